@@ -1,22 +1,245 @@
-from flask import Flask, Response, request
+from flask import Flask, Response, g, request
 from flask_cors import CORS
-from middleware.security.security import Security
+from middleware.security.security import Security, token_cache, LOGIN_NOT_REQUIRED_PATHS
+from middleware import metrics
+from middleware.rate_limit import create_rate_limiter, LoadShedder, READ, WRITE, READ_METHODS
+from decimal import Decimal
 from http import HTTPStatus
+import hashlib
 import json
 import logging
+import math
+import os
+import time
 
-from database_services import dynamodb_service as db
+from database_services.base_data_resource import BaseDataException, create_data_resource, COMMENT_FIELDS, \
+    ALL_RESPONSES, ChangesExpiredException, CapacityExceededException, ScanInterruptedException, IdempotencyKey
 from database_services import dynamodb_errors as e
+from database_services.write_behind import WriteBehindQueue
+from application_services.art_catalog_comment_response_resource import ArtCatalogCommentResponseResource
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger()
 
 application = app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["ETag", "Retry-After", "Idempotent-Replayed"])
 
+# "dynamodb" (default) or "memory"; see database_services/base_data_resource.py
+db = create_data_resource(os.environ.get("STORAGE_ENGINE", "dynamodb"))
 
-def form_response_json(status, result):
-    return json.dumps({"status": status, "result": result}, default=str)
+# WRITE_BEHIND=true queues posted comments and responses and writes them in batches;
+# see database_services/write_behind.py for what that means for durability.
+write_queue = WriteBehindQueue(
+    db,
+    max_size=int(os.environ.get("WRITE_BEHIND_QUEUE_SIZE", 10000)),
+    batch_size=int(os.environ.get("WRITE_BEHIND_BATCH_SIZE", 100)),
+    linger=float(os.environ.get("WRITE_BEHIND_LINGER_MS", 50)) / 1000,
+    drain_timeout=float(os.environ.get("WRITE_BEHIND_DRAIN_TIMEOUT", 10)),
+) if os.environ.get("WRITE_BEHIND", "false").lower() == "true" else None
+
+# Per-user read and write budgets: RATE_LIMIT_BACKEND is "none" (default), "memory" (per worker)
+# or sqlite:///path (shared by the workers of a host); see middleware/rate_limit.py.
+rate_limiter = create_rate_limiter(
+    os.environ.get("RATE_LIMIT_BACKEND", "none"),
+    budgets={
+        READ: (float(os.environ.get("RATE_LIMIT_READS_PER_SECOND", 10)),
+               float(os.environ.get("RATE_LIMIT_READ_BURST", 50))),
+        WRITE: (float(os.environ.get("RATE_LIMIT_WRITES_PER_SECOND", 1)),
+                float(os.environ.get("RATE_LIMIT_WRITE_BURST", 10))),
+    },
+)
+load_shedder = LoadShedder()
+
+# Multi-item reads for catalog pages (GET /api/comments?item_ids=): items are read in parallel on
+# CATALOG_READ_WORKERS threads per worker, and a response holds at most CATALOG_MAX_RESPONSE_BYTES.
+catalog = ArtCatalogCommentResponseResource(
+    db,
+    max_workers=int(os.environ.get("CATALOG_READ_WORKERS", 8)),
+    max_payload_bytes=int(os.environ.get("CATALOG_MAX_RESPONSE_BYTES", 1024 * 1024)),
+    on_capacity_exceeded=lambda err: record_throttle(),
+)
+# comments per item in a multi-item read: default and most
+DEFAULT_PER_ITEM = 5
+MAX_PER_ITEM = 50
+
+# how long a post's Idempotency-Key is remembered
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", 24 * 3600))
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+metrics.set_gauge(metrics.ADMISSION_LEVEL, load_shedder.level)
+
+
+def json_default(value):
+    """
+    DynamoDB returns numbers as Decimal; send them as JSON numbers rather than strings.
+    """
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return str(value)
+
+
+def form_response_json(status, result, **extra):
+    return json.dumps({"status": status, "result": result, **extra}, default=json_default)
+
+
+def parse_page_args(args):
+    """
+    Reads the limit and order query params shared by paginated listings.
+    Returns (limit, ascending), or None if either param is invalid.
+    """
+    try:
+        limit = int(args.get("limit", db.DEFAULT_PAGE_LIMIT))
+    except ValueError:
+        return None
+    order = args.get("order", "asc")
+    if limit < 1 or limit > db.MAX_PAGE_LIMIT or order not in ("asc", "desc"):
+        return None
+    return limit, order == "asc"
+
+
+def parse_projection_args(args):
+    """
+    Reads the fields and include_responses query params of comment reads.
+        * fields: comma-separated comment attributes (see COMMENT_FIELDS); all of them by default.
+        * include_responses: all (default), none, count or first:N.
+    Returns (fields, include_responses), or None if either param is invalid.
+    """
+    fields = None
+    if "fields" in args:
+        fields = {field.strip() for field in args["fields"].split(",") if field.strip()}
+        if not fields or not fields <= COMMENT_FIELDS:
+            return None
+
+    include = args.get("include_responses", "all")
+    if include in ("all", "none", "count"):
+        return fields, (include, None)
+    if include.startswith("first:"):
+        try:
+            first = int(include[len("first:"):])
+        except ValueError:
+            return None
+        if 1 <= first <= db.MAX_PAGE_LIMIT:
+            return fields, ("first", first)
+    return None
+
+
+def hide_unrequested(comment, fields):
+    """
+    Drops version_id from a projected comment unless it was asked for; reads keep it for the ETag.
+    """
+    if fields is not None and "version_id" not in fields:
+        comment.pop("version_id", None)
+    return comment
+
+
+def thread_etag(comment, variant=""):
+    """
+    The ETag of a comment with its responses: the comment's version_id, then a digest of its
+    responses' version_ids and response_count, so posting, editing or deleting a response changes it too.
+    variant names the projection, so each representation of a comment has its own ETag.
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    for response in comment.get("responses", []):
+        digest.update(response["version_id"].encode("utf-8"))
+    digest.update(f"|{comment.get('response_count', '')}|{variant}".encode("utf-8"))
+    return f"{comment['version_id']}.{digest.hexdigest()}"
+
+
+def list_etag(versions, next_cursor):
+    """
+    A weak ETag for one page of a listing: a digest of its records' versions and of next_cursor.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for version in versions:
+        digest.update(version.encode("utf-8") + b"\0")
+    digest.update((next_cursor or "").encode("utf-8"))
+    return digest.hexdigest()
+
+
+def conditional_response(etag, render, weak=False):
+    """
+    Answers If-None-Match with 304 when etag matches; render, which builds the JSON body,
+    is only called when the body is actually sent.
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=HTTPStatus.NOT_MODIFIED)
+    else:
+        response = Response(render(), status=HTTPStatus.OK, content_type="application/json")
+    response.set_etag(etag, weak=weak)
+    return response
+
+
+def write_version(request_base_info):
+    """
+    The optimistic-concurrency token of a write: the If-Match header if there is one, else the
+    old_version_id body param. Returns (from_if_match, version_id); version_id is None for
+    If-Match: * or when neither is given. A thread ETag names the comment's version_id;
+    the response digest after the dot is ignored.
+    Raises ValueError unless If-Match is * or exactly one strong ETag.
+    """
+    if not request.if_match:
+        return False, request_base_info.get("old_version_id", None)
+    if request.if_match.star_tag:
+        return True, None
+    tags = request.if_match.as_set()
+    if len(tags) != 1:
+        raise ValueError("If-Match must name exactly one strong ETag")
+    return True, tags.pop().split(".", 1)[0]
+
+
+def write_error_response(error, message, from_if_match):
+    """
+    A failed write; a version conflict detected through If-Match is a 412 rather than a 409.
+    """
+    status = e.error_status_mappings[error]
+    if from_if_match and error == e.DynmamoDBErrors.WRITE_WRITE_CONFLICT:
+        status = HTTPStatus.PRECONDITION_FAILED
+    return Response(
+        form_response_json(f"invalid request - {message}", None),
+        status=status,
+        content_type="application/json",
+    )
+
+
+def retry_later_response(message, status, retry_after):
+    """
+    An error response with a Retry-After header of retry_after seconds, rounded up to at least 1.
+    """
+    response = Response(
+        form_response_json(message, None),
+        status=status,
+        content_type="application/json",
+    )
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def queued_write_response(accepted, ids):
+    """
+    202 with the new record's ids once the write-behind queue has taken it,
+    or 503 with Retry-After if the queue is full.
+    """
+    if not accepted:
+        return retry_later_response("unavailable - write queue full, please retry",
+                                    HTTPStatus.SERVICE_UNAVAILABLE, 1)
+    return Response(
+        form_response_json("accepted", ids),
+        status=HTTPStatus.ACCEPTED,
+        content_type="application/json",
+    )
+
+
+@application.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@application.after_request
+def record_request_latency(response):
+    if "request_start" in g:
+        metrics.observe(metrics.HTTP_REQUEST_SECONDS, time.perf_counter() - g.request_start,
+                        route=request.url_rule.rule if request.url_rule else "unmatched",
+                        method=request.method, status=response.status_code)
+    return response
 
 
 @application.before_request
@@ -29,33 +252,192 @@ def verify_oauth_token():
     for holding any data you want during a single request.
     """
     if request.method != 'OPTIONS':
-        return Security.verify_token(request)
+        start = time.perf_counter()
+        try:
+            return Security.verify_token(request)
+        finally:
+            metrics.observe(metrics.AUTH_SECONDS, time.perf_counter() - start)
     else:
         return None
 
 
+def idempotency_key(body):
+    """
+    The request's Idempotency-Key header, scoped to the signed-in user and fingerprinted with the
+    method, path and JSON body; None if there is none. Raises ValueError for an empty or overlong key.
+    """
+    key = request.headers.get("Idempotency-Key")
+    if key is None:
+        return None
+    if not key or len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise ValueError("invalid Idempotency-Key")
+    fingerprint = hashlib.sha256(
+        json.dumps([request.method, request.path, body], sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+    return IdempotencyKey(f"{getattr(g, 'google_user_id', '')}:{key}", fingerprint, IDEMPOTENCY_TTL_SECONDS)
+
+
+def posted_response(error, result, idempotency):
+    """
+    200 with the posted comment or response, marked Idempotent-Replayed if an Idempotency-Key
+    returned the result of an earlier request; the engine's error status otherwise.
+    """
+    if error is not None:
+        return Response(
+            form_response_json(f"invalid request - {result}", None),
+            status=e.error_status_mappings[error],
+            content_type="application/json",
+        )
+    response = Response(
+        form_response_json("success", result),
+        status=HTTPStatus.OK,
+        content_type="application/json",
+    )
+    if idempotency is not None and idempotency.replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+@application.before_request
+def admit_request():
+    """
+    Admission control, run after verify_oauth_token. While DynamoDB is throttling, the worker
+    turns away part of its requests with 503; past that, a user who has spent their read
+    (GET) or write budget gets 429. Both carry Retry-After.
+    """
+    if request.method == "OPTIONS" or request.endpoint in LOGIN_NOT_REQUIRED_PATHS:
+        return None
+
+    retry_after = load_shedder.admit()
+    if retry_after:
+        metrics.inc(metrics.SHED_REQUESTS)
+        return retry_later_response("unavailable - over capacity, please retry",
+                                    HTTPStatus.SERVICE_UNAVAILABLE, retry_after)
+
+    user_id = getattr(g, "google_user_id", None)
+    if rate_limiter is None or user_id is None:
+        return None
+    kind = READ if request.method in READ_METHODS else WRITE
+    retry_after = rate_limiter.check(user_id, kind)
+    if retry_after:
+        metrics.inc(metrics.RATE_LIMITED_REQUESTS, kind=kind)
+        return retry_later_response(f"too many requests - {kind} limit reached",
+                                    HTTPStatus.TOO_MANY_REQUESTS, retry_after)
+    return None
+
+
+def record_throttle():
+    """
+    Counts a DynamoDB call that was still throttled after the client's retries and sheds more load.
+    """
+    load_shedder.record_throttle()
+    metrics.inc(metrics.DYNAMODB_THROTTLES)
+
+
+@app.errorhandler(CapacityExceededException)
+def capacity_exceeded(err):
+    """
+    DynamoDB was still throttling after the client's retries: shed more load (see admit_request)
+    and ask the client to come back later, rather than failing as if the request were wrong.
+    """
+    record_throttle()
+    return retry_later_response(f"unavailable - {err}", HTTPStatus.SERVICE_UNAVAILABLE, 1)
+
 
 @app.route("/")
 def health_check():
     return "Hello World"
 
 
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """
+    Request latency, token verification time and DynamoDB time, calls and consumed capacity,
+    in the Prometheus text format. Not behind login, so it can be scraped.
+    """
+    return Response(metrics.render(), status=HTTPStatus.OK, content_type="text/plain; version=0.0.4")
+
+
 @app.route("/api/items/<string:item_id>/comments", methods=["GET", "POST"], strict_slashes=False)
 def get_post_item_comments(item_id):
     """
     Main query param: item_id
-    GET -- gets all comments under a given item ID
-        * Does not expect any other params.
+    GET -- gets one page of comments under a given item ID, ordered by time.
+        * Optional query params: limit (default 50, max 200), order (asc|desc), cursor.
+        * The envelope carries next_cursor; pass it back as cursor to get the next page.
+        * Optional query params fields (comma-separated comment attributes) and
+          include_responses (all|none|count|first:N); only the requested attributes are read.
+        * 400 if limit/order/cursor/fields/include_responses are invalid.
+        * Sends a weak ETag; 304 if it matches If-None-Match.
+        * The envelope also carries next_since, a token for polling the item's changes (below).
+    GET with since -- gets what changed under the item after a since token, oldest change first.
+        * Each entry is a comment or response with "type" and "deleted": false (comments without
+          their responses), or a tombstone {type, comment_id, [response_id], deleted: true}.
+        * The envelope carries next_since for the next poll, and more=true if there are further
+          changes to fetch right away. A change may be reported more than once.
+        * Optional query param limit; 400 if since is malformed.
+        * 410 if since is older than the change history; fetch the comments again.
     POST -- adds a new comment under a given item ID.
         * Expects a JSON body in the request, consisting of the following keys: user_id, comment_text
         * POST issues a 400 error if these keys are missing from the body.
+        * Returns the new comment.
+        * Optional Idempotency-Key header: a retry with the same key and body returns the first
+          request's comment (with Idempotent-Replayed: true) instead of posting again; the same key
+          with a different body gets 422. Keys are kept for IDEMPOTENCY_TTL_SECONDS.
+        * With WRITE_BEHIND=true: 202 with the new comment_id once queued, 503 if the queue is full.
+          Posts with an Idempotency-Key are written right away.
     """
     if request.method == "GET":
-        result = db.get_comments_by_item_id(item_id)
-        return Response(
-            form_response_json("done", result),
-            status=HTTPStatus.OK,
-            content_type="application/json",
+        page_args = parse_page_args(request.args)
+        projection_args = parse_projection_args(request.args)
+        if page_args is None or projection_args is None:
+            return Response(
+                form_response_json("bad request - limit/order/fields/include_responses", None),
+                status=HTTPStatus.BAD_REQUEST,
+                content_type="application/json",
+            )
+        limit, ascending = page_args
+        fields, include_responses = projection_args
+
+        if "since" in request.args:
+            try:
+                changes, next_since, more = db.get_item_changes(item_id, request.args["since"], limit)
+            except ChangesExpiredException as err:
+                return Response(
+                    form_response_json(f"gone - {err.msg}", None),
+                    status=HTTPStatus.GONE,
+                    content_type="application/json",
+                )
+            except BaseDataException as err:
+                return Response(
+                    form_response_json(f"bad request - {err.msg}", None),
+                    status=HTTPStatus.BAD_REQUEST,
+                    content_type="application/json",
+                )
+            return Response(
+                form_response_json("done", changes, next_since=next_since, more=more),
+                status=HTTPStatus.OK,
+                content_type="application/json",
+            )
+
+        # taken before reading, so polling from it can only repeat changes, never miss them
+        next_since = db.changes_token()
+        try:
+            result, next_cursor = db.get_comments_by_item_id(item_id, limit, request.args.get("cursor"), ascending,
+                                                             fields, include_responses)
+        except BaseDataException as err:
+            return Response(
+                form_response_json(f"bad request - {err.msg}", None),
+                status=HTTPStatus.BAD_REQUEST,
+                content_type="application/json",
+            )
+        variant = f"{sorted(fields) if fields is not None else ''}|{include_responses}"
+        etag = list_etag([thread_etag(comment, variant) for comment in result], next_cursor)
+        result = [hide_unrequested(comment, fields) for comment in result]
+        return conditional_response(
+            etag,
+            lambda: form_response_json("done", result, next_cursor=next_cursor, next_since=next_since),
+            weak=True,
         )
     elif request.method == "POST":
         request_base_info = request.get_json()
@@ -69,13 +451,223 @@ def get_post_item_comments(item_id):
                 content_type="application/json",
             )
 
-        result = db.post_comment(item_id, user_id, comment_text)
+        try:
+            idempotency = idempotency_key(request_base_info)
+        except ValueError:
+            return Response(
+                form_response_json("bad request - Idempotency-Key", None),
+                status=HTTPStatus.BAD_REQUEST,
+                content_type="application/json",
+            )
+
+        if write_queue is not None and idempotency is None:
+            comment = db.new_comment(item_id, user_id, comment_text)
+            return queued_write_response(write_queue.submit_comment(comment), {"comment_id": comment["comment_id"]})
+
+        error, result = db.post_comment(item_id, user_id, comment_text, idempotency)
+        return posted_response(error, result, idempotency)
+
+
+@app.route("/api/items/<string:item_id>/comments/summary", methods=["GET"], strict_slashes=False)
+def get_item_comments_summary(item_id):
+    """
+    Gets the comment aggregates of one item: comment_count, response_count, last_activity
+    and latest_comment_ids (newest first). An item without comments has zero counts.
+    """
+    return Response(
+        form_response_json("done", db.get_item_summary(item_id)),
+        status=HTTPStatus.OK,
+        content_type="application/json",
+    )
+
+
+@app.route("/api/items/comments/summary", methods=["GET"], strict_slashes=False)
+def get_items_comments_summaries():
+    """
+    Gets the comment aggregates of up to 100 items in one round trip, in request order.
+        * Expects the query param item_ids: a comma-separated list of item IDs.
+        * 400 if item_ids is missing or lists more than 100 items.
+        * 503 if the summaries could not be read.
+    """
+    item_ids = [i for i in request.args.get("item_ids", "").split(",") if i]
+    if not item_ids or len(item_ids) > db.MAX_BATCH_SIZE:
+        return Response(
+            form_response_json("bad request - item_ids", None),
+            status=HTTPStatus.BAD_REQUEST,
+            content_type="application/json",
+        )
+
+    try:
+        result = db.get_item_summaries(item_ids)
+    except BaseDataException as err:
         return Response(
-            form_response_json("success", None), # TODO: What to return here?
+            form_response_json(err.msg, None),
+            status=HTTPStatus.SERVICE_UNAVAILABLE,
+            content_type="application/json",
+        )
+    return Response(
+        form_response_json("done", result),
+        status=HTTPStatus.OK,
+        content_type="application/json",
+    )
+
+
+@app.route("/api/users/<string:user_id>/comments", methods=["GET"], strict_slashes=False)
+def get_user_comments(user_id):
+    """
+    Gets one page of the comments a user has posted, ordered by time, from the commenter index.
+        * Optional query params as for the item listing: limit, order, cursor, fields, include_responses.
+        * The envelope carries next_cursor; with explain=true, also the access path taken and
+          the items it examined.
+        * 400 if limit/order/cursor/fields/include_responses are invalid.
+        * Sends a weak ETag; 304 if it matches If-None-Match.
+    """
+    page_args = parse_page_args(request.args)
+    projection_args = parse_projection_args(request.args)
+    if page_args is None or projection_args is None:
+        return Response(
+            form_response_json("bad request - limit/order/fields/include_responses", None),
+            status=HTTPStatus.BAD_REQUEST,
+            content_type="application/json",
+        )
+    limit, ascending = page_args
+    fields, include_responses = projection_args
+
+    try:
+        result, next_cursor, explain = db.find_comments({"commenter_id": user_id}, limit, request.args.get("cursor"),
+                                                        ascending, fields, include_responses)
+    except BaseDataException as err:
+        return Response(
+            form_response_json(f"bad request - {err.msg}", None),
+            status=HTTPStatus.BAD_REQUEST,
+            content_type="application/json",
+        )
+    extra = {"explain": explain} if request.args.get("explain", "false").lower() == "true" else {}
+    variant = f"{sorted(fields) if fields is not None else ''}|{include_responses}"
+    etag = list_etag([thread_etag(comment, variant) for comment in result], next_cursor)
+    result = [hide_unrequested(comment, fields) for comment in result]
+    return conditional_response(
+        etag,
+        lambda: form_response_json("done", result, next_cursor=next_cursor, **extra),
+        weak=True,
+    )
+
+
+@app.route("/api/comments", methods=["GET", "POST"], strict_slashes=False)
+def batch_get_post_comments():
+    """
+    Batch versions of the single-comment routes; each returns one entry per requested comment,
+    with its own status code, in request order.
+    GET -- gets up to 100 comments by ID in one round trip.
+        * Expects the query param comment_ids: a comma-separated list of comment IDs.
+        * Comments are returned without their responses (response_count is included).
+        * Entry status: 200, 404 if the comment does not exist, 503 if it could not be read.
+    GET with item_ids -- gets the newest comments of up to 100 items in one round trip, e.g. for a
+    catalog page; the items are read in parallel.
+        * Expects the query param item_ids: a comma-separated list of item IDs.
+        * Optional query params per_item (comments per item, default 5, max 50), order (asc|desc,
+          default desc), fields and include_responses, as for the item listing.
+        * One entry per item, {item_id, status, result, next_cursor}; next_cursor continues the
+          item's listing at /api/items/<item_id>/comments.
+        * Entry status: 200, 503 if the item could not be read, 413 for the items that did not fit
+          in CATALOG_MAX_RESPONSE_BYTES; read those on their own.
+    POST -- posts up to 100 new comments in one round trip.
+        * Expects a JSON body {"comments": [{"item_id", "user_id", "comment_text"}, ...]}
+        * Entry status: 200, 400 if the entry is missing keys, 503 if it could not be written.
+        * 400 with an Idempotency-Key header: entries are written independently, so retry the
+          entries that got 503 instead.
+    Both methods return 400 if the batch is missing, empty or larger than 100 entries.
+    """
+    if request.method == "GET" and "item_ids" in request.args:
+        return get_comments_for_items()
+
+    if request.method == "GET":
+        comment_ids = [c for c in request.args.get("comment_ids", "").split(",") if c]
+        if not comment_ids or len(comment_ids) > db.MAX_BATCH_SIZE:
+            return Response(
+                form_response_json("bad request - comment_ids", None),
+                status=HTTPStatus.BAD_REQUEST,
+                content_type="application/json",
+            )
+
+        result = [
+            {"comment_id": comment_id, "status": HTTPStatus.OK, "result": comment} if error is None else
+            {"comment_id": comment_id, "status": e.error_status_mappings[error], "result": None, "message": comment}
+            for comment_id, error, comment in db.batch_fetch_comments(comment_ids)
+        ]
+        return Response(
+            form_response_json("done", result),
             status=HTTPStatus.OK,
             content_type="application/json",
         )
 
+    if "Idempotency-Key" in request.headers:
+        return Response(
+            form_response_json("bad request - Idempotency-Key is not supported on batch posts", None),
+            status=HTTPStatus.BAD_REQUEST,
+            content_type="application/json",
+        )
+
+    request_base_info = request.get_json()
+    comments = request_base_info.get("comments", None) if isinstance(request_base_info, dict) else None
+    if not isinstance(comments, list) or not comments or len(comments) > db.MAX_BATCH_SIZE:
+        return Response(
+            form_response_json("bad request - comments", None),
+            status=HTTPStatus.BAD_REQUEST,
+            content_type="application/json",
+        )
+
+    result = [None] * len(comments)
+    valid = []
+    for index, entry in enumerate(comments):
+        entry = entry if isinstance(entry, dict) else {}
+        item_id, user_id, comment_text = entry.get("item_id"), entry.get("user_id"), entry.get("comment_text")
+        if item_id is None or user_id is None or comment_text is None:
+            result[index] = {"status": HTTPStatus.BAD_REQUEST, "result": None,
+                             "message": "bad request - item/user/comment"}
+        else:
+            valid.append((index, (str(item_id), user_id, comment_text)))
+
+    for (index, _), (error, comment) in zip(valid, db.batch_post_comments([entry for _, entry in valid])):
+        result[index] = {"status": HTTPStatus.OK, "result": comment} if error is None else \
+            {"status": e.error_status_mappings[error], "result": None, "message": comment}
+    return Response(
+        form_response_json("done", result),
+        status=HTTPStatus.OK,
+        content_type="application/json",
+    )
+
+
+def get_comments_for_items():
+    """
+    GET /api/comments with item_ids; see batch_get_post_comments.
+    """
+    item_ids = [i for i in request.args.get("item_ids", "").split(",") if i]
+    projection_args = parse_projection_args(request.args)
+    try:
+        per_item = int(request.args.get("per_item", DEFAULT_PER_ITEM))
+    except ValueError:
+        per_item = None
+    order = request.args.get("order", "desc")
+    if (not item_ids or len(item_ids) > db.MAX_BATCH_SIZE or "comment_ids" in request.args or per_item is None
+            or not 1 <= per_item <= MAX_PER_ITEM or order not in ("asc", "desc") or projection_args is None):
+        return Response(
+            form_response_json("bad request - item_ids/per_item/order/fields/include_responses", None),
+            status=HTTPStatus.BAD_REQUEST,
+            content_type="application/json",
+        )
+    fields, include_responses = projection_args
+
+    result = catalog.retrieve_comments_for_items(item_ids, per_item, order == "asc", fields, include_responses)
+    for entry in result:
+        if entry["result"] is not None:
+            entry["result"] = [hide_unrequested(comment, fields) for comment in entry["result"]]
+    return Response(
+        form_response_json("done", result),
+        status=HTTPStatus.OK,
+        content_type="application/json",
+    )
+
 
 @app.route("/api/comments/<string:comment_id>", methods=["GET", "POST", "PUT", "DELETE"], strict_slashes=False)
 def get_update_delete_single_comments(comment_id):
@@ -84,27 +676,53 @@ def get_update_delete_single_comments(comment_id):
     All methods require the item ID and the comment ID in the query params.
     GET -- gets a comment with a given comment ID.
         * 404 if the given comment ID does not exist.
+        * Optional query params fields and include_responses, as for the item listing.
+        * Sends an ETag that changes whenever the comment or one of its responses changes;
+          304 if it matches If-None-Match.
     POST -- posts a response under the given comment ID.
         * Expects a JSON body in the request, consisting of the following keys: user_id, response_text
         * 400 if the necessary JSON body params are not provided.
         * 404 for other errors
+        * Returns the new response. Optional Idempotency-Key header, as for posting a comment.
+        * With WRITE_BEHIND=true: 202 with the new response_id once queued, 503 if the queue is full;
+          the comment is only checked when the response is written. Posts with an Idempotency-Key
+          are written right away.
     PUT -- updates a comment with the given comment ID.
         * Expects a JSON body in the request, consisting of the following keys: user_id, old_version_id, new_comment_text.
+        * Instead of old_version_id, an If-Match header with the comment's ETag (or *) may be sent.
         * 400 if the necessary JSON body params are not provided.
-        * 409 for a Write-Write conflict
+        * 409 for a Write-Write conflict (412 when the version came from If-Match)
         * 403/404 for other errors.
     DELETE -- deletes a comment with the given ID
         * Expects a JSON body in the request, consisting of the following keys: user_id
+        * Optional JSON body key old_version_id or If-Match header; the delete only happens
+          if it is still the current version.
         * 400 if the necessary JSON body params are not provided.
+        * 409 for a Write-Write conflict (412 when the version came from If-Match)
         * 403/404 for other errors
     """
     if request.method == "GET":
-        result = db.fetch_comment_by_id(comment_id)
-        return Response(
-            form_response_json("success" if result is not None else "not found", result),
-            status=HTTPStatus.OK if result is not None else HTTPStatus.NOT_FOUND,
-            content_type="application/json",
-        )
+        projection_args = parse_projection_args(request.args)
+        if projection_args is None:
+            return Response(
+                form_response_json("bad request - fields/include_responses", None),
+                status=HTTPStatus.BAD_REQUEST,
+                content_type="application/json",
+            )
+        fields, include_responses = projection_args
+
+        result = db.fetch_comment_by_id(comment_id, fields, include_responses)
+        if result is None:
+            return Response(
+                form_response_json("not found", result),
+                status=HTTPStatus.NOT_FOUND,
+                content_type="application/json",
+            )
+        variant = "" if projection_args == (None, ALL_RESPONSES) else \
+            f"{sorted(fields) if fields is not None else ''}|{include_responses}"
+        etag = thread_etag(result, variant)
+        result = hide_unrequested(result, fields)
+        return conditional_response(etag, lambda: form_response_json("success", result))
     elif request.method == "POST":
         request_base_info = request.get_json()
         user_id = request_base_info.get("user_id", None)
@@ -117,20 +735,37 @@ def get_update_delete_single_comments(comment_id):
                 content_type="application/json",
             )
 
-        result = db.add_response(comment_id, user_id, response_text)
-        return Response(
-            form_response_json("success", None),  # TODO: What to return here?
-            status=HTTPStatus.OK,
-            content_type="application/json",
-        )
+        try:
+            idempotency = idempotency_key(request_base_info)
+        except ValueError:
+            return Response(
+                form_response_json("bad request - Idempotency-Key", None),
+                status=HTTPStatus.BAD_REQUEST,
+                content_type="application/json",
+            )
+
+        if write_queue is not None and idempotency is None:
+            response = db.new_response(comment_id, user_id, response_text)
+            return queued_write_response(write_queue.submit_response(response),
+                                         {"comment_id": comment_id, "response_id": response["response_id"]})
+
+        error, result = db.add_response(comment_id, user_id, response_text, idempotency)
+        return posted_response(error, result, idempotency)
 
     elif request.method == "PUT":
         request_base_info = request.get_json()
         user_id = request_base_info.get("user_id", None)
-        old_version_id = request_base_info.get("old_version_id", None)
         new_comment_text = request_base_info.get("new_comment_text", None)
+        try:
+            from_if_match, old_version_id = write_version(request_base_info)
+        except ValueError:
+            return Response(
+                form_response_json("bad request - If-Match", None),
+                status=HTTPStatus.BAD_REQUEST,
+                content_type="application/json",
+            )
 
-        if user_id is None or old_version_id is None or new_comment_text is None:
+        if user_id is None or (old_version_id is None and not from_if_match) or new_comment_text is None:
             return Response(
                 form_response_json("bad request - user/version/comment", None),
                 status=HTTPStatus.BAD_REQUEST,
@@ -139,11 +774,7 @@ def get_update_delete_single_comments(comment_id):
 
         result = db.update_comment(comment_id, old_version_id, user_id, new_comment_text)
         if result[0] is not None:
-            return Response(
-                form_response_json(f"invalid request - {result[1]}", None),
-                status=e.error_status_mappings[result[0]],
-                content_type="application/json",
-            )
+            return write_error_response(result[0], result[1], from_if_match)
         else:
             return Response(
                 form_response_json("success", None), # TODO: What to return here?
@@ -161,14 +792,18 @@ def get_update_delete_single_comments(comment_id):
                 status=HTTPStatus.BAD_REQUEST,
                 content_type="application/json",
             )
-
-        result = db.delete_comment(comment_id, user_id)
-        if result[0] is not None:
+        try:
+            from_if_match, old_version_id = write_version(request_base_info)
+        except ValueError:
             return Response(
-                form_response_json(f"invalid request - {result[1]}", None),
-                status=e.error_status_mappings[result[0]],
+                form_response_json("bad request - If-Match", None),
+                status=HTTPStatus.BAD_REQUEST,
                 content_type="application/json",
             )
+
+        result = db.delete_comment(comment_id, user_id, old_version_id)
+        if result[0] is not None:
+            return write_error_response(result[0], result[1], from_if_match)
         else:
             return Response(
                 form_response_json("success", None), # TODO: What to return here?
@@ -177,6 +812,39 @@ def get_update_delete_single_comments(comment_id):
             )
 
 
+@app.route("/api/comments/<string:comment_id>/responses", methods=["GET"], strict_slashes=False)
+def get_comment_responses(comment_id):
+    """
+    Gets one page of the responses under a comment, oldest first.
+        * Optional query params: limit (default 50, max 200), cursor.
+        * The envelope carries next_cursor; pass it back as cursor to get the next page.
+        * 400 if limit/cursor are invalid.
+        * Sends a weak ETag; 304 if it matches If-None-Match.
+    """
+    page_args = parse_page_args(request.args)
+    if page_args is None:
+        return Response(
+            form_response_json("bad request - limit", None),
+            status=HTTPStatus.BAD_REQUEST,
+            content_type="application/json",
+        )
+    limit, _ = page_args
+
+    try:
+        result, next_cursor = db.fetch_responses_page(comment_id, limit, request.args.get("cursor"))
+    except BaseDataException as err:
+        return Response(
+            form_response_json(f"bad request - {err.msg}", None),
+            status=HTTPStatus.BAD_REQUEST,
+            content_type="application/json",
+        )
+    return conditional_response(
+        list_etag([response["version_id"] for response in result], next_cursor),
+        lambda: form_response_json("done", result, next_cursor=next_cursor),
+        weak=True,
+    )
+
+
 @app.route("/api/comments/<string:comment_id>/responses/<string:response_id>", methods=["GET", "PUT", "DELETE"],
            strict_slashes=False)
 def update_delete_single_responses(comment_id, response_id):
@@ -188,9 +856,13 @@ def update_delete_single_responses(comment_id, response_id):
         * 403 if the user is invalid
         * 404 if the given comment/response cannot be found.
     GET -- Retrieve a single response.
+        * Sends the response's version_id as its ETag; 304 if it matches If-None-Match.
     PUT -- Updates a response.
         * Requires additional JSON body params: new_response_text and old_version_id
+          (or an If-Match header with the response's ETag, or *)
     DELETE -- Deletes a response.
+        * Optional JSON body param old_version_id or If-Match header; 409 if the response has changed since
+          (412 when the version came from If-Match).
     """
     if request.method == "GET":
         result = db.fetch_single_response(comment_id, response_id)
@@ -202,18 +874,21 @@ def update_delete_single_responses(comment_id, response_id):
                 content_type="application/json",
             )
         else:
-            return Response(
-                form_response_json("success", result),
-                status=HTTPStatus.OK,
-                content_type="application/json",
-            )
+            return conditional_response(result[1]["version_id"], lambda: form_response_json("success", result))
     elif request.method == "PUT":
         request_base_info = request.get_json()
         user_id = request_base_info.get("user_id", None)
         new_response_text = request_base_info.get("new_response_text", None)
-        old_version_id = request_base_info.get("old_version_id", None)
+        try:
+            from_if_match, old_version_id = write_version(request_base_info)
+        except ValueError:
+            return Response(
+                form_response_json("bad request - If-Match", None),
+                status=HTTPStatus.BAD_REQUEST,
+                content_type="application/json",
+            )
 
-        if user_id is None or new_response_text is None or old_version_id is None:
+        if user_id is None or new_response_text is None or (old_version_id is None and not from_if_match):
             return Response(
                 form_response_json("bad request - user/response_text", None),
                 status=HTTPStatus.BAD_REQUEST,
@@ -232,15 +907,19 @@ def update_delete_single_responses(comment_id, response_id):
                 status=HTTPStatus.BAD_REQUEST,
                 content_type="application/json",
             )
+        try:
+            from_if_match, old_version_id = write_version(request_base_info)
+        except ValueError:
+            return Response(
+                form_response_json("bad request - If-Match", None),
+                status=HTTPStatus.BAD_REQUEST,
+                content_type="application/json",
+            )
 
-        result = db.delete_response(comment_id, response_id, user_id)
+        result = db.delete_response(comment_id, response_id, user_id, old_version_id)
 
     if result[0] is not None:
-        return Response(
-            form_response_json(f"invalid request - {result[1]}", None),
-            status=e.error_status_mappings[result[0]],
-            content_type="application/json",
-        )
+        return write_error_response(result[0], result[1], from_if_match)
     else:
         return Response(
             form_response_json("success", None),  # TODO: What to return here?
@@ -249,5 +928,99 @@ def update_delete_single_responses(comment_id, response_id):
         )
 
 
+@app.route("/api/admin/comments", methods=["GET"], strict_slashes=False)
+def admin_list_comments():
+    """
+    Lists comments across all items. Only available to users in ADMIN_USER_IDS (403 otherwise).
+    Query params:
+        * mode -- "page" (default) returns one page and a next_cursor in the envelope;
+                  "stream" streams every comment from the cursor onwards as NDJSON, then a last
+                  {"status", "next_cursor"} line; a stream cut short by DynamoDB gives the cursor to resume from.
+        * limit -- page size for mode=page (default 50, max 200).
+        * cursor -- continuation cursor from a previous page.
+    """
+    if not Security.is_admin():
+        return Response(
+            form_response_json("forbidden - admin only", None),
+            status=HTTPStatus.FORBIDDEN,
+            content_type="application/json",
+        )
+
+    mode = request.args.get("mode", "page")
+    page_args = parse_page_args(request.args)
+    if page_args is None or mode not in ("page", "stream"):
+        return Response(
+            form_response_json("bad request - mode/limit", None),
+            status=HTTPStatus.BAD_REQUEST,
+            content_type="application/json",
+        )
+    limit, _ = page_args
+    cursor = request.args.get("cursor")
+
+    try:
+        db.decode_cursor(cursor)
+    except BaseDataException as err:
+        return Response(
+            form_response_json(f"bad request - {err.msg}", None),
+            status=HTTPStatus.BAD_REQUEST,
+            content_type="application/json",
+        )
+
+    if mode == "stream":
+        def generate():
+            # the last line is {"status", "next_cursor"}: done with no cursor, or where to resume with cursor=
+            status, next_cursor = "done", None
+            try:
+                for comment in db.iter_all_comments(cursor=cursor):
+                    yield json.dumps(comment, default=json_default) + "\n"
+            except ScanInterruptedException as err:
+                if isinstance(err.__cause__, CapacityExceededException):
+                    record_throttle()
+                    status = f"unavailable - {err.__cause__}"
+                else:
+                    logger.exception("admin comment stream stopped")
+                    status = "error - the stream stopped early"
+                next_cursor = err.cursor
+            yield json.dumps({"status": status, "next_cursor": next_cursor}) + "\n"
+
+        return Response(generate(), status=HTTPStatus.OK, content_type="application/x-ndjson")
+
+    result, next_cursor = db.fetch_comments_page(limit, cursor)
+    return Response(
+        form_response_json("done", result, next_cursor=next_cursor),
+        status=HTTPStatus.OK,
+        content_type="application/json",
+    )
+
+
+@app.route("/api/admin/stats", methods=["GET"], strict_slashes=False)
+def admin_stats():
+    """
+    Reports in-process cache statistics (hits, misses, evictions), the write-behind queue and
+    admission control for this worker.
+    Only available to users in ADMIN_USER_IDS (403 otherwise).
+    """
+    if not Security.is_admin():
+        return Response(
+            form_response_json("forbidden - admin only", None),
+            status=HTTPStatus.FORBIDDEN,
+            content_type="application/json",
+        )
+
+    return Response(
+        form_response_json("done", {
+            "token_cache": token_cache.stats(),
+            "comment_cache": db.cache_stats(),
+            "write_behind": write_queue.stats() if write_queue is not None else {"mode": "synchronous"},
+            "admission": {
+                "rate_limit": rate_limiter.stats() if rate_limiter is not None else {"backend": "none"},
+                "admission_level": load_shedder.level(),
+            },
+        }),
+        status=HTTPStatus.OK,
+        content_type="application/json",
+    )
+
+
 if __name__ == "__main__":
     application.run(host="0.0.0.0", port=5000)
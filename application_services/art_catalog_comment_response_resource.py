@@ -1,23 +1,106 @@
+import collections
+import concurrent.futures
+import json
+import logging
+from http import HTTPStatus
+
 from application_services.base_application_resource import BaseApplicationResource
-import database_services.dynamodb_service as d_service
+from database_services.base_data_resource import ALL_RESPONSES, CapacityExceededException
+
+logger = logging.getLogger()
 
 
 class ArtCatalogCommentResponseResource(BaseApplicationResource):
+    """
+    Comment reads shaped for the art catalog UI, on top of a storage engine (see base_data_resource).
+    A catalog page shows many artworks at once, so their comments are read in parallel on a pool
+    of max_workers threads shared by every request of the worker.
+    on_capacity_exceeded(err) is called when DynamoDB throttles an item read, which happens on the
+    pool's threads, out of reach of the app's error handlers.
+    """
     table_name = "comments-responses"
 
-    def __init__(self):
+    def __init__(self, db, max_workers=8, max_payload_bytes=1024 * 1024, on_capacity_exceeded=None):
         super().__init__()
+        self.db = db
+        self.max_workers = max_workers
+        self.max_payload_bytes = max_payload_bytes
+        self.on_capacity_exceeded = on_capacity_exceeded
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="catalog")
 
     @classmethod
     def get_links(cls, resource_data):
         pass
 
-    @classmethod
-    def retrieve_all_comments_for_item(cls, item_id):
+    def retrieve_all_comments_for_item(self, item_id):
         """
         Retrieves all comments for an item given an item_id.
         """
-        return None
+        comments, cursor = self.db.get_comments_by_item_id(item_id, self.db.MAX_PAGE_LIMIT)
+        while cursor is not None:
+            page, cursor = self.db.get_comments_by_item_id(item_id, self.db.MAX_PAGE_LIMIT, cursor)
+            comments += page
+        return comments
+
+    def retrieve_comments_for_items(self, item_ids, per_item, ascending=True, fields=None,
+                                    include_responses=ALL_RESPONSES):
+        """
+        Retrieves the first per_item comments of each item, reading up to max_workers items at once.
+        Returns one entry per distinct item id, in request order:
+            {"item_id", "status", "result": comments, "next_cursor"}
+        next_cursor continues the item's listing at /api/items/<item_id>/comments.
+        An item that could not be read gets status 503, and the item whose comments would take the
+        entries past max_payload_bytes (as JSON) and every item after it get status 413, both with
+        result None and a message. No item is read once the budget is spent.
+        """
+        item_ids = list(dict.fromkeys(item_ids))
+        unread = iter(item_ids)
+        reading = collections.deque()
+
+        def read_next():
+            item_id = next(unread, None)
+            if item_id is not None:
+                reading.append(self._pool.submit(self.db.get_comments_by_item_id, item_id, per_item, None,
+                                                 ascending, fields, include_responses))
+
+        for _ in range(self.max_workers):
+            read_next()
+
+        entries = []
+        payload_bytes = 0
+        for item_id in item_ids:
+            entry = self._read_entry(item_id, reading.popleft())
+            if entry["status"] == HTTPStatus.OK:
+                payload_bytes += len(json.dumps(entry, default=str))
+                if payload_bytes > self.max_payload_bytes:
+                    break
+            entries.append(entry)
+            read_next()
+
+        for future in reading:
+            # reads already running finish on their own; their results are not used
+            future.cancel()
+        for item_id in item_ids[len(entries):]:
+            entries.append({"item_id": item_id, "status": HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "result": None,
+                            "message": "response size limit reached - read this item on its own"})
+        return entries
+
+    def _read_entry(self, item_id, future):
+        """
+        The entry for an item read submitted to the pool: its comments, or status 503 if the read failed.
+        """
+        try:
+            comments, next_cursor = future.result()
+        except CapacityExceededException as err:
+            if self.on_capacity_exceeded is not None:
+                self.on_capacity_exceeded(err)
+            return {"item_id": item_id, "status": HTTPStatus.SERVICE_UNAVAILABLE, "result": None,
+                    "message": f"unavailable - {err}"}
+        except Exception:
+            logger.exception(f"catalog read of item {item_id} failed")
+            return {"item_id": item_id, "status": HTTPStatus.SERVICE_UNAVAILABLE, "result": None,
+                    "message": "unavailable - the item's comments could not be read"}
+        return {"item_id": item_id, "status": HTTPStatus.OK, "result": comments, "next_cursor": next_cursor}
 
     @classmethod
     def post_comment(cls, item_id, poster_id, comment_text, in_response_to_comment_id=None):
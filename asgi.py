@@ -0,0 +1,134 @@
+"""
+ASGI entry point for the comment-response service, served by uvicorn workers
+(see gunicorn.conf.py, SERVER_MODE=async).
+
+This is a thread-pool bridge, not non-blocking I/O. The event loop owns the
+sockets, so a worker can hold thousands of open (idle or slow) connections, but
+each request runs the unchanged, synchronous Flask app from application.py on
+one of ASGI_THREADS pool threads, which it holds for all of its blocking boto3
+and tokeninfo calls. So a worker runs at most ASGI_THREADS requests at once,
+like a gthread worker with that many threads, and every request pays a hop from
+the loop to the pool. Routes and response envelopes are identical to the sync
+entry point, application:application.
+"""
+import asyncio
+import functools
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from application import application as flask_application
+
+# Requests running at once per worker; the rest wait on the loop without holding a thread.
+ASGI_THREADS = int(os.environ.get("ASGI_THREADS", 256))
+
+# one pooled DynamoDB connection per pool thread, plus the multi-item and response read pools, as
+# gunicorn.conf.py sets it; for running asgi:application under uvicorn directly. The DynamoDB client
+# is only created on first use, so this still applies after the import above.
+os.environ.setdefault("DYNAMODB_MAX_POOL_CONNECTIONS", str(ASGI_THREADS + int(os.environ.get("CATALOG_READ_WORKERS", 8))
+                                                           + int(os.environ.get("RESPONSE_READ_WORKERS", 8))))
+
+
+class WsgiToAsgi:
+    """
+    Adapts a WSGI app to ASGI by running it on a thread pool.
+    Response bodies are streamed chunk by chunk, so NDJSON streams stay constant-memory.
+    """
+
+    def __init__(self, wsgi_application, max_threads=ASGI_THREADS):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="asgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                # waiting for the pool's threads blocks, so it is done off the loop
+                await asyncio.get_running_loop().run_in_executor(None, functools.partial(self.executor.shutdown,
+                                                                                         wait=True))
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope, receive, send):
+        body = io.BytesIO()
+        more_body = True
+        while more_body:
+            message = await receive()
+            body.write(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body.seek(0)
+
+        loop = asyncio.get_running_loop()
+        environ = self._environ(scope, body)
+        response_start = {}
+
+        def start_response(status, headers, exc_info=None):
+            response_start["status"] = int(status.split(" ", 1)[0])
+            response_start["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                                         for name, value in headers]
+            return lambda data: None
+
+        def next_chunk(iterator):
+            return next(iterator, None)
+
+        result = await loop.run_in_executor(self.executor, self.wsgi_application, environ, start_response)
+        iterator = iter(result)
+        try:
+            chunk = await loop.run_in_executor(self.executor, next_chunk, iterator)
+            await send({"type": "http.response.start", "status": response_start["status"],
+                        "headers": response_start["headers"]})
+            if chunk is None:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+            while chunk is not None:
+                following = await loop.run_in_executor(self.executor, next_chunk, iterator)
+                await send({"type": "http.response.body", "body": chunk, "more_body": following is not None})
+                chunk = following
+        finally:
+            if hasattr(result, "close"):
+                await loop.run_in_executor(self.executor, result.close)
+
+    @staticmethod
+    def _environ(scope, body):
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+            "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+            "REMOTE_ADDR": client[0],
+            "REMOTE_PORT": str(client[1]),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": body,
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False,
+        }
+        for name, value in scope.get("headers", []):
+            name = name.decode("latin-1")
+            value = value.decode("latin-1")
+            if name == "content-type":
+                key = "CONTENT_TYPE"
+            elif name == "content-length":
+                key = "CONTENT_LENGTH"
+            else:
+                key = "HTTP_" + name.upper().replace("-", "_")
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+
+application = WsgiToAsgi(flask_application)
@@ -0,0 +1,783 @@
+"""
+In-memory stand-in for the subset of the boto3 DynamoDB resource API used by
+this service. It evaluates the same expression strings as DynamoDB (conditions,
+updates, projections, key conditions), emulates sparse GSIs, 1 MB pages, Limit,
+parallel scan segments and transactions, and counts every call so benchmarks
+can report DynamoDB round trips per endpoint without AWS credentials.
+"""
+import copy
+import json
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from decimal import Decimal
+from types import SimpleNamespace
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+PAGE_SIZE_BYTES = 1024 * 1024
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+def _client_error(code, message, operation, extra=None):
+    error = {'Error': {'Code': code, 'Message': message}}
+    if extra:
+        error.update(extra)
+    return ClientError(error, operation)
+
+
+def _to_dynamo(value):
+    """
+    Normalises python values the way boto3 does on the way in: ints become
+    Decimal and floats are rejected.
+    """
+    if isinstance(value, bool) or value is None or isinstance(value, (str, bytes, Decimal)):
+        return value
+    if isinstance(value, int):
+        return Decimal(value)
+    if isinstance(value, float):
+        raise TypeError('Float types are not supported. Use Decimal types instead.')
+    if isinstance(value, dict):
+        return {k: _to_dynamo(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_dynamo(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return {_to_dynamo(v) for v in value}
+    return value
+
+
+def _item_size(item):
+    return len(json.dumps(item, default=str))
+
+
+# ---------------------------------------------------------------------------
+# Expression parsing
+# ---------------------------------------------------------------------------
+
+_TOKEN_RE = re.compile(r"\s*(?:(<>|<=|>=|=|<|>|\(|\)|\[|\]|,|\.|\+|-)|(#[A-Za-z0-9_]+)|(:[A-Za-z0-9_]+)|"
+                       r"([0-9]+)|([A-Za-z_][A-Za-z0-9_\-]*))")
+_KEYWORDS = {'AND', 'OR', 'NOT', 'BETWEEN', 'IN', 'SET', 'REMOVE', 'ADD', 'DELETE'}
+
+
+def _tokenize(expression):
+    tokens = []
+    pos = 0
+    expression = expression.strip()
+    while pos < len(expression):
+        match = _TOKEN_RE.match(expression, pos)
+        if match is None or match.end() == pos:
+            raise ValueError(f'Invalid expression near: {expression[pos:]!r}')
+        op, name_ref, value_ref, number, ident = match.groups()
+        if op is not None:
+            tokens.append(('op', op))
+        elif name_ref is not None:
+            tokens.append(('name_ref', name_ref))
+        elif value_ref is not None:
+            tokens.append(('value_ref', value_ref))
+        elif number is not None:
+            tokens.append(('number', int(number)))
+        elif ident.upper() in _KEYWORDS:
+            tokens.append(('kw', ident.upper()))
+        else:
+            tokens.append(('ident', ident))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    def __init__(self, expression, names, values):
+        self.tokens = _tokenize(expression)
+        self.pos = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def peek(self, offset=0):
+        idx = self.pos + offset
+        return self.tokens[idx] if idx < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, value=None):
+        token = self.peek()
+        if kind is not None and token[0] != kind:
+            raise ValueError(f'Expected {kind} but found {token}')
+        if value is not None and token[1] != value:
+            raise ValueError(f'Expected {value} but found {token}')
+        self.pos += 1
+        return token
+
+    def at(self, kind, value=None):
+        token = self.peek()
+        return token[0] == kind and (value is None or token[1] == value)
+
+    def done(self):
+        return self.pos >= len(self.tokens)
+
+    # paths and operands
+    def path(self):
+        kind, tok = self.take()
+        if kind == 'name_ref':
+            name = self.names[tok]
+        elif kind == 'ident':
+            name = tok
+        else:
+            raise ValueError(f'Expected attribute path, found {tok}')
+        parts = [name]
+        while True:
+            if self.at('op', '.'):
+                self.take()
+                kind, tok = self.take()
+                parts.append(self.names[tok] if kind == 'name_ref' else tok)
+            elif self.at('op', '['):
+                self.take()
+                parts.append(self.take('number')[1])
+                self.take('op', ']')
+            else:
+                return ('path', tuple(parts))
+
+    def operand(self):
+        kind, tok = self.peek()
+        if kind == 'value_ref':
+            self.take()
+            return ('value', self.values[tok])
+        if kind == 'ident' and self.peek(1) == ('op', '('):
+            func = tok
+            self.take()
+            self.take('op', '(')
+            args = [self.operand()]
+            while self.at('op', ','):
+                self.take()
+                args.append(self.operand())
+            self.take('op', ')')
+            return ('func', func, args)
+        return self.path()
+
+    # conditions
+    def condition(self):
+        node = self.and_condition()
+        while self.at('kw', 'OR'):
+            self.take()
+            node = ('or', node, self.and_condition())
+        return node
+
+    def and_condition(self):
+        node = self.not_condition()
+        while self.at('kw', 'AND'):
+            self.take()
+            node = ('and', node, self.not_condition())
+        return node
+
+    def not_condition(self):
+        if self.at('kw', 'NOT'):
+            self.take()
+            return ('not', self.not_condition())
+        if self.at('op', '('):
+            self.take()
+            node = self.condition()
+            self.take('op', ')')
+            return node
+        left = self.operand()
+        if left[0] == 'func' and left[1] != 'size':
+            return left
+        if self.at('kw', 'BETWEEN'):
+            self.take()
+            low = self.operand()
+            self.take('kw', 'AND')
+            return ('between', left, low, self.operand())
+        if self.at('kw', 'IN'):
+            self.take()
+            self.take('op', '(')
+            options = [self.operand()]
+            while self.at('op', ','):
+                self.take()
+                options.append(self.operand())
+            self.take('op', ')')
+            return ('in', left, options)
+        op = self.take('op')[1]
+        return ('cmp', op, left, self.operand())
+
+    # update expressions
+    def update(self):
+        actions = []
+        while not self.done():
+            clause = self.take('kw')[1]
+            while True:
+                if clause == 'SET':
+                    target = self.path()
+                    self.take('op', '=')
+                    value = self.operand()
+                    if self.at('op', '+') or self.at('op', '-'):
+                        op = self.take()[1]
+                        value = ('arith', op, value, self.operand())
+                    actions.append(('SET', target, value))
+                elif clause == 'REMOVE':
+                    actions.append(('REMOVE', self.path(), None))
+                else:
+                    target = self.path()
+                    actions.append((clause, target, self.operand()))
+                if self.at('op', ','):
+                    self.take()
+                    continue
+                break
+        return actions
+
+    def projection(self):
+        paths = [self.path()]
+        while self.at('op', ','):
+            self.take()
+            paths.append(self.path())
+        return paths
+
+
+_MISSING = object()
+
+
+def _resolve(item, path):
+    current = item
+    for part in path[1]:
+        if isinstance(part, int):
+            if not isinstance(current, list) or part >= len(current):
+                return _MISSING
+            current = current[part]
+        else:
+            if not isinstance(current, dict) or part not in current:
+                return _MISSING
+            current = current[part]
+    return current
+
+
+def _operand_value(item, node):
+    if node[0] == 'value':
+        return node[1]
+    if node[0] == 'path':
+        return _resolve(item, node)
+    if node[0] == 'func':
+        name, args = node[1], node[2]
+        if name == 'size':
+            value = _operand_value(item, args[0])
+            return _MISSING if value is _MISSING else Decimal(len(value))
+        if name == 'if_not_exists':
+            value = _operand_value(item, args[0])
+            return _operand_value(item, args[1]) if value is _MISSING else value
+        if name == 'list_append':
+            first = _operand_value(item, args[0])
+            second = _operand_value(item, args[1])
+            if first is _MISSING or second is _MISSING:
+                raise _ValidationError('The provided expression refers to an attribute that does not exist in the item')
+            return list(first) + list(second)
+        raise ValueError(f'Unsupported function {name}')
+    if node[0] == 'arith':
+        left = _operand_value(item, node[2])
+        right = _operand_value(item, node[3])
+        if left is _MISSING or right is _MISSING:
+            raise _ValidationError('The provided expression refers to an attribute that does not exist in the item')
+        return left + right if node[1] == '+' else left - right
+    raise ValueError(f'Unsupported operand {node}')
+
+
+def _compare(op, left, right):
+    if left is _MISSING or right is _MISSING:
+        return op == '<>' and not (left is _MISSING and right is _MISSING)
+    try:
+        if op == '=':
+            return left == right
+        if op == '<>':
+            return left != right
+        if op == '<':
+            return left < right
+        if op == '<=':
+            return left <= right
+        if op == '>':
+            return left > right
+        if op == '>=':
+            return left >= right
+    except TypeError:
+        return False
+    raise ValueError(f'Unsupported comparison {op}')
+
+
+def _evaluate(item, node):
+    kind = node[0]
+    if kind == 'and':
+        return _evaluate(item, node[1]) and _evaluate(item, node[2])
+    if kind == 'or':
+        return _evaluate(item, node[1]) or _evaluate(item, node[2])
+    if kind == 'not':
+        return not _evaluate(item, node[1])
+    if kind == 'cmp':
+        return _compare(node[1], _operand_value(item, node[2]), _operand_value(item, node[3]))
+    if kind == 'between':
+        value = _operand_value(item, node[1])
+        return _compare('>=', value, _operand_value(item, node[2])) and \
+            _compare('<=', value, _operand_value(item, node[3]))
+    if kind == 'in':
+        value = _operand_value(item, node[1])
+        return any(_compare('=', value, _operand_value(item, option)) for option in node[2])
+    if kind == 'func':
+        name, args = node[1], node[2]
+        if name == 'attribute_exists':
+            return _operand_value(item, args[0]) is not _MISSING
+        if name == 'attribute_not_exists':
+            return _operand_value(item, args[0]) is _MISSING
+        if name == 'begins_with':
+            value = _operand_value(item, args[0])
+            prefix = _operand_value(item, args[1])
+            return isinstance(value, str) and value.startswith(prefix)
+        if name == 'contains':
+            value = _operand_value(item, args[0])
+            return value is not _MISSING and _operand_value(item, args[1]) in value
+        raise ValueError(f'Unsupported function {name}')
+    raise ValueError(f'Unsupported condition {node}')
+
+
+class _ValidationError(Exception):
+    pass
+
+
+def _set_path(item, path, value):
+    parts = path[1]
+    current = item
+    for part in parts[:-1]:
+        current = current[part]
+    last = parts[-1]
+    if isinstance(last, int):
+        if last >= len(current):
+            current.append(value)
+        else:
+            current[last] = value
+    else:
+        current[last] = value
+
+
+def _remove_path(item, path):
+    parts = path[1]
+    current = item
+    for part in parts[:-1]:
+        if isinstance(part, int):
+            if part >= len(current):
+                return
+        elif part not in current:
+            return
+        current = current[part]
+    last = parts[-1]
+    if isinstance(last, int):
+        if last < len(current):
+            del current[last]
+    else:
+        current.pop(last, None)
+
+
+def _apply_update(item, actions):
+    # removals of list elements are applied highest index first, as DynamoDB does
+    removals = [a for a in actions if a[0] == 'REMOVE']
+    others = [a for a in actions if a[0] != 'REMOVE']
+    computed = []
+    for action, target, value in others:
+        if action == 'SET':
+            computed.append((action, target, _operand_value(item, value)))
+        else:
+            computed.append((action, target, _operand_value(item, value)))
+    for action, target, value in computed:
+        existing = _resolve(item, target)
+        if action == 'SET':
+            _set_path(item, target, copy.deepcopy(value))
+        elif action == 'ADD':
+            if existing is _MISSING:
+                _set_path(item, target, copy.deepcopy(value))
+            elif isinstance(existing, set):
+                existing |= value
+            else:
+                _set_path(item, target, existing + value)
+        elif action == 'DELETE':
+            if isinstance(existing, set):
+                existing -= value
+    for _, target, _ in sorted(removals, key=lambda a: [p if isinstance(p, int) else -1 for p in a[1][1]],
+                               reverse=True):
+        _remove_path(item, target)
+
+
+def _project(item, paths):
+    if not paths:
+        return item
+    result = {}
+    for path in paths:
+        value = _resolve(item, path)
+        if value is _MISSING:
+            continue
+        parts = path[1]
+        if len(parts) == 1:
+            result[parts[0]] = value
+        else:
+            # nested projections keep the top level attribute for simplicity
+            result[parts[0]] = item[parts[0]]
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Tables
+# ---------------------------------------------------------------------------
+
+class FakeBatchWriter:
+    def __init__(self, table):
+        self.table = table
+        self.requests = []
+
+    def put_item(self, Item):
+        self.requests.append({'PutRequest': {'Item': Item}})
+        self._maybe_flush()
+
+    def delete_item(self, Key):
+        self.requests.append({'DeleteRequest': {'Key': Key}})
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self.requests) >= 25:
+            self._flush()
+
+    def _flush(self):
+        if self.requests:
+            self.table.resource.batch_write_item(RequestItems={self.table.name: self.requests})
+            self.requests = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._flush()
+
+
+class FakeTable:
+    def __init__(self, resource, name, hash_key, range_key=None, indexes=None):
+        self.resource = resource
+        self.name = name
+        self.table_name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.indexes = indexes or {}
+        self.items = {}
+
+    # helpers
+    def _key_of(self, item):
+        return (item[self.hash_key], item.get(self.range_key) if self.range_key else None)
+
+    def _key_dict(self, item, index=None):
+        key = {self.hash_key: item[self.hash_key]}
+        if self.range_key:
+            key[self.range_key] = item[self.range_key]
+        if index:
+            hk, rk = self.indexes[index]
+            key[hk] = item[hk]
+            if rk and rk in item:
+                key[rk] = item[rk]
+        return key
+
+    def _lookup_key(self, key):
+        expected = {self.hash_key} | ({self.range_key} if self.range_key else set())
+        if set(key) != expected:
+            raise _client_error('ValidationException', 'The provided key element does not match the schema',
+                                'GetItem')
+        return key[self.hash_key], key.get(self.range_key) if self.range_key else None
+
+    def _check_condition(self, existing, condition, names, values, operation):
+        if not condition:
+            return
+        node = _Parser(condition, names, values).condition()
+        if not _evaluate(existing or {}, node):
+            raise _client_error('ConditionalCheckFailedException', 'The conditional request failed', operation)
+
+    def _capacity(self, units, request):
+        if request.get('ReturnConsumedCapacity') in ('TOTAL', 'INDEXES'):
+            return {'ConsumedCapacity': {'TableName': self.name, 'CapacityUnits': float(units)}}
+        return {}
+
+    def _record(self, operation):
+        self.resource._record(operation)
+
+    # single item operations
+    def get_item(self, Key, **kwargs):
+        self._record('GetItem')
+        with self.resource.lock:
+            item = self.items.get(self._lookup_key(Key))
+            result = self._capacity(0.5 if not kwargs.get('ConsistentRead') else 1, kwargs)
+            if item is not None:
+                paths = _Parser(kwargs['ProjectionExpression'], kwargs.get('ExpressionAttributeNames'), {}) \
+                    .projection() if kwargs.get('ProjectionExpression') else None
+                result['Item'] = copy.deepcopy(_project(item, paths))
+            return result
+
+    def put_item(self, Item, **kwargs):
+        self._record('PutItem')
+        item = _to_dynamo(copy.deepcopy(Item))
+        with self.resource.lock:
+            key = self._key_of(item)
+            existing = self.items.get(key)
+            self._check_condition(existing, kwargs.get('ConditionExpression'),
+                                  kwargs.get('ExpressionAttributeNames'),
+                                  _to_dynamo(kwargs.get('ExpressionAttributeValues')), 'PutItem')
+            self.items[key] = item
+            result = self._capacity(max(1, _item_size(item) // 1024 + 1), kwargs)
+            if kwargs.get('ReturnValues') == 'ALL_OLD' and existing is not None:
+                result['Attributes'] = copy.deepcopy(existing)
+            return result
+
+    def update_item(self, Key, **kwargs):
+        self._record('UpdateItem')
+        with self.resource.lock:
+            lookup = self._lookup_key(Key)
+            existing = self.items.get(lookup)
+            names = kwargs.get('ExpressionAttributeNames')
+            values = _to_dynamo(kwargs.get('ExpressionAttributeValues'))
+            self._check_condition(existing, kwargs.get('ConditionExpression'), names, values, 'UpdateItem')
+            item = copy.deepcopy(existing) if existing is not None else _to_dynamo(copy.deepcopy(Key))
+            old = copy.deepcopy(item)
+            try:
+                _apply_update(item, _Parser(kwargs['UpdateExpression'], names, values).update())
+            except _ValidationError as err:
+                raise _client_error('ValidationException', str(err), 'UpdateItem')
+            self.items[lookup] = item
+            result = self._capacity(max(1, _item_size(item) // 1024 + 1), kwargs)
+            return_values = kwargs.get('ReturnValues', 'NONE')
+            if return_values == 'ALL_NEW':
+                result['Attributes'] = copy.deepcopy(item)
+            elif return_values == 'ALL_OLD' and existing is not None:
+                result['Attributes'] = old
+            elif return_values in ('UPDATED_NEW', 'UPDATED_OLD'):
+                source = item if return_values == 'UPDATED_NEW' else old
+                touched = {a[1][1][0] for a in _Parser(kwargs['UpdateExpression'], names, values).update()}
+                result['Attributes'] = {k: copy.deepcopy(v) for k, v in source.items() if k in touched}
+            return result
+
+    def delete_item(self, Key, **kwargs):
+        self._record('DeleteItem')
+        with self.resource.lock:
+            lookup = self._lookup_key(Key)
+            existing = self.items.get(lookup)
+            self._check_condition(existing, kwargs.get('ConditionExpression'),
+                                  kwargs.get('ExpressionAttributeNames'),
+                                  _to_dynamo(kwargs.get('ExpressionAttributeValues')), 'DeleteItem')
+            self.items.pop(lookup, None)
+            result = self._capacity(1, kwargs)
+            if kwargs.get('ReturnValues') == 'ALL_OLD' and existing is not None:
+                result['Attributes'] = copy.deepcopy(existing)
+            return result
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return FakeBatchWriter(self)
+
+    # multi item operations
+    def _ordered(self, index=None):
+        """
+        Returns items in the order DynamoDB iterates them: grouped by partition
+        (in hash order) and sorted by range key within the partition.
+        """
+        if index is None:
+            hk, rk = self.hash_key, self.range_key
+            candidates = list(self.items.values())
+        else:
+            hk, rk = self.indexes[index]
+            candidates = [i for i in self.items.values() if hk in i and (rk is None or rk in i)]
+        return sorted(candidates, key=lambda i: (zlib.crc32(str(i[hk]).encode()), str(i[hk]),
+                                                 i.get(rk, '') if rk else '',
+                                                 self._key_of(i)[1] or ''))
+
+    def _page(self, candidates, kwargs, operation, index=None):
+        names = kwargs.get('ExpressionAttributeNames')
+        values = _to_dynamo(kwargs.get('ExpressionAttributeValues'))
+        start = kwargs.get('ExclusiveStartKey')
+        if start is not None:
+            start_key = self._key_of(start)
+            for pos, item in enumerate(candidates):
+                if self._key_of(item) == start_key:
+                    candidates = candidates[pos + 1:]
+                    break
+            else:
+                raise _client_error('ValidationException', 'The provided starting key is invalid', operation)
+        limit = kwargs.get('Limit')
+        filter_node = _Parser(kwargs['FilterExpression'], names, values).condition() \
+            if kwargs.get('FilterExpression') else None
+        paths = _Parser(kwargs['ProjectionExpression'], names, values).projection() \
+            if kwargs.get('ProjectionExpression') else None
+
+        returned, scanned, size = [], 0, 0
+        last = None
+        for item in candidates:
+            if limit is not None and scanned >= limit:
+                break
+            if size >= PAGE_SIZE_BYTES:
+                break
+            scanned += 1
+            size += _item_size(item)
+            last = item
+            if filter_node is None or _evaluate(item, filter_node):
+                returned.append(copy.deepcopy(_project(item, paths)))
+        result = {'Count': len(returned), 'ScannedCount': scanned}
+        if kwargs.get('Select') == 'COUNT':
+            returned = []
+        result['Items'] = returned
+        if last is not None and scanned < len(candidates):
+            result['LastEvaluatedKey'] = copy.deepcopy(self._key_dict(last, index))
+        result.update(self._capacity(max(0.5, size / 4096 / 2), kwargs))
+        return result
+
+    def query(self, **kwargs):
+        self._record('Query')
+        index = kwargs.get('IndexName')
+        with self.resource.lock:
+            names = kwargs.get('ExpressionAttributeNames')
+            values = _to_dynamo(kwargs.get('ExpressionAttributeValues'))
+            node = _Parser(kwargs['KeyConditionExpression'], names, values).condition()
+            hk = self.indexes[index][0] if index else self.hash_key
+            candidates = [i for i in self._ordered(index) if hk in i and _evaluate(i, node)]
+            if not kwargs.get('ScanIndexForward', True):
+                candidates.reverse()
+            return self._page(candidates, kwargs, 'Query', index)
+
+    def scan(self, **kwargs):
+        self._record('Scan')
+        index = kwargs.get('IndexName')
+        with self.resource.lock:
+            candidates = self._ordered(index)
+            total = kwargs.get('TotalSegments')
+            if total:
+                segment = kwargs['Segment']
+                hk = self.indexes[index][0] if index else self.hash_key
+                candidates = [i for i in candidates
+                              if zlib.crc32(str(i[hk]).encode()) % total == segment]
+            return self._page(candidates, kwargs, 'Scan', index)
+
+
+class FakeClient:
+    """
+    Low-level client operations that the resource API does not wrap.
+    """
+
+    def __init__(self, resource):
+        self.resource = resource
+        # botocore event hooks (see middleware/metrics.py) are accepted but never fired
+        self.meta = SimpleNamespace(events=SimpleNamespace(register=lambda event_name, handler: None))
+
+    def transact_write_items(self, TransactItems, **kwargs):
+        self.resource._record('TransactWriteItems')
+        if len(TransactItems) > 100:
+            raise _client_error('ValidationException', 'Too many transact items', 'TransactWriteItems')
+        with self.resource.lock:
+            prepared, reasons, failed = [], [], False
+            for entry in TransactItems:
+                (action, request), = entry.items()
+                table = self.resource.Table(request['TableName'])
+                names = request.get('ExpressionAttributeNames')
+                values = {k: _deserializer.deserialize(v)
+                          for k, v in request.get('ExpressionAttributeValues', {}).items()}
+                if action == 'Put':
+                    item = {k: _deserializer.deserialize(v) for k, v in request['Item'].items()}
+                    lookup = table._key_of(item)
+                else:
+                    key = {k: _deserializer.deserialize(v) for k, v in request['Key'].items()}
+                    lookup = table._lookup_key(key)
+                existing = table.items.get(lookup)
+                try:
+                    table._check_condition(existing, request.get('ConditionExpression'), names, values,
+                                           'TransactWriteItems')
+                    reasons.append({'Code': 'None'})
+                except ClientError:
+                    failed = True
+                    reason = {'Code': 'ConditionalCheckFailed', 'Message': 'The conditional request failed'}
+                    if request.get('ReturnValuesOnConditionCheckFailure') == 'ALL_OLD' and existing is not None:
+                        reason['Item'] = {k: _serializer.serialize(v) for k, v in existing.items()}
+                    reasons.append(reason)
+                prepared.append((action, table, lookup, request, names, values,
+                                 item if action == 'Put' else key))
+            if failed:
+                raise _client_error('TransactionCanceledException',
+                                    'Transaction cancelled, please refer cancellation reasons for specific reasons',
+                                    'TransactWriteItems', {'CancellationReasons': reasons})
+            for action, table, lookup, request, names, values, payload in prepared:
+                if action == 'Put':
+                    table.items[lookup] = payload
+                elif action == 'Delete':
+                    table.items.pop(lookup, None)
+                elif action == 'Update':
+                    item = copy.deepcopy(table.items.get(lookup)) or copy.deepcopy(payload)
+                    _apply_update(item, _Parser(request['UpdateExpression'], names, values).update())
+                    table.items[lookup] = item
+            return {}
+
+
+class FakeDynamoDBResource:
+    """
+    Drop-in replacement for ``boto3.resource('dynamodb')``.
+    Tables are declared up front with ``create_table`` using the same keyword
+    arguments as the real API.
+    """
+
+    def __init__(self, latency=0.0):
+        self.tables = {}
+        self.lock = threading.RLock()
+        self.calls = Counter()
+        self.latency = latency
+        self.meta = SimpleNamespace(client=FakeClient(self))
+
+    def _record(self, operation):
+        self.calls[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def reset_calls(self):
+        self.calls = Counter()
+
+    def create_table(self, TableName, KeySchema, GlobalSecondaryIndexes=None, **kwargs):
+        hash_key = next(k['AttributeName'] for k in KeySchema if k['KeyType'] == 'HASH')
+        range_key = next((k['AttributeName'] for k in KeySchema if k['KeyType'] == 'RANGE'), None)
+        indexes = {}
+        for gsi in GlobalSecondaryIndexes or []:
+            ghk = next(k['AttributeName'] for k in gsi['KeySchema'] if k['KeyType'] == 'HASH')
+            grk = next((k['AttributeName'] for k in gsi['KeySchema'] if k['KeyType'] == 'RANGE'), None)
+            indexes[gsi['IndexName']] = (ghk, grk)
+        self.tables[TableName] = FakeTable(self, TableName, hash_key, range_key, indexes)
+        return self.tables[TableName]
+
+    def Table(self, name):
+        try:
+            return self.tables[name]
+        except KeyError:
+            raise _client_error('ResourceNotFoundException', f'Requested resource not found: {name}', 'DescribeTable')
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        self._record('BatchGetItem')
+        responses = {}
+        with self.lock:
+            total = sum(len(r['Keys']) for r in RequestItems.values())
+            if total > 100:
+                raise _client_error('ValidationException', 'Too many items requested for the BatchGetItem call',
+                                    'BatchGetItem')
+            for name, request in RequestItems.items():
+                table = self.Table(name)
+                paths = _Parser(request['ProjectionExpression'], request.get('ExpressionAttributeNames'), {}) \
+                    .projection() if request.get('ProjectionExpression') else None
+                found = []
+                for key in request['Keys']:
+                    item = table.items.get(table._lookup_key(key))
+                    if item is not None:
+                        found.append(copy.deepcopy(_project(item, paths)))
+                responses[name] = found
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        self._record('BatchWriteItem')
+        with self.lock:
+            total = sum(len(r) for r in RequestItems.values())
+            if total > 25:
+                raise _client_error('ValidationException', 'Too many items requested for the BatchWriteItem call',
+                                    'BatchWriteItem')
+            for name, requests in RequestItems.items():
+                table = self.Table(name)
+                for request in requests:
+                    if 'PutRequest' in request:
+                        item = _to_dynamo(copy.deepcopy(request['PutRequest']['Item']))
+                        table.items[table._key_of(item)] = item
+                    else:
+                        table.items.pop(table._lookup_key(request['DeleteRequest']['Key']), None)
+        return {'UnprocessedItems': {}}
@@ -0,0 +1,63 @@
+"""
+Local stand-in for Google's tokeninfo endpoint, so the real Security.verify_token
+path (HTTP call, token cache) can be exercised without network access.
+
+Tokens of the form "valid-<user_id>" are accepted; anything else is rejected the
+way Google rejects an invalid token.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+VALID_PREFIX = "valid-"
+
+
+class _TokenInfoHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        token = parse_qs(urlparse(self.path).query).get("access_token", [""])[0]
+        self.server.calls += 1
+        if token.startswith(VALID_PREFIX):
+            status = 200
+            body = {"user_id": token[len(VALID_PREFIX):], "expires_in": self.server.expires_in,
+                    "scope": "openid email", "audience": "comment-response-benchmark"}
+        else:
+            status = 400
+            body = {"error": "invalid_token", "error_description": "Invalid Value"}
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeTokenInfoServer:
+    """
+    Runs the fake endpoint on a background thread. Use url as GOOGLE_TOKEN_INFO_URL.
+    """
+
+    def __init__(self, expires_in=3600):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _TokenInfoHandler)
+        self.server.calls = 0
+        self.server.expires_in = expires_in
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}/tokeninfo"
+
+    @property
+    def calls(self):
+        return self.server.calls
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
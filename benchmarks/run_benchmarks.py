@@ -0,0 +1,255 @@
+"""
+Offline benchmark suite for the comment-response routes.
+
+Runs the Flask app against an in-memory DynamoDB stand-in (fake_dynamodb.py)
+and a local fake tokeninfo server (fake_tokeninfo.py), so it needs neither AWS
+credentials nor network access. For every scenario it reports p50/p99 latency,
+throughput under concurrency and the DynamoDB calls made per request, and saves
+the results as JSON so runs on different commits can be compared:
+
+    $ python -m benchmarks.run_benchmarks --output before.json
+    $ git checkout other-branch
+    $ python -m benchmarks.run_benchmarks --compare before.json
+
+Use --latency-ms to add a simulated network round trip to every DynamoDB call.
+"""
+import argparse
+import csv
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+from benchmarks.fake_dynamodb import FakeDynamoDBResource
+from benchmarks.fake_tokeninfo import FakeTokenInfoServer, VALID_PREFIX
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CATALOG_CSV = os.path.join(REPO_ROOT, "data", "art_imported_data.csv")
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+
+def install_fakes(latency, engine="dynamodb"):
+    """
+    Starts the fake tokeninfo server and makes boto3 hand out the in-memory DynamoDB,
+    then imports the app. Must run before anything imports application or dynamodb_service.
+    """
+    tokeninfo = FakeTokenInfoServer().start()
+    os.environ["GOOGLE_TOKEN_INFO_URL"] = tokeninfo.url
+    os.environ["STORAGE_ENGINE"] = engine
+
+    fake_dynamodb = FakeDynamoDBResource()
+    from database_services import dynamodb_schema
+    for definition in dynamodb_schema.TABLES:
+        fake_dynamodb.create_table(**definition)
+    boto3.resource = lambda *args, **kwargs: fake_dynamodb
+
+    import application
+    fake_dynamodb.latency = latency
+    return application, fake_dynamodb, tokeninfo
+
+
+def catalog_item_ids():
+    with open(CATALOG_CSV, newline="") as f:
+        reader = csv.reader(f)
+        next(reader)
+        return [row[0].strip() for row in reader if row and row[0].strip()]
+
+
+def seed(db, args):
+    """
+    Builds the data shapes the scenarios read: one hot item with thousands of comments,
+    one comment with a long response list, and a few comments on every other catalog item.
+    """
+    item_ids = catalog_item_ids()
+    hot_item, other_items = item_ids[0], item_ids[1:]
+
+    for i in range(args.hot_comments):
+        db.post_comment(hot_item, f"user-{i % 97}", f"comment {i} on the hot item " + "x" * 200)
+    for item_id in other_items:
+        for i in range(args.comments_per_item):
+            db.post_comment(item_id, f"user-{i % 97}", f"comment {i} on item {item_id}")
+
+    thread_owner = "thread-owner"
+    db.post_comment(other_items[0], thread_owner, "a comment with a long thread")
+    thread = db.get_comments_by_item_id(other_items[0], db.MAX_PAGE_LIMIT, None, False)[0][0]
+    for i in range(args.thread_responses):
+        db.add_response(thread["comment_id"], f"user-{i % 97}", f"response {i} " + "y" * 100)
+
+    thread = db.fetch_comment_by_id(thread["comment_id"])
+    item_comments = db.get_comments_by_item_id(other_items[1], db.MAX_PAGE_LIMIT)[0]
+    return {
+        "hot_item": hot_item,
+        "items": item_ids,
+        "thread": thread,
+        "thread_owner": thread_owner,
+        "response": thread["responses"][len(thread["responses"]) // 2],
+        "batch_ids": [c["comment_id"] for c in db.get_comments_by_item_id(hot_item, 50)[0]],
+        "editable": item_comments[0],
+    }
+
+
+def scenarios(data):
+    """
+    (name, method, path, json body) for every benchmarked request.
+    """
+    thread_id = data["thread"]["comment_id"]
+    response_id = data["response"]["response_id"]
+    editable = data["editable"]
+    return [
+        ("item_comments_hot_first_page", "GET", f"/api/items/{data['hot_item']}/comments?limit=50", None),
+        ("item_comments_hot_newest", "GET", f"/api/items/{data['hot_item']}/comments?limit=50&order=desc", None),
+        ("comment_long_thread", "GET", f"/api/comments/{thread_id}", None),
+        ("comment_responses_page", "GET", f"/api/comments/{thread_id}/responses?limit=50", None),
+        ("single_response", "GET", f"/api/comments/{thread_id}/responses/{response_id}", None),
+        ("item_summary", "GET", f"/api/items/{data['hot_item']}/comments/summary", None),
+        ("item_summaries_page_of_50", "GET",
+         "/api/items/comments/summary?item_ids=" + ",".join(data["items"][:50]), None),
+        ("batch_get_50_comments", "GET", "/api/comments?comment_ids=" + ",".join(data["batch_ids"]), None),
+        ("post_comment", "POST", f"/api/items/{data['items'][2]}/comments",
+         {"user_id": "bench-user", "comment_text": "a new comment"}),
+        ("post_response", "POST", f"/api/comments/{editable['comment_id']}",
+         {"user_id": "bench-user", "response_text": "a new response"}),
+        ("update_comment_conflict", "PUT", f"/api/comments/{editable['comment_id']}",
+         {"user_id": editable["commenter_id"], "old_version_id": "stale", "new_comment_text": "edited"}),
+    ]
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_scenario(app, fake_dynamodb, scenario, args):
+    name, method, path, body = scenario
+    headers = {"Authorization": f"Bearer {VALID_PREFIX}bench-user"}
+
+    def call(client):
+        response = client.open(path, method=method, json=body, headers=headers)
+        if response.status_code >= 500:
+            raise RuntimeError(f"{name}: {method} {path} returned {response.status_code}")
+        return response.status_code
+
+    client = app.test_client()
+    for _ in range(args.warmup):
+        call(client)
+
+    # latency: one request at a time, so DynamoDB calls can be attributed to the route
+    fake_dynamodb.reset_calls()
+    latencies = []
+    statuses = Counter()
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        statuses[call(client)] += 1
+        latencies.append((time.perf_counter() - start) * 1000)
+    calls = Counter(fake_dynamodb.calls)
+
+    # throughput: the same request from several threads at once
+    def worker(count):
+        thread_client = app.test_client()
+        for _ in range(count):
+            call(thread_client)
+
+    per_thread = max(1, args.requests // args.concurrency)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(worker, [per_thread] * args.concurrency))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "method": method,
+        "path": path,
+        "requests": args.requests,
+        "status_codes": {str(code): count for code, count in statuses.items()},
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "mean_ms": round(statistics.mean(latencies), 3),
+        "throughput_rps": round(per_thread * args.concurrency / elapsed, 1),
+        "dynamodb_calls_per_request": round(sum(calls.values()) / args.requests, 2),
+        "dynamodb_calls_by_operation": {op: round(n / args.requests, 2) for op, n in sorted(calls.items())},
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\ncompared with {baseline_path} (commit {baseline.get('commit')})")
+    print(f"{'scenario':32} {'p50 ms':>16} {'p99 ms':>16} {'calls/req':>14}")
+    for name, current in results["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            print(f"{name:32} {'(new)':>16}")
+            continue
+        print(f"{name:32} {before['p50_ms']:>7} -> {current['p50_ms']:<7} {before['p99_ms']:>7} -> "
+              f"{current['p99_ms']:<7} {before['dynamodb_calls_per_request']:>5} -> "
+              f"{current['dynamodb_calls_per_request']:<5}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hot-comments", type=int, default=2000, help="comments on the hot item")
+    parser.add_argument("--comments-per-item", type=int, default=3, help="comments on every other item")
+    parser.add_argument("--thread-responses", type=int, default=1000, help="responses on the long thread")
+    parser.add_argument("--requests", type=int, default=200, help="timed requests per scenario")
+    parser.add_argument("--warmup", type=int, default=10, help="untimed requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="threads for the throughput run")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated latency per DynamoDB call")
+    parser.add_argument("--engine", default="dynamodb", choices=["dynamodb", "memory"],
+                        help="STORAGE_ENGINE to benchmark")
+    parser.add_argument("--only", action="append", help="run only the named scenario (repeatable)")
+    parser.add_argument("--output", help="where to write the JSON results "
+                                         "(default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", help="a previous results file to print deltas against")
+    args = parser.parse_args()
+
+    app_module, fake_dynamodb, tokeninfo = install_fakes(0.0, args.engine)
+    app = app_module.application
+    app.logger.disabled = True
+
+    started = time.perf_counter()
+    data = seed(app_module.db, args)
+    print(f"seeded in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    fake_dynamodb.latency = args.latency_ms / 1000
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "scenarios": {},
+    }
+    for scenario in scenarios(data):
+        if args.only and scenario[0] not in args.only:
+            continue
+        result = run_scenario(app, fake_dynamodb, scenario, args)
+        results["scenarios"][scenario[0]] = result
+        print(f"{scenario[0]:32} p50 {result['p50_ms']:>8.3f} ms  p99 {result['p99_ms']:>8.3f} ms  "
+              f"{result['throughput_rps']:>8.1f} req/s  {result['dynamodb_calls_per_request']:>6} calls/req")
+    results["tokeninfo_calls"] = tokeninfo.calls
+    tokeninfo.stop()
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{results['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {output}", file=sys.stderr)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Cold-start benchmark: how long a fresh worker process takes to import the app and to serve
+its first request, and how many DynamoDB calls it makes while importing.
+
+DynamoDB is a local HTTP endpoint that answers every call with an empty result after
+--endpoint-latency-ms, standing in for the round trip to AWS; tokens are checked against
+the fake tokeninfo server. Each run is a new interpreter, like a new gunicorn worker:
+
+    $ python -m benchmarks.startup --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.fake_tokeninfo import FakeTokenInfoServer, VALID_PREFIX
+from benchmarks.run_benchmarks import REPO_ROOT, RESULTS_DIR, git_commit
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import application
+imported = time.perf_counter()
+if sys.argv[1] == "first-request":
+    client = application.application.test_client()
+    client.get("/api/comments/startup", headers={"Authorization": "Bearer %sstartup"})
+print(json.dumps({"import_s": imported - start, "total_s": time.perf_counter() - start}))
+"""
+
+
+class _EndpointHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.server.lock:
+            self.server.calls += 1
+        time.sleep(self.server.latency)
+        body = json.dumps({"Items": [], "Count": 0, "ScannedCount": 0}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-amz-json-1.0")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_endpoint(latency):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _EndpointHandler)
+    server.latency = latency
+    server.calls = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_child(mode, env, endpoint):
+    calls_before = endpoint.calls
+    output = subprocess.check_output([sys.executable, "-c", CHILD % VALID_PREFIX, mode], cwd=REPO_ROOT, env=env,
+                                     stderr=subprocess.DEVNULL)
+    result = json.loads(output.decode().strip().splitlines()[-1])
+    result["dynamodb_calls"] = endpoint.calls - calls_before
+    return result
+
+
+def summarize(runs, key):
+    values = sorted(run[key] for run in runs)
+    return {"median_ms": round(statistics.median(values) * 1000, 1), "max_ms": round(values[-1] * 1000, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per measurement")
+    parser.add_argument("--endpoint-latency-ms", type=float, default=100.0,
+                        help="simulated round trip of every DynamoDB call")
+    parser.add_argument("--output", help="where to write the JSON results "
+                                         "(default: benchmarks/results/startup-<commit>.json)")
+    args = parser.parse_args()
+
+    endpoint = start_endpoint(args.endpoint_latency_ms / 1000)
+    tokeninfo = FakeTokenInfoServer().start()
+    env = dict(os.environ,
+               DYNAMODB_ENDPOINT_URL=f"http://127.0.0.1:{endpoint.server_port}",
+               GOOGLE_TOKEN_INFO_URL=tokeninfo.url,
+               AWS_ACCESS_KEY="benchmark", AWS_SECRET_KEY="benchmark", AWS_REGION_NAME="us-east-1",
+               STORAGE_ENGINE="dynamodb", COMMENT_CACHE_BACKEND="none")
+
+    imports = [run_child("import", env, endpoint) for _ in range(args.runs)]
+    first_requests = [run_child("first-request", env, endpoint) for _ in range(args.runs)]
+    tokeninfo.stop()
+    endpoint.shutdown()
+
+    results = {
+        "commit": git_commit(),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "import": {**summarize(imports, "import_s"),
+                   "dynamodb_calls": max(run["dynamodb_calls"] for run in imports)},
+        "import_and_first_request": summarize(first_requests, "total_s"),
+    }
+    print(json.dumps(results, indent=2))
+
+    output = args.output or os.path.join(RESULTS_DIR, f"startup-{results['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+#! /usr/bin/env python
+"""
+Exports every comment and response in the comment table to NDJSON or CSV files with a
+parallel scan. Uses the AWS_* environment variables. Re-run with the same arguments to
+resume an interrupted export.
+
+    $ ./bin/export_comments.py exports/2021-12-01 --segments 32 --read-units 2000
+"""
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database_services import dynamodb_schema as schema
+from database_services.dynamodb_export import export_table, FORMATS, CSV_FIELDS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('out_dir', help='directory for the chunk files, checkpoints and manifest.json')
+    parser.add_argument('--table', default=schema.COMMENT_TABLE_NAME, help='table to export')
+    parser.add_argument('--segments', type=int, default=16, help='parallel scan segments (TotalSegments)')
+    parser.add_argument('--workers', type=int, help='threads scanning segments (default: one per segment)')
+    parser.add_argument('--format', choices=FORMATS, default='ndjson', help='output format')
+    parser.add_argument('--chunk-size', type=int, default=100000, help='items per output file')
+    parser.add_argument('--read-units', type=float, default=0,
+                        help='read capacity units per second for the whole export (default: no limit)')
+    parser.add_argument('--page-size', type=int, help='items per scan page (default: 1 MB pages)')
+    parser.add_argument('--fields', default=','.join(CSV_FIELDS), help='csv columns')
+    parser.add_argument('--include-tombstones', action='store_true', help='also export deletion tombstones')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # one pooled connection per scanning thread; read before the client is created
+    os.environ.setdefault('DYNAMODB_MAX_POOL_CONNECTIONS', str(args.workers or args.segments))
+    from database_services.dynamodb_connection import get_table
+
+    manifest = export_table(get_table(args.table), args.out_dir, total_segments=args.segments, workers=args.workers,
+                            fmt=args.format, chunk_size=args.chunk_size, read_units_per_second=args.read_units,
+                            page_size=args.page_size, include_tombstones=args.include_tombstones,
+                            fields=args.fields.split(','))
+    print(f"exported {manifest['items']} items ({manifest['scanned']} scanned) to {len(manifest['files'])} files "
+          f"in {manifest['seconds']}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+#! /usr/bin/env python
+"""
+Migrates comments from the legacy table (responses stored as a list on the comment)
+to the adjacency-list table used by the service, then rebuilds the item summaries.
+Uses the AWS_* environment variables.
+
+    $ ./bin/migrate_responses.py --create-table
+    $ ./bin/migrate_responses.py --summaries-only
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database_services import dynamodb_schema as schema
+from database_services.dynamodb_connection import get_resource
+from database_services.dynamodb_migration import migrate, backfill_summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=schema.LEGACY_COMMENT_TABLE_NAME, help='legacy table name')
+    parser.add_argument('--target', default=schema.COMMENT_TABLE_NAME, help='adjacency-list table name')
+    parser.add_argument('--create-table', action='store_true', help='create missing tables and indexes first')
+    parser.add_argument('--dry-run', action='store_true', help='count what would be migrated without writing')
+    parser.add_argument('--summaries-only', action='store_true',
+                        help='only rebuild the item summaries from the target table')
+    args = parser.parse_args()
+
+    dynamodb = get_resource()
+    if args.create_table:
+        schema.create_tables(dynamodb)
+        dynamodb.meta.client.get_waiter('table_exists').wait(TableName=args.target)
+
+    if not args.summaries_only:
+        comments, responses = migrate(dynamodb.Table(args.source), dynamodb.Table(args.target),
+                                      dry_run=args.dry_run)
+        print(f"{'would migrate' if args.dry_run else 'migrated'} {comments} comments and {responses} responses")
+    if not args.dry_run:
+        items = backfill_summaries(dynamodb.Table(args.target), dynamodb.Table(schema.SUMMARY_TABLE_NAME))
+        print(f"rebuilt the summaries of {items} items")
+
+
+if __name__ == '__main__':
+    main()
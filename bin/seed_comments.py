@@ -0,0 +1,60 @@
+#! /usr/bin/env python
+"""
+Bulk loads comments and responses for load tests and staging refreshes: generated over the
+items of the art catalog, or read from an NDJSON file (see database_services/dynamodb_seed.py).
+Uses the AWS_* environment variables; set DYNAMODB_ENDPOINT_URL to load DynamoDB Local.
+
+    $ ./bin/seed_comments.py --comments 1000000 --workers 16 --write-units 5000
+    $ ./bin/seed_comments.py --input threads.ndjson
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--input', help='NDJSON file of comment threads to load instead of generating them')
+    parser.add_argument('--catalog', default=os.path.join(REPO_ROOT, 'data', 'art_imported_data.csv'),
+                        help='art catalog CSV whose items get the generated comments')
+    parser.add_argument('--comments', type=int, default=100000, help='comments to generate')
+    parser.add_argument('--users', type=int, default=10000, help='distinct commenters and responders')
+    parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent of item popularity')
+    parser.add_argument('--response-alpha', type=float, default=1.3,
+                        help='Pareto shape of responses per comment (lower means deeper threads)')
+    parser.add_argument('--max-responses', type=int, default=500, help='longest generated thread')
+    parser.add_argument('--days', type=float, default=365, help='generated comments span this many days')
+    parser.add_argument('--seed', type=int, help='random seed for the generated text, users and times')
+    parser.add_argument('--workers', type=int, default=8, help='parallel BatchWriteItem writers')
+    parser.add_argument('--write-units', type=float, default=0,
+                        help='write capacity units per second for the whole load (default: no limit)')
+    parser.add_argument('--create-table', action='store_true', help='create missing tables and indexes first')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # one pooled connection per writer; read before the client is created
+    os.environ.setdefault('DYNAMODB_MAX_POOL_CONNECTIONS', str(args.workers))
+    from database_services import dynamodb_schema as schema
+    from database_services.dynamodb_connection import get_resource
+    from database_services.dynamodb_seed import catalog_item_ids, generate_threads, read_threads, load_threads
+
+    if args.create_table:
+        schema.create_tables(get_resource())
+
+    if args.input:
+        threads = read_threads(args.input)
+    else:
+        threads = generate_threads(catalog_item_ids(args.catalog), args.comments, users=args.users,
+                                   zipf_exponent=args.zipf, response_alpha=args.response_alpha,
+                                   max_responses=args.max_responses, days=args.days, rng=random.Random(args.seed))
+    print(json.dumps(load_threads(threads, workers=args.workers, write_units_per_second=args.write_units)))
+
+
+if __name__ == '__main__':
+    main()
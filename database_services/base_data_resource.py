@@ -1,11 +1,360 @@
+import base64
+import binascii
+import json
 from abc import ABC, abstractmethod
 
+from database_services.dynamodb_errors import DynmamoDBErrors as e
 
-class BaseDataException:
-    def __init__(self):
-        pass
+
+class BaseDataException(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+
+class CapacityExceededException(Exception):
+    """
+    The storage is over capacity (e.g. DynamoDB throttling); the request may be retried later.
+    Not a BaseDataException, since it says nothing about the request itself.
+    """
+    pass
+
+
+class ScanInterruptedException(Exception):
+    """
+    iter_all_comments failed part way, with the error that stopped it as __cause__ (a
+    CapacityExceededException if DynamoDB kept throttling). cursor resumes the scan after the
+    last comment it yielded.
+    """
+
+    def __init__(self, msg, cursor):
+        super().__init__(msg)
+        self.msg = msg
+        self.cursor = cursor
+
+
+class ChangesExpiredException(BaseDataException):
+    """
+    A since token older than the change history; the client has to fetch the item again.
+    """
+    pass
+
+
+class IdempotencyKey:
+    """
+    An Idempotency-Key sent with a post. key is already scoped to the user; fingerprint identifies
+    the request, so a key reused for a different request can be told apart from a retry.
+    The engine stores the key with the post's result in the same write and, if the key was already
+    used for this request, returns the stored result instead and sets replayed.
+    """
+
+    def __init__(self, key, fingerprint, ttl):
+        self.key = key
+        self.fingerprint = fingerprint
+        self.ttl = ttl
+        self.replayed = False
+
+
+def encode_cursor(last_evaluated_key):
+    """
+    Turns a LastEvaluatedKey into an opaque, URL-safe continuation cursor.
+    Returns None when there is no further page.
+    """
+    if not last_evaluated_key:
+        return None
+    raw = json.dumps(last_evaluated_key, default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Inverse of encode_cursor: returns the ExclusiveStartKey for a cursor, or None.
+    Raises BaseDataException if the cursor is malformed.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        key = json.loads(raw.decode('utf-8'))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise BaseDataException("Invalid pagination cursor")
+    if not isinstance(key, dict):
+        raise BaseDataException("Invalid pagination cursor")
+    return key
+
+
+# attributes of a comment that a fields= projection may select
+COMMENT_FIELDS = frozenset(['comment_id', 'item_id', 'commenter_id', 'comment_text', 'datetime', 'edited_at',
+                            'version_id', 'response_count'])
+# attributes of a response item
+RESPONSE_FIELDS = frozenset(['comment_id', 'response_id', 'responder_id', 'response_text', 'datetime', 'edited_at',
+                             'version_id'])
+
+# access paths find_comments can take for a template, cheapest first
+KEY_LOOKUP = 'key_lookup'
+INDEX_QUERY = 'index_query'
+SCAN = 'scan'
+
+# include_responses options: ("all", None), ("none", None), ("count", None) or ("first", n)
+ALL_RESPONSES = ('all', None)
+
+
+def projected_attributes(fields, include_responses):
+    """
+    The comment attributes a projected read needs: the requested fields, the comment_id and
+    version_id that ETags and keys rely on, and response_count unless responses are left out.
+    """
+    attributes = set(fields if fields is not None else COMMENT_FIELDS) | {'comment_id', 'version_id'}
+    if include_responses[0] != 'none':
+        attributes.add('response_count')
+    return attributes
+
+
+def check_template(template):
+    """
+    Raises BaseDataException unless every attribute of a find_comments template is a comment attribute.
+    """
+    unknown = set(template) - COMMENT_FIELDS
+    if unknown:
+        raise BaseDataException(f"Unknown comment attributes: {', '.join(sorted(unknown))}")
+
+
+def project_thread(comment, fields=None, include_responses=ALL_RESPONSES):
+    """
+    Cuts a comment with its responses down to a projection. comment_id and version_id are always kept;
+    response_count is added for the count and first modes.
+    fields: set of COMMENT_FIELDS, or None for every attribute
+    """
+    mode, first = include_responses
+    projected = {k: v for k, v in comment.items()
+                 if k != 'responses' and (fields is None or k in fields or k in ('comment_id', 'version_id'))}
+    if mode in ('count', 'first'):
+        projected['response_count'] = comment.get('response_count', len(comment.get('responses', [])))
+    if mode == 'all':
+        projected['responses'] = comment.get('responses', [])
+    elif mode == 'first':
+        projected['responses'] = comment.get('responses', [])[:first]
+    return projected
 
 
 class BaseDataResource(ABC):
+    """
+    The storage operations behind the routes. Every engine returns the same shapes:
+    comments are dicts with a responses list (except in batch reads), and writes return
+    (error, result), where error is None or a DynmamoDBErrors value and result is the
+    written record on success or a message on failure.
+    """
+    DEFAULT_PAGE_LIMIT = 50
+    MAX_PAGE_LIMIT = 200
+    # most entries accepted by the batch endpoints in one request
+    MAX_BATCH_SIZE = 100
+
     def __init__(self):
         pass
+
+    decode_cursor = staticmethod(decode_cursor)
+
+    @abstractmethod
+    def fetch_comment_by_id(self, comment_id, fields=None, include_responses=ALL_RESPONSES):
+        """
+        Returns the comment with its responses, or None if it does not exist.
+        fields and include_responses project the result as described in project_thread;
+        engines should avoid reading what is not requested.
+        """
+        pass
+
+    @abstractmethod
+    def get_comments_by_item_id(self, item_id, limit=DEFAULT_PAGE_LIMIT, cursor=None, ascending=True,
+                                fields=None, include_responses=ALL_RESPONSES):
+        """
+        Returns one page of an item's comments ordered by time, as (comments, next_cursor).
+        Raises BaseDataException for a malformed cursor.
+        """
+        pass
+
+    @abstractmethod
+    def get_item_changes(self, item_id, since, limit=DEFAULT_PAGE_LIMIT):
+        """
+        Returns the item's comments and responses created, edited or deleted after the since token,
+        oldest change first, as (changes, next_since, more). A change is the record as it is now,
+        with "type" ("comment" or "response") and "deleted": False; comments come without their
+        responses list. A delete is a tombstone {type, comment_id[, response_id], deleted: True}.
+        more is True if there are further changes to fetch right away with next_since.
+        Raises BaseDataException for a malformed token and ChangesExpiredException for an expired one.
+        """
+        pass
+
+    @abstractmethod
+    def changes_token(self):
+        """
+        A since token from which get_item_changes reports every change not in a read made after it.
+        """
+        pass
+
+    @abstractmethod
+    def fetch_responses_page(self, comment_id, limit=DEFAULT_PAGE_LIMIT, cursor=None):
+        """
+        Returns one page of a comment's responses, oldest first, as (responses, next_cursor).
+        """
+        pass
+
+    @abstractmethod
+    def fetch_single_response(self, comment_id, response_id):
+        pass
+
+    @abstractmethod
+    def fetch_comments_page(self, limit=DEFAULT_PAGE_LIMIT, cursor=None):
+        """
+        Returns one page of comments across all items, as (comments, next_cursor).
+        """
+        pass
+
+    @abstractmethod
+    def iter_all_comments(self, page_size=None, cursor=None):
+        """
+        Generator over every comment, each with its responses.
+        Raises ScanInterruptedException if the storage fails part way.
+        """
+        pass
+
+    @abstractmethod
+    def find_comments(self, template, limit=DEFAULT_PAGE_LIMIT, cursor=None, ascending=True, fields=None,
+                      include_responses=ALL_RESPONSES):
+        """
+        Returns one page of the comments whose top-level attributes match template, e.g. {"commenter_id": "talya"},
+        as (comments, next_cursor, explain), oldest first unless ascending is False.
+        The engine picks the cheapest access path for the template and explain records it:
+        {"access_path": KEY_LOOKUP, INDEX_QUERY or SCAN, "index", "key_attributes", "filter_attributes",
+         "items_examined", "items_returned"}.
+        Attributes outside the key are filtered after reading, so a page may hold fewer than limit comments.
+        Raises BaseDataException for a template attribute that is not in COMMENT_FIELDS.
+        """
+        pass
+
+    def fetch_all_comments_by_template(self, template):
+        """
+        Returns (every comment matching template, explain), following find_comments from page to page;
+        explain counts the items examined and returned over all pages.
+        """
+        comments, cursor, explain = self.find_comments(template, self.MAX_PAGE_LIMIT)
+        while cursor is not None:
+            page, cursor, page_explain = self.find_comments(template, self.MAX_PAGE_LIMIT, cursor)
+            comments += page
+            explain['items_examined'] += page_explain['items_examined']
+            explain['items_returned'] += page_explain['items_returned']
+        return comments, explain
+
+    @abstractmethod
+    def post_comment(self, item_id, commenter_id, comment_text, idempotency=None):
+        """
+        idempotency: an optional IdempotencyKey; a key reused for a different request
+        gets IDEMPOTENCY_KEY_REUSED.
+        """
+        pass
+
+    @abstractmethod
+    def add_response(self, comment_id, responder_id, response_text, idempotency=None):
+        """
+        idempotency: as for post_comment
+        """
+        pass
+
+    @abstractmethod
+    def new_comment(self, item_id, commenter_id, comment_text):
+        """
+        Builds a new comment, ids included, without writing it; see batch_put_comments.
+        """
+        pass
+
+    @abstractmethod
+    def new_response(self, comment_id, responder_id, response_text):
+        """
+        Builds a new response, ids included, without writing it; see add_responses.
+        """
+        pass
+
+    @abstractmethod
+    def batch_put_comments(self, comments):
+        """
+        Writes comments built by new_comment.
+        Returns a list of (error, comment) in the order of comments.
+        """
+        pass
+
+    @abstractmethod
+    def add_responses(self, comment_id, responses):
+        """
+        Writes responses built by new_response under one comment, together with one update of its response_count.
+        Returns (error, responses); error is COMMENT_NOT_FOUND if the comment does not exist.
+        """
+        pass
+
+    @abstractmethod
+    def update_comment(self, comment_id, old_version_id, commenter_id, new_comment_text):
+        """
+        Only succeeds if commenter_id owns the comment and old_version_id is its current version.
+        """
+        pass
+
+    @abstractmethod
+    def update_response(self, comment_id, response_id, new_response_text, responder_id, old_version_id):
+        pass
+
+    @abstractmethod
+    def delete_comment(self, comment_id, commenter_id, old_version_id=None):
+        """
+        Deletes the comment and its responses. The version is only checked if old_version_id is given.
+        """
+        pass
+
+    @abstractmethod
+    def delete_response(self, comment_id, response_id, responder_id, old_version_id=None):
+        pass
+
+    @abstractmethod
+    def get_item_summary(self, item_id):
+        """
+        Returns {item_id, comment_count, response_count, last_activity, latest_comment_ids}.
+        """
+        pass
+
+    def get_item_summaries(self, item_ids):
+        return [self.get_item_summary(item_id) for item_id in item_ids]
+
+    def batch_fetch_comments(self, comment_ids):
+        """
+        Returns a list of (comment_id, error, comment) in the order of comment_ids.
+        Comments are returned without their responses list.
+        Engines with a native batch read should override this.
+        """
+        results = []
+        for comment_id in comment_ids:
+            comment = self.fetch_comment_by_id(comment_id, include_responses=('none', None))
+            if comment is None:
+                results.append((comment_id, e.COMMENT_NOT_FOUND, "Comment could not be found!"))
+            else:
+                results.append((comment_id, None, comment))
+        return results
+
+    def batch_post_comments(self, entries):
+        """
+        entries: list of (item_id, commenter_id, comment_text)
+        Returns a list of (error, comment) in the order of entries.
+        """
+        return self.batch_put_comments([self.new_comment(*entry) for entry in entries])
+
+    def cache_stats(self):
+        return {'backend': 'none'}
+
+
+def create_data_resource(engine):
+    """
+    Builds a storage engine from a config string: "dynamodb" or "memory".
+    Engines are imported lazily, so the DynamoDB client is only created when it is used.
+    """
+    if not engine or engine == 'dynamodb':
+        from database_services.dynamodb_service import DynamoDBDataResource
+        return DynamoDBDataResource()
+    if engine == 'memory':
+        from database_services.memory_service import InMemoryDataResource
+        return InMemoryDataResource()
+    raise ValueError(f"Unknown storage engine: {engine}")
@@ -0,0 +1,242 @@
+"""
+Cache backends for the read-through cache in dynamodb_service.
+
+Values are pickled, so callers always get their own copy and may mutate it.
+Invalidation is generation based: cache keys embed a generation number that
+writers bump, so an entry written by a slow reader after a write can never be
+served (it was stored under the old generation).
+
+A backend that cannot be reached never fails a request: reads miss, and writes
+and invalidations are logged and counted in comment_cache_errors_total.
+"""
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from middleware import metrics
+
+logger = logging.getLogger()
+
+
+class CacheBackend:
+    """
+    Interface shared by the backends, plus the hit/miss bookkeeping.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Returns the cached value, or None on a miss.
+        A key of None (its generation could not be read) always misses.
+        """
+        raw = self._get(key) if key is not None else None
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        if key is not None:
+            self._set(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ttl)
+
+    def generation(self, key):
+        """
+        Returns the current generation stored under key, creating it if needed, or None if it
+        could not be read. New generations start from the clock, so a generation key that was
+        evicted or expired never comes back with a number that older entries were stored under.
+        """
+        raise NotImplementedError
+
+    def bump(self, key):
+        """
+        Moves key to a new generation, which invalidates every entry stored under the old one.
+        """
+        raise NotImplementedError
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, raw, ttl):
+        raise NotImplementedError
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class NullCache(CacheBackend):
+    """
+    Caching disabled: every lookup misses and nothing is stored.
+    """
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def generation(self, key):
+        return 0
+
+    def bump(self, key):
+        pass
+
+
+class LRUCache(CacheBackend):
+    """
+    In-process LRU cache with per-entry TTL, for a single worker. Writes only invalidate
+    the entries of the process that made them, so with several workers (or containers)
+    the others would serve an entry until its TTL runs out; gunicorn.conf.py refuses it
+    with more than one worker. Use RedisCache to share invalidation.
+    """
+
+    def __init__(self, max_entries=10000, default_ttl=30):
+        super().__init__()
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def _set(self, key, raw, ttl):
+        expires_at = time.monotonic() + (ttl if ttl is not None else self.default_ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, raw)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def generation(self, key):
+        with self._lock:
+            return self._generations.setdefault(key, time.time_ns())
+
+    def bump(self, key):
+        with self._lock:
+            self._generations[key] = max(self._generations.get(key, 0) + 1, time.time_ns())
+            # generations are tiny, but a long-running worker shouldn't keep every one forever
+            if len(self._generations) > self.max_entries * 4:
+                self._generations.clear()
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stats.update({
+                'entries': len(self._entries),
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            })
+        return stats
+
+
+class RedisCache(CacheBackend):
+    """
+    Cache in any server that speaks the Redis protocol, shared by every worker and container,
+    so invalidations are seen everywhere. Requires the optional redis package.
+
+    Generation keys expire generation_ttl seconds after their last bump (default 100 times the
+    entry TTL, at least an hour), so keys of comments and items that stopped changing go away.
+    If Redis fails, reads go to DynamoDB; a failed bump leaves other workers' entries until their TTL.
+    """
+
+    def __init__(self, url, default_ttl=30, generation_ttl=None):
+        super().__init__()
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("COMMENT_CACHE_BACKEND points at redis, but the redis package is not installed")
+        self.client = redis.Redis.from_url(url, socket_timeout=0.25, socket_connect_timeout=0.25)
+        self.default_ttl = default_ttl
+        self.generation_ttl = generation_ttl or max(3600, 100 * default_ttl)
+        self._redis_error = redis.RedisError
+        self.errors = 0
+
+    def _failed(self, operation, key):
+        self.errors += 1
+        metrics.inc(metrics.CACHE_ERRORS, operation=operation)
+        logger.warning(f"redis cache {operation} of {key} failed", exc_info=True)
+
+    def _get(self, key):
+        try:
+            return self.client.get(key)
+        except self._redis_error:
+            self._failed('get', key)
+            return None
+
+    def _set(self, key, raw, ttl):
+        try:
+            self.client.set(key, raw, ex=ttl if ttl is not None else self.default_ttl)
+        except self._redis_error:
+            self._failed('set', key)
+
+    def generation(self, key):
+        pipe = self.client.pipeline()
+        pipe.set(key, time.time_ns(), nx=True, ex=self.generation_ttl)
+        pipe.get(key)
+        try:
+            return int(pipe.execute()[1])
+        except self._redis_error:
+            self._failed('generation', key)
+            return None
+
+    def bump(self, key):
+        pipe = self.client.pipeline()
+        pipe.set(key, time.time_ns(), nx=True)
+        pipe.incr(key)
+        pipe.expire(key, self.generation_ttl)
+        try:
+            pipe.execute()
+        except self._redis_error:
+            self._failed('bump', key)
+
+    def stats(self):
+        stats = super().stats()
+        stats['errors'] = self.errors
+        try:
+            info = self.client.info('stats')
+        except self._redis_error:
+            self._failed('info', 'stats')
+            return stats
+        stats.update({
+            'evictions': info.get('evicted_keys', 0),
+            'expirations': info.get('expired_keys', 0),
+        })
+        return stats
+
+
+def create_cache(spec, max_entries=10000, default_ttl=30):
+    """
+    Builds a backend from a config string: "none", "memory", or a redis:// URL.
+    """
+    if not spec or spec == 'none':
+        return NullCache()
+    if spec == 'memory':
+        return LRUCache(max_entries=max_entries, default_ttl=default_ttl)
+    if spec.startswith('redis://') or spec.startswith('rediss://') or spec.startswith('unix://'):
+        return RedisCache(spec, default_ttl=default_ttl)
+    raise ValueError(f"Unknown cache backend: {spec}")
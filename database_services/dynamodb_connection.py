@@ -0,0 +1,65 @@
+"""
+The boto3 DynamoDB resource used by the data-access code.
+
+Nothing connects at import time. The resource is created on first use in each process,
+and created again if the process has forked since (gunicorn --preload imports the app in
+the master), so workers never share sockets. One resource serves all of a process's threads,
+with a connection pool sized to them (gunicorn.conf.py sets DYNAMODB_MAX_POOL_CONNECTIONS
+from the requests a worker runs at once: GUNICORN_THREADS, or ASGI_THREADS in async mode).
+"""
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+import database_services.dynamodb_secrets as secrets
+from middleware import metrics
+
+# DynamoDB Local or another endpoint, e.g. http://localhost:8000
+ENDPOINT_URL = os.environ.get('DYNAMODB_ENDPOINT_URL') or None
+
+_lock = threading.Lock()
+_resource = None
+_resource_pid = None
+
+
+def client_config():
+    """
+    Pool size, timeouts and retries for the DynamoDB client. botocore's defaults (10 connections,
+    60 second timeouts, legacy retries) let a slow call hold a request thread for minutes.
+    HTTP keep-alive needs no setting: connections go back to the pool and are reused.
+    """
+    return Config(
+        max_pool_connections=int(os.environ.get('DYNAMODB_MAX_POOL_CONNECTIONS', 10)),
+        connect_timeout=float(os.environ.get('DYNAMODB_CONNECT_TIMEOUT', 1)),
+        read_timeout=float(os.environ.get('DYNAMODB_READ_TIMEOUT', 5)),
+        retries={
+            'mode': 'adaptive',
+            'max_attempts': int(os.environ.get('DYNAMODB_MAX_ATTEMPTS', 4)),
+        },
+    )
+
+
+def get_resource():
+    """
+    The DynamoDB service resource of the current process, created on first use.
+    """
+    global _resource, _resource_pid
+    pid = os.getpid()
+    if _resource is None or _resource_pid != pid:
+        with _lock:
+            if _resource is None or _resource_pid != pid:
+                resource = boto3.resource('dynamodb',
+                                          aws_access_key_id=secrets.AWS_ACCESS_KEY,
+                                          aws_secret_access_key=secrets.AWS_SECRET_KEY,
+                                          region_name=secrets.AWS_REGION_NAME,
+                                          endpoint_url=ENDPOINT_URL,
+                                          config=client_config())
+                metrics.instrument_dynamodb_client(resource.meta.client)
+                _resource, _resource_pid = resource, pid
+    return _resource
+
+
+def get_table(name):
+    return get_resource().Table(name)
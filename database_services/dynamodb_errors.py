@@ -6,10 +6,14 @@ class DynmamoDBErrors(Enum):
     WRONG_USER = 1
     COMMENT_NOT_FOUND = 2
     WRITE_WRITE_CONFLICT = 3
+    BATCH_UNPROCESSED = 4
+    IDEMPOTENCY_KEY_REUSED = 5
 
 
 error_status_mappings = {
     DynmamoDBErrors.WRONG_USER: HTTPStatus.FORBIDDEN,
     DynmamoDBErrors.COMMENT_NOT_FOUND: HTTPStatus.NOT_FOUND,
-    DynmamoDBErrors.WRITE_WRITE_CONFLICT: HTTPStatus.CONFLICT
+    DynmamoDBErrors.WRITE_WRITE_CONFLICT: HTTPStatus.CONFLICT,
+    DynmamoDBErrors.BATCH_UNPROCESSED: HTTPStatus.SERVICE_UNAVAILABLE,
+    DynmamoDBErrors.IDEMPOTENCY_KEY_REUSED: HTTPStatus.UNPROCESSABLE_ENTITY
 }
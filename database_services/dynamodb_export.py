@@ -0,0 +1,279 @@
+"""
+Full export of the comment table with a DynamoDB parallel scan (see bin/export_comments.py).
+
+The table is scanned as total_segments segments (Segment/TotalSegments) by a pool of threads.
+Each segment streams its items into its own chunk files in the output directory,
+
+    segment-0003-00000.ndjson, segment-0003-00001.ndjson, ...
+
+starting a new file every chunk_size items, and after every scan page saves a checkpoint,
+checkpoints/segment-0003.json, with the page's LastEvaluatedKey and the length of its current
+chunk file. Running the export again into the same directory resumes each unfinished segment
+from its checkpoint, first cutting its files back to the checkpointed length, so an interrupted
+export neither loses nor repeats items. manifest.json lists the files once every segment is done.
+
+All segments share one read-capacity budget (units per second), charged with the capacity each
+page reports, so an export can run next to live traffic.
+"""
+import concurrent.futures
+import csv
+import glob
+import io
+import json
+import logging
+import os
+import threading
+import time
+from decimal import Decimal
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+from database_services.dynamodb_schema import TOMBSTONE_SK_PREFIX
+
+logger = logging.getLogger()
+
+FORMATS = ('ndjson', 'csv')
+CHECKPOINT_DIR = 'checkpoints'
+MANIFEST = 'manifest.json'
+
+# columns of a csv export; comments and responses each fill in their own
+CSV_FIELDS = ['comment_id', 'sk', 'item_id', 'datetime', 'commenter_id', 'comment_text', 'response_count',
+              'response_id', 'responder_id', 'response_text', 'version_id', 'edited_at']
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+def _plain(value):
+    """
+    Converts the Decimals and sets boto3 returns to JSON types.
+    """
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, set)):
+        return [_plain(v) for v in value]
+    return value
+
+
+def _ndjson_row(item):
+    return (json.dumps(_plain(item), ensure_ascii=False, sort_keys=True, default=str) + '\n').encode('utf-8')
+
+
+def _csv_row(values):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue().encode('utf-8')
+
+
+def _format_row(fmt, item, fields):
+    if fmt == 'ndjson':
+        return _ndjson_row(item)
+    return _csv_row(['' if item.get(field) is None else _plain(item[field]) for field in fields])
+
+
+class CapacityBudget:
+    """
+    Read capacity units per second shared by every segment (0 for no limit). A page's cost is only
+    known once it has been read, so it is charged afterwards and the next page waits out any debt.
+    """
+
+    def __init__(self, units_per_second):
+        self.units_per_second = units_per_second
+        self._available = units_per_second
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.units_per_second:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._available = min(self.units_per_second,
+                                       self._available + (now - self._updated) * self.units_per_second)
+                self._updated = now
+                if self._available > 0:
+                    return
+                delay = -self._available / self.units_per_second
+            time.sleep(delay)
+
+    def charge(self, units):
+        if not self.units_per_second:
+            return
+        with self._lock:
+            self._available -= units
+
+
+def _chunk_path(out_dir, segment, chunk, fmt):
+    return os.path.join(out_dir, f'segment-{segment:04d}-{chunk:05d}.{fmt}')
+
+
+def _checkpoint_path(out_dir, segment):
+    return os.path.join(out_dir, CHECKPOINT_DIR, f'segment-{segment:04d}.json')
+
+
+def _load_checkpoint(out_dir, segment):
+    try:
+        with open(_checkpoint_path(out_dir, segment)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _save_checkpoint(out_dir, segment, checkpoint):
+    """
+    Replaces the checkpoint atomically, so a crash leaves either the old one or the new one.
+    """
+    path = _checkpoint_path(out_dir, segment)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def _discard_unrecorded(out_dir, segment, fmt, checkpoint):
+    """
+    Cuts a resumed segment's files back to its checkpoint: drops chunks started after it
+    and truncates the current chunk to the checkpointed length.
+    """
+    for path in glob.glob(os.path.join(out_dir, f'segment-{segment:04d}-*.{fmt}')):
+        if int(path[:-len(fmt) - 1].rsplit('-', 1)[1]) > checkpoint['chunk']:
+            os.remove(path)
+    path = _chunk_path(out_dir, segment, checkpoint['chunk'], fmt)
+    if os.path.exists(path):
+        with open(path, 'r+b') as f:
+            f.truncate(checkpoint['chunk_bytes'])
+
+
+def _open_chunk(out_dir, segment, fmt, checkpoint, fields):
+    """
+    Opens the segment's current chunk for appending; a new chunk starts with the csv header.
+    """
+    path = _chunk_path(out_dir, segment, checkpoint['chunk'], fmt)
+    if checkpoint['chunk_bytes']:
+        out = open(path, 'r+b')
+        out.seek(checkpoint['chunk_bytes'])
+        return out
+    out = open(path, 'wb')
+    if fmt == 'csv':
+        out.write(_csv_row(fields))
+    return out
+
+
+def export_segment(table, out_dir, segment, total_segments, fmt='ndjson', chunk_size=100000, budget=None,
+                   page_size=None, include_tombstones=False, fields=CSV_FIELDS, stop=None):
+    """
+    Scans one segment into its chunk files, resuming from its checkpoint if there is one.
+    stop: a threading.Event; once set, the segment returns after its current page
+    Returns: the segment's checkpoint ('done' is False if it was stopped)
+    """
+    checkpoint = _load_checkpoint(out_dir, segment)
+    if checkpoint is None:
+        checkpoint = {'total_segments': total_segments, 'format': fmt, 'fields': list(fields), 'chunk': 0,
+                      'chunk_items': 0, 'chunk_bytes': 0, 'items': 0, 'scanned': 0, 'start_key': None,
+                      'done': False}
+    elif (checkpoint['total_segments'], checkpoint['format'], checkpoint.get('fields', list(fields))) != \
+            (total_segments, fmt, list(fields)):
+        raise ValueError(f"{out_dir} holds a {checkpoint['format']} export in {checkpoint['total_segments']} "
+                         f"segments with fields {checkpoint.get('fields')}; resume it with the same settings "
+                         f"or export to a new directory")
+    if checkpoint['done']:
+        return checkpoint
+    _discard_unrecorded(out_dir, segment, fmt, checkpoint)
+
+    scan_args = {'Segment': segment, 'TotalSegments': total_segments, 'ReturnConsumedCapacity': 'TOTAL'}
+    if page_size:
+        scan_args['Limit'] = page_size
+    if not include_tombstones:
+        scan_args['FilterExpression'] = 'NOT begins_with(sk, :tombstone)'
+        scan_args['ExpressionAttributeValues'] = {':tombstone': TOMBSTONE_SK_PREFIX}
+
+    out = None
+    try:
+        while not (stop is not None and stop.is_set()):
+            if checkpoint['start_key'] is not None:
+                scan_args['ExclusiveStartKey'] = {k: _deserializer.deserialize(v)
+                                                  for k, v in checkpoint['start_key'].items()}
+            if budget is not None:
+                budget.wait()
+            response = table.scan(**scan_args)
+            if budget is not None:
+                budget.charge(response.get('ConsumedCapacity', {}).get('CapacityUnits', 0))
+
+            for item in response['Items']:
+                # also when resuming: the checkpointed chunk may already be full
+                if checkpoint['chunk_items'] >= chunk_size:
+                    if out is not None:
+                        out.close()
+                        out = None
+                    checkpoint['chunk'] += 1
+                    checkpoint['chunk_items'] = checkpoint['chunk_bytes'] = 0
+                if out is None:
+                    out = _open_chunk(out_dir, segment, fmt, checkpoint, fields)
+                out.write(_format_row(fmt, item, fields))
+                checkpoint['chunk_items'] += 1
+                checkpoint['items'] += 1
+
+            if out is not None:
+                out.flush()
+                os.fsync(out.fileno())
+                checkpoint['chunk_bytes'] = out.tell()
+            checkpoint['scanned'] += response['ScannedCount']
+            last_key = response.get('LastEvaluatedKey')
+            checkpoint['start_key'] = None if last_key is None else \
+                {k: _serializer.serialize(v) for k, v in last_key.items()}
+            checkpoint['done'] = last_key is None
+            _save_checkpoint(out_dir, segment, checkpoint)
+            if checkpoint['done']:
+                break
+    finally:
+        if out is not None:
+            out.close()
+    return checkpoint
+
+
+def export_table(table, out_dir, total_segments=16, workers=None, fmt='ndjson', chunk_size=100000,
+                 read_units_per_second=0, page_size=None, include_tombstones=False, fields=CSV_FIELDS):
+    """
+    Exports the whole table into out_dir with total_segments segments on workers threads
+    (default one per segment), then writes manifest.json. Safe to re-run to resume.
+    Returns: the manifest, {'format', 'total_segments', 'items', 'scanned', 'seconds', 'files'}
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    os.makedirs(os.path.join(out_dir, CHECKPOINT_DIR), exist_ok=True)
+    budget = CapacityBudget(read_units_per_second)
+    stop = threading.Event()
+    start = time.perf_counter()
+
+    checkpoints = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers or total_segments,
+                                               thread_name_prefix='export') as pool:
+        futures = {pool.submit(export_segment, table, out_dir, segment, total_segments, fmt, chunk_size, budget,
+                               page_size, include_tombstones, fields, stop): segment
+                   for segment in range(total_segments)}
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                segment = futures[future]
+                checkpoints[segment] = future.result()
+                logger.info(f"export segment {segment} done: {checkpoints[segment]['items']} items "
+                            f"({len(checkpoints)}/{total_segments} segments)")
+        except BaseException:
+            # the other segments stop after their current page; their checkpoints let a re-run resume
+            stop.set()
+            raise
+
+    manifest = {
+        'format': fmt,
+        'total_segments': total_segments,
+        'items': sum(c['items'] for c in checkpoints.values()),
+        'scanned': sum(c['scanned'] for c in checkpoints.values()),
+        'seconds': round(time.perf_counter() - start, 3),
+        'files': sorted(os.path.basename(path) for path in glob.glob(os.path.join(out_dir, f'segment-*.{fmt}'))),
+    }
+    with open(os.path.join(out_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
@@ -0,0 +1,136 @@
+"""
+Converts comments from the legacy table, where responses were a list attribute
+on the comment item, to the adjacency-list layout in dynamodb_schema.COMMENT_TABLE.
+
+Migrated responses get new, time-ordered response ids (see convert_comment).
+"""
+import calendar
+import hashlib
+import logging
+import time
+import uuid
+
+from database_services import dynamodb_service as service
+from database_services.dynamodb_schema import ITEM_INDEX_NAME
+
+logger = logging.getLogger()
+
+
+def _datetime_millis(value):
+    """
+    Milliseconds since the epoch of a stored datetime ('%Y-%m-%d %H:%M:%S', UTC), or None.
+    """
+    try:
+        return calendar.timegm(time.strptime(value, '%Y-%m-%d %H:%M:%S')) * 1000
+    except (TypeError, ValueError):
+        return None
+
+
+def _migrated_response_id(millis, comment_id, legacy_response_id):
+    """
+    A UUIDv7 response id for a legacy response: its timestamp is the response's time, and its
+    random bits are derived from the legacy id, so re-running the migration mints the same id.
+    """
+    seed = hashlib.sha256(f'{comment_id}/{legacy_response_id}'.encode('utf-8')).digest()
+    random_bits = int.from_bytes(seed[:8], 'big') & ((1 << 62) - 1)
+    return str(uuid.UUID(int=(millis << 80) | (0x7 << 76) | (0b10 << 62) | random_bits))
+
+
+def convert_comment(legacy_comment):
+    """
+    Splits one legacy comment item into the comment item and one item per response, stamped for
+    the changes feed as a post would be (see dynamodb_service.stored_thread).
+    Legacy response ids are random, and response sort keys are built from the id, so responses
+    get time-ordered ids minted from their datetime; the old id is kept as legacy_response_id.
+    Responses keep their list order: each sorts at least a millisecond after the one before.
+    Returns: a list of items for the new table, the comment item first
+    """
+    comment = {k: v for k, v in legacy_comment.items() if k != 'responses'}
+    millis = _datetime_millis(comment.get('datetime')) or 0
+
+    responses = []
+    for legacy_response in legacy_comment.get('responses', []):
+        millis = max(_datetime_millis(legacy_response.get('datetime')) or 0, millis + 1)
+        response = dict(legacy_response)
+        response['comment_id'] = legacy_comment['comment_id']
+        response['legacy_response_id'] = legacy_response['response_id']
+        response['response_id'] = _migrated_response_id(millis, legacy_comment['comment_id'],
+                                                        legacy_response['response_id'])
+        responses.append(response)
+    return service.stored_thread(comment, responses)
+
+
+def iter_legacy_comments(source_table):
+    """
+    Generator over every item in the legacy table, following LastEvaluatedKey.
+    """
+    scan_args = {}
+    while True:
+        response = source_table.scan(**scan_args)
+        yield from response['Items']
+        if 'LastEvaluatedKey' not in response:
+            return
+        scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def migrate(source_table, target_table, dry_run=False):
+    """
+    Copies every legacy comment into the target table in the new layout.
+    Writes are plain puts, so re-running the migration is safe.
+    Returns: (comments migrated, responses migrated)
+    """
+    comments = responses = 0
+    if dry_run:
+        for legacy_comment in iter_legacy_comments(source_table):
+            comments += 1
+            responses += len(convert_comment(legacy_comment)) - 1
+        return comments, responses
+
+    with target_table.batch_writer() as batch:
+        for legacy_comment in iter_legacy_comments(source_table):
+            items = convert_comment(legacy_comment)
+            for item in items:
+                batch.put_item(Item=item)
+            comments += 1
+            responses += len(items) - 1
+            if comments % 1000 == 0:
+                logger.info(f"migrated {comments} comments, {responses} responses")
+    return comments, responses
+
+
+def backfill_summaries(comment_table, summary_table):
+    """
+    Rebuilds every item's summary (see dynamodb_service.get_item_summary) from the comments in the
+    item_id-datetime-index, for comments written before the summary table existed, e.g. by migrate.
+    Summaries are replaced, not added to, so re-running is safe; posts made while it runs may be lost
+    from the counts, so run it before the service takes writes. last_activity is the newest comment's time.
+    Returns: the number of items summarized
+    """
+    summaries = {}
+    scan_args = {
+        'IndexName': ITEM_INDEX_NAME,
+        'ProjectionExpression': '#item_id, #comment_id, #datetime, #response_count',
+        'ExpressionAttributeNames': {'#item_id': 'item_id', '#comment_id': 'comment_id', '#datetime': 'datetime',
+                                     '#response_count': 'response_count'},
+    }
+    while True:
+        response = comment_table.scan(**scan_args)
+        for comment in response['Items']:
+            summary = summaries.setdefault(comment['item_id'], {'comment_count': 0, 'response_count': 0,
+                                                                'newest': []})
+            summary['comment_count'] += 1
+            summary['response_count'] += int(comment.get('response_count', 0))
+            summary['newest'].append((comment.get('datetime') or '', comment['comment_id']))
+            if len(summary['newest']) > 2 * service.LATEST_COMMENT_IDS:
+                summary['newest'] = sorted(summary['newest'])[-service.LATEST_COMMENT_IDS:]
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    with summary_table.batch_writer() as batch:
+        for item_id, summary in summaries.items():
+            newest = sorted(summary['newest'], reverse=True)[:service.LATEST_COMMENT_IDS]
+            batch.put_item(Item={'item_id': item_id, 'comment_count': summary['comment_count'],
+                                 'response_count': summary['response_count'], 'last_activity': newest[0][0],
+                                 'latest_comment_ids': [comment_id for _, comment_id in newest]})
+    return len(summaries)
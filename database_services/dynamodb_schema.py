@@ -0,0 +1,189 @@
+"""
+Table and index definitions for the comment-response DynamoDB tables.
+
+Running this module creates any missing tables and indexes:
+
+    $ python -m database_services.dynamodb_schema
+"""
+import logging
+import os
+import time
+
+from botocore.exceptions import ClientError
+
+from database_services.dynamodb_connection import get_resource
+
+logger = logging.getLogger()
+
+# how often create_tables checks on a table or index that is still being built
+POLL_SECONDS = 20
+
+COMMENT_TABLE_NAME = os.environ.get('COMMENT_TABLE_NAME', 'comment-response-v2')
+
+# the original table, which kept responses in a list on the comment item;
+# see database_services/dynamodb_migration.py
+LEGACY_COMMENT_TABLE_NAME = os.environ.get('LEGACY_COMMENT_TABLE_NAME', 'comment-response')
+
+# A comment and its responses share the comment_id partition (an adjacency list).
+# The comment item has sk=COMMENT and each response has sk=RESPONSE#<response_id>,
+# so a whole thread is one Query and a single response is one key lookup.
+COMMENT_SK = 'COMMENT'
+RESPONSE_SK_PREFIX = 'RESPONSE#'
+# A deleted comment or response leaves a tombstone in its partition, sk=TOMBSTONE#<its sk>,
+# which expires (TTL on expires_at) once clients can no longer ask for changes that old.
+TOMBSTONE_SK_PREFIX = 'TOMBSTONE#'
+TTL_ATTRIBUTE = 'expires_at'
+
+# Comments for one item, sorted by creation time. Item listings query this
+# index instead of scanning the whole table. Only comment items carry item_id,
+# so responses are not part of the index.
+ITEM_INDEX_NAME = 'item_id-datetime-index'
+
+ITEM_INDEX = {
+    'IndexName': ITEM_INDEX_NAME,
+    'KeySchema': [
+        {'AttributeName': 'item_id', 'KeyType': 'HASH'},
+        {'AttributeName': 'datetime', 'KeyType': 'RANGE'},
+    ],
+    'Projection': {'ProjectionType': 'ALL'},
+}
+
+# Comments by one user, sorted by creation time, for "my activity" pages and templates that name
+# commenter_id. Responses carry responder_id instead, so they are not part of the index either.
+COMMENTER_INDEX_NAME = 'commenter_id-datetime-index'
+
+COMMENTER_INDEX = {
+    'IndexName': COMMENTER_INDEX_NAME,
+    'KeySchema': [
+        {'AttributeName': 'commenter_id', 'KeyType': 'HASH'},
+        {'AttributeName': 'datetime', 'KeyType': 'RANGE'},
+    ],
+    'Projection': {'ProjectionType': 'ALL'},
+}
+
+# Every write stamps the comment or response with change_item_id (its item) and change_seq
+# (a time-ordered id, so later changes sort later); tombstones carry them too. Polling an item
+# for changes is a Query on this index from the last change_seq seen.
+CHANGES_INDEX_NAME = 'change_item_id-change_seq-index'
+
+CHANGES_INDEX = {
+    'IndexName': CHANGES_INDEX_NAME,
+    'KeySchema': [
+        {'AttributeName': 'change_item_id', 'KeyType': 'HASH'},
+        {'AttributeName': 'change_seq', 'KeyType': 'RANGE'},
+    ],
+    'Projection': {'ProjectionType': 'ALL'},
+}
+
+COMMENT_TABLE = {
+    'TableName': COMMENT_TABLE_NAME,
+    'KeySchema': [
+        {'AttributeName': 'comment_id', 'KeyType': 'HASH'},
+        {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+    ],
+    'AttributeDefinitions': [
+        {'AttributeName': 'comment_id', 'AttributeType': 'S'},
+        {'AttributeName': 'sk', 'AttributeType': 'S'},
+        {'AttributeName': 'item_id', 'AttributeType': 'S'},
+        {'AttributeName': 'commenter_id', 'AttributeType': 'S'},
+        {'AttributeName': 'datetime', 'AttributeType': 'S'},
+        {'AttributeName': 'change_item_id', 'AttributeType': 'S'},
+        {'AttributeName': 'change_seq', 'AttributeType': 'S'},
+    ],
+    'GlobalSecondaryIndexes': [ITEM_INDEX, COMMENTER_INDEX, CHANGES_INDEX],
+    'BillingMode': 'PAY_PER_REQUEST',
+}
+
+# Per-item aggregates (comment_count, response_count, last_activity, latest_comment_ids),
+# kept up to date by every write so catalog pages can show counts without reading comments.
+SUMMARY_TABLE_NAME = os.environ.get('SUMMARY_TABLE_NAME', 'comment-item-summary')
+
+SUMMARY_TABLE = {
+    'TableName': SUMMARY_TABLE_NAME,
+    'KeySchema': [
+        {'AttributeName': 'item_id', 'KeyType': 'HASH'},
+    ],
+    'AttributeDefinitions': [
+        {'AttributeName': 'item_id', 'AttributeType': 'S'},
+    ],
+    'BillingMode': 'PAY_PER_REQUEST',
+}
+
+# Idempotency-Key records: the result of a post, written in the same transaction as the post
+# itself, so a retried post finds it instead of posting again. They expire on expires_at.
+IDEMPOTENCY_TABLE_NAME = os.environ.get('IDEMPOTENCY_TABLE_NAME', 'comment-idempotency')
+
+IDEMPOTENCY_TABLE = {
+    'TableName': IDEMPOTENCY_TABLE_NAME,
+    'KeySchema': [
+        {'AttributeName': 'idempotency_key', 'KeyType': 'HASH'},
+    ],
+    'AttributeDefinitions': [
+        {'AttributeName': 'idempotency_key', 'AttributeType': 'S'},
+    ],
+    'BillingMode': 'PAY_PER_REQUEST',
+}
+
+TABLES = [COMMENT_TABLE, SUMMARY_TABLE, IDEMPOTENCY_TABLE]
+
+# tables whose items expire, by TTL attribute
+TIME_TO_LIVE = {COMMENT_TABLE_NAME: TTL_ATTRIBUTE, IDEMPOTENCY_TABLE_NAME: TTL_ATTRIBUTE}
+
+
+def wait_until_active(client, table_name, poll_seconds=POLL_SECONDS):
+    """
+    Waits until the table and all of its global secondary indexes are ACTIVE. DynamoDB builds
+    one index of a table at a time, so another index can only be added once this returns.
+    Returns the table's description.
+    """
+    while True:
+        description = client.describe_table(TableName=table_name)['Table']
+        building = [index['IndexName'] for index in description.get('GlobalSecondaryIndexes', [])
+                    if index.get('IndexStatus', 'ACTIVE') != 'ACTIVE']
+        if description['TableStatus'] == 'ACTIVE' and not building:
+            return description
+        logger.info(f"waiting for {table_name} ({description['TableStatus']}) and its indexes {building}")
+        time.sleep(poll_seconds)
+
+
+def create_tables(dynamodb, poll_seconds=POLL_SECONDS):
+    """
+    Creates every table in TABLES that does not exist yet, adds any global secondary
+    index that is missing from an existing table, and turns on TIME_TO_LIVE.
+    Missing indexes are added one at a time, each once the previous one is built,
+    so upgrading a large table can take a while.
+    dynamodb: a boto3 DynamoDB service resource
+    """
+    client = dynamodb.meta.client
+    for definition in TABLES:
+        try:
+            description = client.describe_table(TableName=definition['TableName'])['Table']
+        except ClientError as err:
+            if err.response['Error']['Code'] != 'ResourceNotFoundException':
+                raise
+            dynamodb.create_table(**definition)
+            continue
+
+        existing = {index['IndexName'] for index in description.get('GlobalSecondaryIndexes', [])}
+        for index in definition.get('GlobalSecondaryIndexes', []):
+            if index['IndexName'] in existing:
+                continue
+            wait_until_active(client, definition['TableName'], poll_seconds)
+            names = {key['AttributeName'] for key in index['KeySchema']}
+            client.update_table(
+                TableName=definition['TableName'],
+                AttributeDefinitions=[a for a in definition['AttributeDefinitions'] if a['AttributeName'] in names],
+                GlobalSecondaryIndexUpdates=[{'Create': index}]
+            )
+
+    for table_name, attribute in TIME_TO_LIVE.items():
+        client.get_waiter('table_exists').wait(TableName=table_name)
+        status = client.describe_time_to_live(TableName=table_name)['TimeToLiveDescription']
+        if status['TimeToLiveStatus'] in ('DISABLED', 'DISABLING'):
+            client.update_time_to_live(TableName=table_name,
+                                       TimeToLiveSpecification={'Enabled': True, 'AttributeName': attribute})
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    create_tables(get_resource())
@@ -0,0 +1,233 @@
+"""
+Bulk loading of comments and responses for load tests and staging (see bin/seed_comments.py).
+
+Threads (a comment and its responses) are either generated -- items from the art catalog with
+Zipf-skewed popularity, heavy-tailed response counts, datetimes spread over the last days -- or
+read from an NDJSON file. Each thread becomes the items post_comment and add_responses store
+(dynamodb_service.stored_thread), written 25 per BatchWriteItem by a pool of writer threads that
+retry UnprocessedItems with backoff and share a write-capacity budget. Item summaries get one
+update per item once everything is written.
+
+It writes through dynamodb_connection.get_resource, so DYNAMODB_ENDPOINT_URL points it at
+DynamoDB Local, and the benchmarks' in-memory stand-in works as well.
+"""
+import csv
+import heapq
+import json
+import logging
+import queue
+import random
+import threading
+import time
+
+from database_services import dynamodb_service as service
+from database_services.dynamodb_connection import get_resource
+from database_services.dynamodb_export import CapacityBudget
+from database_services.dynamodb_schema import COMMENT_TABLE_NAME
+
+logger = logging.getLogger()
+
+WORDS = ('the colour of this piece is lovely and I like how the light falls across canvas with '
+         'graphite lines texture warm cool bold quiet detail scale frame wall room would look great in '
+         'my kitchen does it come larger smaller framed ship soon price print original series artist').split()
+
+
+def catalog_item_ids(path):
+    """
+    The item ids of the art catalog CSV (its header has stray spaces, e.g. "item_id ").
+    """
+    with open(path, newline='') as f:
+        rows = [{k.strip(): v for k, v in row.items() if k} for row in csv.DictReader(f)]
+    return [row['item_id'].strip() for row in rows if row.get('item_id', '').strip()]
+
+
+def _format_datetime(seconds):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(seconds))
+
+
+def _text(rng, low, high):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+
+def generate_threads(item_ids, comments, users=10000, zipf_exponent=1.1, response_alpha=1.3, max_responses=500,
+                     days=365, rng=None):
+    """
+    Generator of comment threads: (comment, responses).
+    Item popularity follows Zipf's law by catalog order (the item of rank r gets weight 1 / r ** zipf_exponent);
+    a comment has int(paretovariate(response_alpha)) - 1 responses, so most have none or a few and some
+    have very long threads. Comments are spread over the last days, responses follow their comment.
+    """
+    rng = rng or random.Random()
+    cum_weights, total = [], 0.0
+    for rank in range(1, len(item_ids) + 1):
+        total += 1 / rank ** zipf_exponent
+        cum_weights.append(total)
+    end = time.time()
+    start = end - days * 86400
+
+    for _ in range(comments):
+        item_id = rng.choices(item_ids, cum_weights=cum_weights)[0]
+        posted = rng.uniform(start, end)
+        comment = service.new_comment(item_id, f"user-{rng.randrange(users)}", _text(rng, 5, 80))
+        comment['datetime'] = _format_datetime(posted)
+        responses = []
+        for _ in range(min(max_responses, int(rng.paretovariate(response_alpha)) - 1)):
+            posted = min(end, posted + rng.expovariate(1 / 3600))
+            response = service.new_response(comment['comment_id'], f"user-{rng.randrange(users)}",
+                                            _text(rng, 3, 40))
+            response['datetime'] = _format_datetime(posted)
+            responses.append(response)
+        yield comment, responses
+
+
+def read_threads(path):
+    """
+    Generator of comment threads from an NDJSON file, one comment per line:
+        {"item_id", "commenter_id", "comment_text", "datetime"?,
+         "responses"?: [{"responder_id", "response_text", "datetime"?}, ...]}
+    Ids and versions are assigned as on a post; a missing datetime means now.
+    """
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            comment = service.new_comment(record['item_id'], record['commenter_id'], record['comment_text'])
+            comment['datetime'] = record.get('datetime') or comment['datetime']
+            responses = []
+            for entry in record.get('responses', []):
+                response = service.new_response(comment['comment_id'], entry['responder_id'],
+                                                entry['response_text'])
+                response['datetime'] = entry.get('datetime') or response['datetime']
+                responses.append(response)
+            yield comment, responses
+
+
+class BulkLoadError(Exception):
+    pass
+
+
+class _ItemTotals:
+    """
+    What one item's summary gains from the load; keeps only the newest comment ids.
+    """
+
+    def __init__(self):
+        self.comments = 0
+        self.responses = 0
+        self.last_activity = ''
+        self.newest = []  # heap of (datetime, comment_id)
+
+    def add(self, comment, responses):
+        self.comments += 1
+        self.responses += len(responses)
+        self.last_activity = max([self.last_activity, comment['datetime']] + [r['datetime'] for r in responses])
+        entry = (comment['datetime'], comment['comment_id'])
+        if len(self.newest) < service.LATEST_COMMENT_IDS:
+            heapq.heappush(self.newest, entry)
+        else:
+            heapq.heappushpop(self.newest, entry)
+
+
+def _write_batch(requests, budget, max_attempts):
+    """
+    One BatchWriteItem of up to 25 puts, retrying UnprocessedItems with backoff.
+    Returns: the number of retried calls
+    """
+    pending = requests
+    for attempt in range(max_attempts):
+        if attempt:
+            time.sleep(random.uniform(0, min(2.0, 0.05 * (2 ** attempt))))
+        budget.wait()
+        response = get_resource().batch_write_item(RequestItems={COMMENT_TABLE_NAME: pending},
+                                                   ReturnConsumedCapacity='TOTAL')
+        consumed = response.get('ConsumedCapacity')
+        # stand-ins that do not report capacity are charged a unit per item
+        budget.charge(sum(c.get('CapacityUnits', 0) for c in consumed) if consumed else len(pending))
+        pending = response.get('UnprocessedItems', {}).get(COMMENT_TABLE_NAME, [])
+        if not pending:
+            return attempt
+    raise BulkLoadError(f"{len(pending)} items still unprocessed after {max_attempts} attempts")
+
+
+def load_threads(threads, workers=8, write_units_per_second=0, max_attempts=10, progress_every=100000):
+    """
+    Writes comment threads with workers parallel BatchWriteItem writers, then updates each item's summary.
+    write_units_per_second: write capacity the whole load may use per second (0 for no limit)
+    A batch that still has unprocessed items after max_attempts calls stops the load with BulkLoadError;
+    summaries are only updated when everything was written.
+    Returns: {'comments', 'responses', 'items', 'batches', 'retries', 'seconds', 'items_per_second'}
+    """
+    budget = CapacityBudget(write_units_per_second)
+    batches = queue.Queue(maxsize=workers * 4)
+    stop = threading.Event()
+    errors = []
+    counts = {'batches': 0, 'retries': 0}
+    lock = threading.Lock()
+
+    def writer():
+        while True:
+            requests = batches.get()
+            if requests is None:
+                return
+            if stop.is_set():
+                continue
+            try:
+                retries = _write_batch(requests, budget, max_attempts)
+            except Exception as err:
+                errors.append(err)
+                stop.set()
+                continue
+            with lock:
+                counts['batches'] += 1
+                counts['retries'] += retries
+
+    def enqueue(requests):
+        while not stop.is_set():
+            try:
+                batches.put(requests, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    start = time.perf_counter()
+    pool = [threading.Thread(target=writer, name=f"seed-writer-{n}", daemon=True) for n in range(workers)]
+    for thread in pool:
+        thread.start()
+
+    totals = {}
+    comments = responses = items = 0
+    pending = []
+    try:
+        for comment, thread_responses in threads:
+            if stop.is_set():
+                break
+            for item in service.stored_thread(comment, thread_responses):
+                pending.append({'PutRequest': {'Item': item}})
+                if len(pending) == service.BATCH_WRITE_LIMIT:
+                    enqueue(pending)
+                    pending = []
+            totals.setdefault(comment['item_id'], _ItemTotals()).add(comment, thread_responses)
+            comments += 1
+            responses += len(thread_responses)
+            items += 1 + len(thread_responses)
+            if progress_every and comments % progress_every == 0:
+                logger.info(f"queued {comments} comments, {responses} responses "
+                            f"({items / (time.perf_counter() - start):.0f} items/s)")
+        if pending:
+            enqueue(pending)
+    finally:
+        for _ in pool:
+            batches.put(None)
+        for thread in pool:
+            thread.join()
+    if errors:
+        raise errors[0]
+
+    for item_id, item_totals in totals.items():
+        service.record_bulk_load(item_id, [comment_id for _, comment_id in sorted(item_totals.newest)],
+                                 item_totals.comments, item_totals.responses, item_totals.last_activity)
+
+    seconds = time.perf_counter() - start
+    return {'comments': comments, 'responses': responses, 'items': items, **counts,
+            'seconds': round(seconds, 3), 'items_per_second': round(items / seconds) if seconds else None}
@@ -1,154 +1,1258 @@
-import json
+import concurrent.futures
+import functools
 import logging
-import boto3
+import os
+import random
+import threading
 import time
 import uuid
-from pprint import pprint
+from collections import OrderedDict
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
 from botocore.exceptions import ClientError
 
 import middleware.context as context
-import database_services.dynamodb_secrets as secrets
+from middleware import metrics
+from database_services.dynamodb_connection import get_resource, get_table
+from database_services.dynamodb_schema import COMMENT_TABLE_NAME, ITEM_INDEX_NAME, COMMENT_SK, RESPONSE_SK_PREFIX, \
+    SUMMARY_TABLE_NAME, CHANGES_INDEX_NAME, TOMBSTONE_SK_PREFIX, TTL_ATTRIBUTE, COMMENTER_INDEX_NAME, \
+    IDEMPOTENCY_TABLE_NAME
 from database_services.dynamodb_errors import DynmamoDBErrors as e
+from database_services.cache import create_cache, NullCache
+from database_services.single_flight import SingleFlight
+from database_services.base_data_resource import BaseDataResource, BaseDataException, encode_cursor, decode_cursor, \
+    RESPONSE_FIELDS, ALL_RESPONSES, projected_attributes, project_thread, ChangesExpiredException, \
+    CapacityExceededException, ScanInterruptedException, check_template, KEY_LOOKUP, INDEX_QUERY, SCAN
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
-class DynamoDBServiceException(Exception):
-    def __init__(self, msg):
-        self.msg = msg
+class DynamoDBServiceException(BaseDataException):
+    pass
 
 
-dynamodb = boto3.resource('dynamodb',
-                          aws_access_key_id=secrets.AWS_ACCESS_KEY,
-                          aws_secret_access_key=secrets.AWS_SECRET_KEY,
-                          region_name=secrets.AWS_REGION_NAME)
+def _table():
+    return get_table(COMMENT_TABLE_NAME)
 
 
-# other_client = boto3.client("dynamodb")
+def _summary_table():
+    return get_table(SUMMARY_TABLE_NAME)
 
-table = dynamodb.Table('comment-response')
 
+def _idempotency_table():
+    return get_table(IDEMPOTENCY_TABLE_NAME)
 
-# TODO: incoorporate offset, limit/pagination
+
+# errors DynamoDB answers with when a table or the account is over capacity
+THROTTLING_ERROR_CODES = frozenset(['ProvisionedThroughputExceededException', 'ThrottlingException',
+                                    'RequestLimitExceeded'])
+# the same, as transaction cancellation reasons
+THROTTLING_CANCELLATION_CODES = frozenset(['ProvisionedThroughputExceeded', 'ThrottlingError'])
+
+
+def _throttled(err):
+    """
+    Whether a ClientError means DynamoDB is throttling, including a transaction cancelled for that reason.
+    """
+    code = err.response['Error']['Code']
+    if code == 'TransactionCanceledException':
+        return any(reason.get('Code') in THROTTLING_CANCELLATION_CODES
+                   for reason in err.response.get('CancellationReasons') or [])
+    return code in THROTTLING_ERROR_CODES
+
+
+def timed(fn):
+    """
+    Decorates each public function below: times it (DynamoDB calls and capacity are attributed to it)
+    and raises CapacityExceededException when DynamoDB is still throttling after botocore's retries.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except ClientError as err:
+            if _throttled(err):
+                raise CapacityExceededException("DynamoDB is over capacity, please retry") from err
+            raise
+    return metrics.timed_function(metrics.DYNAMODB_FUNCTION_SECONDS)(wrapper)
+
+DEFAULT_PAGE_LIMIT = BaseDataResource.DEFAULT_PAGE_LIMIT
+MAX_PAGE_LIMIT = BaseDataResource.MAX_PAGE_LIMIT
+
+# DynamoDB's per-call limits for BatchGetItem and BatchWriteItem
+BATCH_GET_LIMIT = 100
+BATCH_WRITE_LIMIT = 25
+BATCH_MAX_ATTEMPTS = 6
+# DynamoDB's limit of actions in one TransactWriteItems call
+TRANSACT_WRITE_LIMIT = 100
+
+# how many of an item's newest comment ids its summary keeps
+LATEST_COMMENT_IDS = 5
+MAX_BATCH_SIZE = BaseDataResource.MAX_BATCH_SIZE
+
+# How long deletes are remembered (tombstone TTL), and so the oldest since token accepted.
+CHANGE_HISTORY_SECONDS = int(os.environ.get('CHANGE_HISTORY_SECONDS', 7 * 24 * 3600))
+# Writes are stamped with their change_seq just before they are sent, so a write from another
+# worker may commit with a slightly older change_seq than one already read. Polls never move
+# their token into the last CHANGES_SETTLE_SECONDS, so such writes are picked up by the next poll.
+CHANGES_SETTLE_SECONDS = float(os.environ.get('CHANGES_SETTLE_SECONDS', 2))
+
+# Global secondary indexes a template can be answered from, by hash key: (index, range key).
+# A user has fewer comments than a popular item, so commenter_id is tried first.
+TEMPLATE_INDEXES = {
+    'commenter_id': (COMMENTER_INDEX_NAME, 'datetime'),
+    'item_id': (ITEM_INDEX_NAME, 'datetime'),
+}
+
+# attributes only used for keys and indexes, never returned
+STORAGE_ATTRIBUTES = frozenset(['sk', 'change_item_id', 'change_seq'])
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+# Read-through cache for single comments and item listings: "none", "memory" or a redis:// URL.
+cache = create_cache(os.environ.get('COMMENT_CACHE_BACKEND', 'none'),
+                     max_entries=int(os.environ.get('COMMENT_CACHE_MAX_ENTRIES', 10000)),
+                     default_ttl=int(os.environ.get('COMMENT_CACHE_TTL', 30)))
+
+# Reads the response partitions of a listing page in parallel (see _attach_responses); threads
+# are started on first use, so a preloaded app forks without them.
+RESPONSE_READ_WORKERS = int(os.environ.get('RESPONSE_READ_WORKERS', 8))
+response_readers = concurrent.futures.ThreadPoolExecutor(max_workers=RESPONSE_READ_WORKERS,
+                                                         thread_name_prefix='responses')
+
+# Concurrent identical reads in this worker share one DynamoDB call (see single_flight).
+reads = SingleFlight(enabled=os.environ.get('READ_COALESCING', 'true').lower() == 'true')
+
+
+def _comment_key(comment_id):
+    return {'comment_id': comment_id, 'sk': COMMENT_SK}
+
+
+def _response_key(comment_id, response_id):
+    return {'comment_id': comment_id, 'sk': RESPONSE_SK_PREFIX + response_id}
+
+
+def _strip_keys(item):
+    """
+    Drops the storage-only sort key and change stamp so callers see the same shape as before
+    the adjacency-list layout.
+    """
+    return {k: v for k, v in item.items() if k not in STORAGE_ATTRIBUTES}
+
+
+def _serialize(values):
+    """
+    Converts a dict of python values to the low-level attribute format used by transact_write_items.
+    """
+    return {k: _serializer.serialize(v) for k, v in values.items()}
+
+
+def _current_datetime():
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time()))
+
+
+_id_lock = threading.Lock()
+_last_id_timestamp = [0, 0]
+
+
+def _time_ordered_id():
+    """
+    A UUIDv7 id: a millisecond timestamp, a per-process sequence number, then random bits.
+    Response sort keys embed this id, so a thread's responses come back in creation order.
+    """
+    with _id_lock:
+        millis = int(time.time() * 1000)
+        if millis <= _last_id_timestamp[0] and _last_id_timestamp[1] < 0xFFF:
+            millis = _last_id_timestamp[0]
+            _last_id_timestamp[1] += 1
+        else:
+            millis = max(millis, _last_id_timestamp[0] + 1)
+            _last_id_timestamp[1] = 0
+        _last_id_timestamp[0] = millis
+        sequence = _last_id_timestamp[1]
+    random_bits = uuid.uuid4().int & ((1 << 62) - 1)
+    return str(uuid.UUID(int=(millis << 80) | (0x7 << 76) | (sequence << 64) | (0b10 << 62) | random_bits))
+
+
+def _stamp(item, item_id):
+    """
+    Marks an item as changed now, which puts it in its item's changes index.
+    """
+    return {**item, 'change_item_id': item_id, 'change_seq': _time_ordered_id()}
+
+
+def _tombstone(key, item_id):
+    """
+    The item a delete leaves behind for the changes index, until it expires with the change history.
+    """
+    return _stamp({'comment_id': key['comment_id'], 'sk': TOMBSTONE_SK_PREFIX + key['sk'],
+                   TTL_ATTRIBUTE: int(time.time()) + CHANGE_HISTORY_SECONDS}, item_id)
+
+
+def _change_marker(seconds_ago=0.0):
+    """
+    A change_seq that sorts before every change stamped from seconds_ago seconds ago onwards.
+    """
+    return str(uuid.UUID(int=int((time.time() - seconds_ago) * 1000) << 80))
+
+
+def _iter_query(**query_args):
+    """
+    Generator over every item matched by a query, following LastEvaluatedKey.
+    """
+    while True:
+        response = _table().query(**query_args)
+        yield from response['Items']
+        if 'LastEvaluatedKey' not in response:
+            return
+        query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def _iter_thread_items(comment_id):
+    return _iter_query(
+        KeyConditionExpression='comment_id = :comment_id',
+        ExpressionAttributeValues={':comment_id': comment_id}
+    )
+
+
+def _projection(attributes):
+    """
+    ProjectionExpression arguments reading only the given attributes.
+    Every name goes through ExpressionAttributeNames, so reserved words need no special care.
+    """
+    names = {f'#p{i}': name for i, name in enumerate(sorted(attributes))}
+    return {'ProjectionExpression': ', '.join(names), 'ExpressionAttributeNames': names}
+
+
+def _read_responses(comment_id, include_responses):
+    """
+    The responses of one comment, oldest first; only the first N for first:N.
+    """
+    mode, first = include_responses
+    query_args = {
+        'KeyConditionExpression': 'comment_id = :comment_id AND begins_with(sk, :prefix)',
+        'ExpressionAttributeValues': {':comment_id': comment_id, ':prefix': RESPONSE_SK_PREFIX},
+    }
+    if mode == 'first':
+        responses = _table().query(Limit=first, **query_args)['Items']
+    else:
+        responses = _iter_query(**query_args)
+    return [_strip_keys(r) for r in responses]
+
+
+def _attach_responses(comments, include_responses=ALL_RESPONSES):
+    """
+    Adds the responses list to comment items read without their responses (e.g. from the item index).
+    Comments without responses cost no extra calls, and neither do the none and count modes;
+    first:N reads only the first N responses.
+    Each thread is its own partition, so the partitions of a page are read in parallel on
+    response_readers, and a page takes about as long as its longest thread rather than the sum.
+    """
+    mode, _ = include_responses
+    if mode in ('none', 'count'):
+        return [_strip_keys(c) for c in comments]
+
+    threads = [c for c in comments if c.get('response_count', 0) > 0]
+    for comment in comments:
+        comment['responses'] = []
+    if len(threads) == 1:
+        threads[0]['responses'] = _read_responses(threads[0]['comment_id'], include_responses)
+    elif threads:
+        read = metrics.attributed(_read_responses)
+        futures = [response_readers.submit(read, c['comment_id'], include_responses) for c in threads]
+        for comment, future in zip(threads, futures):
+            comment['responses'] = future.result()
+    return [_strip_keys(c) for c in comments]
+
+
+def _group_threads(items):
+    """
+    Regroups a stream of table items into comments with their responses lists.
+    Relies on scans and queries returning a partition's items together, sorted by sk,
+    so the comment item (sk=COMMENT) always precedes its responses.
+    Responses whose comment was not part of the stream (e.g. when resuming mid-thread) are skipped.
+    """
+    current = None
+    for item in items:
+        if item['sk'] == COMMENT_SK:
+            if current is not None:
+                yield current
+            current = _strip_keys(item)
+            current['responses'] = []
+        elif current is not None and item['comment_id'] == current['comment_id'] \
+                and item['sk'].startswith(RESPONSE_SK_PREFIX):
+            current['responses'].append(_strip_keys(item))
+    if current is not None:
+        yield current
+
+
+@timed
+def iter_all_comments(page_size=None, cursor=None):
+    """
+    Generator over every comment in the table, each with its responses.
+    Follows LastEvaluatedKey from page to page, so only one scan page is held in memory at a time.
+    page_size: optional Limit for each underlying scan call
+    cursor: continuation cursor to resume the scan from
+    The scan calls run while the generator is consumed, after @timed has returned, so throttled
+    calls are retried here. If the scan still fails, ScanInterruptedException is raised with a cursor
+    that resumes after the last comment yielded (which is also how a thread split across scan pages
+    is never lost).
+    """
+    def scan_items():
+        scan_args = {}
+        if page_size is not None:
+            scan_args['Limit'] = page_size
+        exclusive_start_key = decode_cursor(cursor)
+
+        while True:
+            if exclusive_start_key is not None:
+                scan_args['ExclusiveStartKey'] = exclusive_start_key
+            response = _scan_with_backoff(scan_args)
+            yield from response['Items']
+            exclusive_start_key = response.get('LastEvaluatedKey')
+            if exclusive_start_key is None:
+                return
+
+    def comments():
+        resume_cursor = cursor
+        try:
+            for comment in _group_threads(scan_items()):
+                yield comment
+                resume_cursor = encode_cursor({'comment_id': comment['comment_id'], 'sk': COMMENT_SK})
+        except Exception as err:
+            raise ScanInterruptedException(f"scan stopped: {err}", resume_cursor) from err
+
+    return comments()
+
+
+def _scan_with_backoff(scan_args):
+    """
+    One scan call of the comment table, retried with backoff while DynamoDB throttles it.
+    Raises CapacityExceededException if it is still throttled after BATCH_MAX_ATTEMPTS calls.
+    """
+    for attempt in range(BATCH_MAX_ATTEMPTS):
+        if attempt:
+            _backoff(attempt)
+        try:
+            return _table().scan(**scan_args)
+        except ClientError as err:
+            if not _throttled(err):
+                raise
+    raise CapacityExceededException("DynamoDB is over capacity, please retry")
+
+
+@timed
 def fetch_all_comments():
     """
     Retrieves all comments for all items
     Returns: A list of all comments in dynamoDB
     """
-    response = table.scan()
-    data = response['Items']
-    return data
+    return list(iter_all_comments())
+
+
+@timed
+def fetch_comments_page(limit=DEFAULT_PAGE_LIMIT, cursor=None):
+    """
+    Retrieves one page of comments across all items, in table order
+    Returns: (comments, next_cursor); next_cursor is None on the last page
+    """
+    scan_args = {
+        'Limit': min(limit, MAX_PAGE_LIMIT),
+        'FilterExpression': 'sk = :sk',
+        'ExpressionAttributeValues': {':sk': COMMENT_SK},
+    }
+    exclusive_start_key = decode_cursor(cursor)
+    if exclusive_start_key is not None:
+        scan_args['ExclusiveStartKey'] = exclusive_start_key
+
+    response = _table().scan(**scan_args)
+    return _attach_responses(response['Items']), encode_cursor(response.get('LastEvaluatedKey'))
 
 #pprint(fetch_all_comments())
 
-# TODO: incoorporate offset, limit/pagination
-def fetch_all_comments_by_template(template):
+def plan_template(template):
     """
-    retrieves all comments that match template
-    template: dict.  eg. {item_id: 1}
-    Note: This template can only be for top level/ Comment attributes.
-    DynamoDB doesn't have a feature to filter the data present in the Map inside the List data type,
-    unless you know the entire value for the response which seems irrelevant
+    Chooses how find_comments reads the comments matching template, cheapest first: a key lookup when
+    it names comment_id, a Query on a TEMPLATE_INDEXES index whose hash key it names (with the range
+    key in the key condition too when it is named), or else a scan. Other attributes become a filter.
+    Returns: the explain record of the plan, with nothing examined yet
     """
-    fe = ' AND '.join(['{0}=:{0}'.format(k) for k, v in template.items()])
-    ea = {':{}'.format(k): v for k, v in template.items()}
+    check_template(template)
+    index = None
+    if 'comment_id' in template:
+        access_path, key = KEY_LOOKUP, ['comment_id']
+    else:
+        hash_key = next((name for name in TEMPLATE_INDEXES if name in template), None)
+        if hash_key is not None:
+            index, range_key = TEMPLATE_INDEXES[hash_key]
+            access_path, key = INDEX_QUERY, [hash_key] + ([range_key] if range_key in template else [])
+        else:
+            access_path, key = SCAN, []
+    return {'access_path': access_path, 'index': index, 'key_attributes': key,
+            'filter_attributes': sorted(set(template) - set(key)), 'items_examined': 0, 'items_returned': 0}
 
-    result = table.scan(
-        FilterExpression=fe,
-        ExpressionAttributeValues=ea
-    )
-    return result['Items']
+
+@timed
+def find_comments(template, limit=DEFAULT_PAGE_LIMIT, cursor=None, ascending=True, fields=None,
+                  include_responses=ALL_RESPONSES):
+    """
+    retrieves one page of the comments that match template, along the access path plan_template picks
+    template: dict of top level comment attributes, eg. {"commenter_id": "talya"}
+    ascending: oldest first if True, newest first otherwise (index queries only)
+    fields, include_responses: optional projection (see base_data_resource.project_thread)
+    Returns: (comments, next_cursor, explain); next_cursor is None on the last page
+    """
+    explain = plan_template(template)
+    projected = fields is not None or include_responses != ALL_RESPONSES
+
+    if explain['access_path'] == KEY_LOOKUP:
+        item = _fetch_comment_item(template['comment_id'])
+        items = [item] if item is not None and all(item.get(k) == template[k] for k in template) else []
+        explain['items_examined'] = 0 if item is None else 1
+        last_evaluated_key = None
+    else:
+        names = {f'#t{i}': name for i, name in enumerate(sorted(template))}
+        values = {f':t{i}': template[name] for i, name in enumerate(sorted(template))}
+        conditions = {name: f'#t{i} = :t{i}' for i, name in enumerate(sorted(template))}
+        args = {'Limit': min(limit, MAX_PAGE_LIMIT)}
+        filters = [conditions[name] for name in explain['filter_attributes']]
+        if explain['access_path'] == INDEX_QUERY:
+            args.update(IndexName=explain['index'], ScanIndexForward=ascending,
+                        KeyConditionExpression=' AND '.join(conditions[name] for name in explain['key_attributes']))
+        else:
+            # the table also holds responses and tombstones
+            filters.append('sk = :sk')
+            values[':sk'] = COMMENT_SK
+        if filters:
+            args['FilterExpression'] = ' AND '.join(filters)
+        if projected:
+            projection = _projection(projected_attributes(fields, include_responses))
+            args['ProjectionExpression'] = projection['ProjectionExpression']
+            names.update(projection['ExpressionAttributeNames'])
+        if names:
+            args['ExpressionAttributeNames'] = names
+        args['ExpressionAttributeValues'] = values
+        exclusive_start_key = decode_cursor(cursor)
+        if exclusive_start_key is not None:
+            args['ExclusiveStartKey'] = exclusive_start_key
+
+        result = _table().query(**args) if explain['access_path'] == INDEX_QUERY else _table().scan(**args)
+        items = result['Items']
+        explain['items_examined'] = result['ScannedCount']
+        last_evaluated_key = result.get('LastEvaluatedKey')
+
+    comments = _attach_responses(items, include_responses)
+    if projected:
+        comments = [project_thread(c, fields, include_responses) for c in comments]
+    explain['items_returned'] = len(comments)
+    logger.debug("find_comments %s: %s", template, explain)
+    return comments, encode_cursor(last_evaluated_key), explain
+
+
+@timed
+def fetch_all_comments_by_template(template):
+    """
+    retrieves all comments that match template, following find_comments from page to page
+    Returns: (comments, explain); explain counts the items examined over all pages
+    """
+    comments, cursor, explain = find_comments(template, MAX_PAGE_LIMIT)
+    while cursor is not None:
+        page, cursor, page_explain = find_comments(template, MAX_PAGE_LIMIT, cursor)
+        comments += page
+        explain['items_examined'] += page_explain['items_examined']
+        explain['items_returned'] += page_explain['items_returned']
+    return comments, explain
 
 #pprint(fetch_all_comments_by_template({"commenter_id": "talya"}))
 
-def fetch_comment_by_id(comment_id_value):
+def _comment_cache_key(comment_id):
+    """
+    None if the comment's generation could not be read, which the cache treats as a miss.
+    """
+    generation = cache.generation(f'gen:comment:{comment_id}')
+    return f"comment:{comment_id}:{generation}" if generation is not None else None
+
+
+def _item_cache_key(item_id, *page_args):
+    generation = cache.generation(f'gen:item:{item_id}')
+    if generation is None:
+        return None
+    return f"item:{item_id}:{generation}:" + ":".join(str(arg) for arg in page_args)
+
+
+_comment_items = OrderedDict()
+_comment_items_lock = threading.Lock()
+COMMENT_ITEMS_MAX_ENTRIES = 100000
+
+
+def _comment_item_id(comment_id):
+    """
+    The item a comment belongs to, or None if the comment does not exist.
+    A comment never moves between items, so the answer is kept in a bounded in-process map
+    and only looked up (with a key-only read) on a miss.
+    """
+    with _comment_items_lock:
+        item_id = _comment_items.get(comment_id)
+    if item_id is not None:
+        return item_id
+
+    item = _table().get_item(Key=_comment_key(comment_id), ProjectionExpression='item_id').get('Item')
+    if item is None:
+        return None
+    _remember_comment_item(comment_id, item['item_id'])
+    return item['item_id']
+
+
+def _remember_comment_item(comment_id, item_id):
+    with _comment_items_lock:
+        _comment_items[comment_id] = item_id
+        if len(_comment_items) > COMMENT_ITEMS_MAX_ENTRIES:
+            _comment_items.popitem(last=False)
+
+
+def _invalidate(comment_id=None, item_id=None):
+    """
+    Invalidates the cached thread of comment_id and the cached listings of its item,
+    and detaches their reads in flight. Called after every successful write.
     """
-    retrieves the comment with comment_id=comment_id
+    if comment_id is not None:
+        reads.forget(f'comment:{comment_id}')
+    if item_id is not None:
+        reads.forget(f'item:{item_id}')
+    if isinstance(cache, NullCache):
+        return
+    if comment_id is not None:
+        cache.bump(f'gen:comment:{comment_id}')
+        if item_id is None:
+            item_id = _comment_item_id(comment_id)
+    if item_id is not None:
+        cache.bump(f'gen:item:{item_id}')
+
+
+def cache_stats():
+    """
+    Hit ratio and eviction counters of the comment cache, and how many reads were coalesced.
+    """
+    return {**cache.stats(), 'coalescing': reads.stats()}
+
+
+@timed
+def fetch_comment_by_id(comment_id_value, fields=None, include_responses=ALL_RESPONSES):
+    """
+    retrieves the comment with comment_id=comment_id, with its responses
+    The whole thread is one partition, so this is a single Query (paged only for very long threads).
+    Served from the comment cache when enabled; concurrent misses for the same projection share one read.
     comment_id_value: string
+    fields, include_responses: optional projection (see base_data_resource.project_thread).
+    A projected read only fetches the requested attributes: a key lookup for the none and count modes,
+    a Query limited to N responses for first:N. Only full threads are cached, but projections are
+    cut from a cached full thread when there is one.
+    """
+    cache_key = _comment_cache_key(comment_id_value)
+    comment = cache.get(cache_key)
+    projected = fields is not None or include_responses != ALL_RESPONSES
+    if comment is not None:
+        return project_thread(comment, fields, include_responses) if projected else comment
+    return reads.do(f'comment:{comment_id_value}',
+                    (frozenset(fields) if fields is not None else None, include_responses),
+                    lambda: _read_comment(comment_id_value, cache_key, fields, include_responses))
+
+
+def _read_comment(comment_id_value, cache_key, fields, include_responses):
+    """
+    fetch_comment_by_id on a cache miss
+    """
+    projected = fields is not None or include_responses != ALL_RESPONSES
+    if not projected:
+        comment = next(_group_threads(_iter_thread_items(comment_id_value)), None)
+        if comment is not None:
+            cache.set(cache_key, comment)
+        return comment
+
+    mode, first = include_responses
+    attributes = projected_attributes(fields, include_responses)
+    if mode in ('none', 'count'):
+        comment = _table().get_item(Key=_comment_key(comment_id_value), **_projection(attributes)).get('Item')
+        comment = _strip_keys(comment) if comment is not None else None
+    else:
+        query_args = {
+            'KeyConditionExpression': 'comment_id = :comment_id',
+            'ExpressionAttributeValues': {':comment_id': comment_id_value},
+            **_projection(attributes | RESPONSE_FIELDS | {'sk'}),
+        }
+        if mode == 'first':
+            # the comment item sorts before its responses, so N + 1 items are the comment and its first N responses
+            items = _table().query(Limit=first + 1, **query_args)['Items']
+        else:
+            items = _iter_query(**query_args)
+        comment = next(_group_threads(items), None)
+    return project_thread(comment, fields, include_responses) if comment is not None else None
+
+
+def _fetch_comment_item(comment_id):
+    """
+    retrieves only the comment item (no responses) with a key lookup
     """
-    rsp = table.get_item(Key={'comment_id': comment_id_value})
-    response = rsp.get('Item', None)
-    return response
-pprint(fetch_comment_by_id('3e0ab1b0-df48-4c65-b238-e3b4ccd8ee76'))
+    return _table().get_item(Key=_comment_key(comment_id)).get('Item', None)
 
-def get_comments_by_item_id(item_id):
+
+@timed
+def get_comments_by_item_id(item_id, limit=DEFAULT_PAGE_LIMIT, cursor=None, ascending=True, fields=None,
+                            include_responses=ALL_RESPONSES):
     """
-    retrieves all comments under the given item id
+    retrieves one page of comments under the given item id, ordered by datetime
+    Queries the item_id index, so the cost depends on the item's comments and not the table size.
     item_id: string
+    limit: max number of comments to return (capped at MAX_PAGE_LIMIT)
+    cursor: continuation cursor returned by a previous call
+    ascending: oldest first if True, newest first otherwise
+    fields, include_responses: optional projection (see base_data_resource.project_thread);
+    the index query then only reads the requested attributes
+    Returns: (comments, next_cursor); next_cursor is None on the last page
+    Served from the comment cache when enabled; concurrent misses for the same page share one Query.
     """
-    return fetch_all_comments_by_template({'item_id': item_id})
+    page_args = (limit, ascending, cursor or '', ','.join(sorted(fields)) if fields is not None else '*',
+                 *include_responses)
+    cache_key = _item_cache_key(item_id, *page_args)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+    return reads.do(f'item:{item_id}', page_args,
+                    lambda: _read_item_page(item_id, cache_key, limit, cursor, ascending, fields, include_responses))
+
+
+def _read_item_page(item_id, cache_key, limit, cursor, ascending, fields, include_responses):
+    """
+    get_comments_by_item_id on a cache miss
+    """
+    projected = fields is not None or include_responses != ALL_RESPONSES
+    query_args = {
+        'IndexName': ITEM_INDEX_NAME,
+        'KeyConditionExpression': 'item_id = :item_id',
+        'ExpressionAttributeValues': {':item_id': item_id},
+        'ScanIndexForward': ascending,
+        'Limit': min(limit, MAX_PAGE_LIMIT),
+    }
+    exclusive_start_key = decode_cursor(cursor)
+    if exclusive_start_key is not None:
+        query_args['ExclusiveStartKey'] = exclusive_start_key
+    if projected:
+        query_args.update(_projection(projected_attributes(fields, include_responses)))
+
+    result = _table().query(**query_args)
+    comments = _attach_responses(result['Items'], include_responses)
+    if projected:
+        comments = [project_thread(c, fields, include_responses) for c in comments]
+    page = comments, encode_cursor(result.get('LastEvaluatedKey'))
+    cache.set(cache_key, page)
+    return page
+
+
+@timed
+def fetch_responses_page(comment_id, limit=DEFAULT_PAGE_LIMIT, cursor=None):
+    """
+    retrieves one page of the responses under a comment, oldest first
+    Returns: (responses, next_cursor); next_cursor is None on the last page
+    """
+    query_args = {
+        'KeyConditionExpression': 'comment_id = :comment_id AND begins_with(sk, :prefix)',
+        'ExpressionAttributeValues': {':comment_id': comment_id, ':prefix': RESPONSE_SK_PREFIX},
+        'Limit': min(limit, MAX_PAGE_LIMIT),
+    }
+    exclusive_start_key = decode_cursor(cursor)
+    if exclusive_start_key is not None:
+        query_args['ExclusiveStartKey'] = exclusive_start_key
+
+    result = _table().query(**query_args)
+    return [_strip_keys(r) for r in result['Items']], encode_cursor(result.get('LastEvaluatedKey'))
 
 
 #pprint(fetch_comment_by_id('2'))
 
-def add_response(comment_id, responder_id, response_text):
+
+def changes_token():
+    """
+    A since token for get_item_changes, a little in the past: the settle window, plus the cache TTL
+    when caching is on, since a cached listing can be that old.
+    """
+    lag = CHANGES_SETTLE_SECONDS + (0 if isinstance(cache, NullCache) else cache.default_ttl)
+    return encode_cursor({'change_seq': _change_marker(lag)})
+
+
+def _since_change_seq(since):
+    """
+    The change_seq a since token continues after.
+    Raises DynamoDBServiceException if it is malformed, ChangesExpiredException if it is too old.
+    """
+    key = decode_cursor(since)
+    change_seq = key.get('change_seq') if key is not None else None
+    try:
+        millis = int(change_seq.replace('-', '')[:12], 16)
+    except (AttributeError, ValueError):
+        raise DynamoDBServiceException("Invalid since token")
+    if millis < (time.time() - CHANGE_HISTORY_SECONDS) * 1000:
+        raise ChangesExpiredException("since token is older than the change history")
+    return change_seq
+
+
+def _change_record(item):
+    """
+    A changes index entry as a change: the record, or a tombstone for a deleted one.
+    """
+    sk = item['sk']
+    deleted = sk.startswith(TOMBSTONE_SK_PREFIX)
+    if deleted:
+        sk = sk[len(TOMBSTONE_SK_PREFIX):]
+    change = {'type': 'comment' if sk == COMMENT_SK else 'response'}
+    if not deleted:
+        return {**change, **_strip_keys(item), 'deleted': False}
+    change['comment_id'] = item['comment_id']
+    if sk != COMMENT_SK:
+        change['response_id'] = sk[len(RESPONSE_SK_PREFIX):]
+    change['deleted'] = True
+    return change
+
+
+@timed
+def get_item_changes(item_id, since, limit=DEFAULT_PAGE_LIMIT):
+    """
+    retrieves the comments and responses under an item that were created, edited or deleted after
+    a since token (see changes_token), oldest change first
+    Queries the changes index from the token's change_seq, so a poll reads only what changed.
+    Returns: (changes, next_since, more)
+    next_since only moves into the last CHANGES_SETTLE_SECONDS while more pages are waiting,
+    so changes in that window may be reported again by the next poll.
+    """
+    since_seq = _since_change_seq(since)
+    result = _table().query(
+        IndexName=CHANGES_INDEX_NAME,
+        KeyConditionExpression='change_item_id = :item_id AND change_seq > :since',
+        ExpressionAttributeValues={':item_id': item_id, ':since': since_seq},
+        Limit=min(limit, MAX_PAGE_LIMIT),
+    )
+    items = result['Items']
+    more = 'LastEvaluatedKey' in result
+    if more and items:
+        next_seq = items[-1]['change_seq']
+    else:
+        settled = _change_marker(CHANGES_SETTLE_SECONDS)
+        next_seq = max(since_seq, min(items[-1]['change_seq'], settled) if items else settled)
+    return [_change_record(item) for item in items], encode_cursor({'change_seq': next_seq}), more
+
+
+def new_response(comment_id, responder_id, response_text):
+    """
+    Builds a new response; its id is time-ordered so it sorts after the comment's earlier responses.
+    """
+    return {
+        "comment_id": comment_id,
+        "responder_id": responder_id,
+        "datetime": _current_datetime(),
+        "response_text": response_text,
+        "response_id": _time_ordered_id(),
+        "version_id": str(uuid.uuid4())
+    }
+
+
+@timed
+def add_response(comment_id, responder_id, response_text, idempotency=None):
     """
     Posts a response under a comment id
     comment_id: the comment_id the response will be under
     responder_id: the user posting the response
     response_text: the response_text field in the response object
+    idempotency: optional IdempotencyKey, recorded in the same transaction as the response
     (See add_response in ferguson code)
+
+    The response is its own item in the comment's partition; see add_responses.
     """
-    Key = {
-        "comment_id": comment_id
-    }
-    dt = time.time()
-    dts = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(dt))
+    error, result = _add_responses(comment_id, [new_response(comment_id, responder_id, response_text)],
+                                   idempotency)
+    if error is not None or idempotency is not None and idempotency.replayed:
+        return error, result
+    return None, result[0]
 
-    full_rsp = {
-        "responder_id": responder_id,
-        "datetime": dts,
-        "response_text": response_text,
-        "response_id": str(uuid.uuid4()),
-        "version_id": str(uuid.uuid4())
-    }
-    UpdateExpression = "SET responses = list_append(responses, :i)"
-    ExpressionAttributeValues = {
-        ':i': [full_rsp]
-    }
-    ReturnValues = "UPDATED_NEW"
 
-    res = table.update_item(
-        Key=Key,
-        UpdateExpression=UpdateExpression,
-        ExpressionAttributeValues=ExpressionAttributeValues,
-        ReturnValues=ReturnValues
-    )
+@timed
+def add_responses(comment_id, responses):
+    """
+    Posts responses built by new_response under one comment.
+    Each transaction puts up to TRANSACT_WRITE_LIMIT - 1 responses together with one increment of the
+    comment's response_count, which also checks that the comment exists; the item's summary is updated
+    once per transaction afterwards. Safe to retry: transactions whose responses are already written are skipped.
+    Returns: (error, responses), where error is None or COMMENT_NOT_FOUND
+    """
+    return _add_responses(comment_id, responses)
 
-    return None, res
+
+def _add_responses(comment_id, responses, idempotency=None):
+    """
+    add_responses, optionally with an IdempotencyKey (for a single response): its record is written in
+    the response's transaction, and a replay returns the stored response instead of the list.
+    """
+    item_id = _comment_item_id(comment_id)
+    if item_id is None:
+        return e.COMMENT_NOT_FOUND, "Parent comment could not be found!"
+
+    per_transaction = TRANSACT_WRITE_LIMIT - 2 if idempotency is not None else TRANSACT_WRITE_LIMIT - 1
+    for start in range(0, len(responses), per_transaction):
+        chunk = responses[start:start + per_transaction]
+        record = [_idempotency_put(idempotency, chunk[0])] if idempotency is not None and start == 0 else []
+        try:
+            get_resource().meta.client.transact_write_items(TransactItems=record + [
+                {'Update': {
+                    'TableName': COMMENT_TABLE_NAME,
+                    'Key': _serialize(_comment_key(comment_id)),
+                    'UpdateExpression': 'ADD response_count :n',
+                    'ConditionExpression': 'attribute_exists(comment_id)',
+                    'ExpressionAttributeValues': _serialize({':n': len(chunk)}),
+                }},
+            ] + [
+                {'Put': {
+                    'TableName': COMMENT_TABLE_NAME,
+                    'Item': _serialize(_stamp({**response, 'sk': RESPONSE_SK_PREFIX + response['response_id']},
+                                              item_id)),
+                    'ConditionExpression': 'attribute_not_exists(sk)',
+                }} for response in chunk
+            ])
+        except ClientError as err:
+            if record and _idempotency_conflict(err):
+                return _idempotent_replay(idempotency)
+            if err.response['Error']['Code'] == 'TransactionCanceledException' and not _throttled(err):
+                if _responses_exist(err, len(record) + 1):
+                    # a retry of a transaction that committed: its responses and count are in place
+                    continue
+                return e.COMMENT_NOT_FOUND, "Parent comment could not be found!"
+            raise
+        _summarize(_record_response_change, item_id, len(chunk), chunk[-1]['datetime'])
+
+    _invalidate(comment_id, item_id)
+    return None, responses
 
 #add_response('1', 'maya', 'adding a response!')
 #pprint(fetch_all_comments())
 
-def post_comment(item_id, commenter_id, comment_text):
+def new_comment(item_id, commenter_id, comment_text):
+    return _strip_keys(_new_comment_item(item_id, commenter_id, comment_text))
+
+
+def _new_comment_item(item_id, commenter_id, comment_text):
     """
-    Posts a new comment
-    commenter_id: the user posting the comment
-    commenter_text: the comment_text field in the comment object
-    (See add_comment in ferguson code)
+    Builds the stored form of a new comment.
     """
-    dt = time.time()
-    dts = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(dt))
-
-    item = {
+    return {
         "comment_id": str(uuid.uuid4()),
+        "sk": COMMENT_SK,
         "version_id": str(uuid.uuid4()),
         "commenter_id": commenter_id,
         "comment_text": comment_text,
-        "datetime": dts,
+        "datetime": _current_datetime(),
         "item_id": item_id,
-        "responses": []
+        "response_count": 0
     }
-    res = table.put_item(Item=item)
-    return None, res
+
+
+def _idempotency_put(idempotency, result):
+    """
+    The transaction action that records an Idempotency-Key with its post's result. It fails if the key
+    is already recorded (and not yet expired, as TTL deletes lag), which cancels the post with it.
+    """
+    now = int(time.time())
+    return {'Put': {
+        'TableName': IDEMPOTENCY_TABLE_NAME,
+        'Item': _serialize({'idempotency_key': idempotency.key, 'fingerprint': idempotency.fingerprint,
+                            'result': result, TTL_ATTRIBUTE: now + idempotency.ttl}),
+        'ConditionExpression': 'attribute_not_exists(idempotency_key) OR #expires < :now',
+        'ExpressionAttributeNames': {'#expires': TTL_ATTRIBUTE},
+        'ExpressionAttributeValues': _serialize({':now': now}),
+    }}
+
+
+def _idempotency_conflict(err):
+    """
+    Whether a transaction starting with _idempotency_put was cancelled because the key was already recorded.
+    """
+    reasons = err.response.get('CancellationReasons') or []
+    return err.response['Error']['Code'] == 'TransactionCanceledException' and bool(reasons) \
+        and reasons[0].get('Code') == 'ConditionalCheckFailed'
+
+
+def _idempotent_replay(idempotency):
+    """
+    The answer to a post whose Idempotency-Key is already recorded: the stored result,
+    or IDEMPOTENCY_KEY_REUSED if the key was recorded for a different request.
+    """
+    record = _idempotency_table().get_item(Key={'idempotency_key': idempotency.key}, ConsistentRead=True).get('Item')
+    if record is None:
+        # expired between the failed write and this read
+        return e.WRITE_WRITE_CONFLICT, "Idempotency-Key expired, please retry"
+    if record['fingerprint'] != idempotency.fingerprint:
+        return e.IDEMPOTENCY_KEY_REUSED, "Idempotency-Key was already used for a different request"
+    idempotency.replayed = True
+    return None, record['result']
+
+
+@timed
+def post_comment(item_id, commenter_id, comment_text, idempotency=None):
+    """
+    Posts a new comment
+    commenter_id: the user posting the comment
+    commenter_text: the comment_text field in the comment object
+    idempotency: optional IdempotencyKey; the comment and the key's record are then written in one
+    transaction, and a retry gets the comment stored with the key instead of posting another
+    (See add_comment in ferguson code)
+    """
+    item = _stamp(_new_comment_item(item_id, commenter_id, comment_text), item_id)
+    if idempotency is None:
+        _table().put_item(Item=item)
+    else:
+        try:
+            get_resource().meta.client.transact_write_items(TransactItems=[
+                _idempotency_put(idempotency, _strip_keys(item)),
+                {'Put': {'TableName': COMMENT_TABLE_NAME, 'Item': _serialize(item)}},
+            ])
+        except ClientError as err:
+            if not _idempotency_conflict(err):
+                raise
+            return _idempotent_replay(idempotency)
+    _remember_comment_item(item['comment_id'], item_id)
+    _summarize(_record_comments_posted, item_id, [item['comment_id']], item['datetime'])
+    _invalidate(item_id=item_id)
+    return None, _strip_keys(item)
 
 
 # post_comment('4','jake', 'comment about item 4!')
 # pprint(fetch_all_comments())
 
 
+def _backoff(attempt):
+    """
+    Sleeps before retrying unprocessed batch entries: exponential with full jitter, capped at 2 seconds.
+    """
+    time.sleep(random.uniform(0, min(2.0, 0.05 * (2 ** attempt))))
+
+
+def _batch_write(requests):
+    """
+    Writes up to BATCH_WRITE_LIMIT put/delete requests to the comment table with one BatchWriteItem call,
+    retrying UnprocessedItems with backoff.
+    Returns: the requests that were still unprocessed after BATCH_MAX_ATTEMPTS calls
+    """
+    pending = requests
+    for attempt in range(BATCH_MAX_ATTEMPTS):
+        if attempt:
+            _backoff(attempt)
+        response = get_resource().batch_write_item(RequestItems={COMMENT_TABLE_NAME: pending})
+        pending = response.get('UnprocessedItems', {}).get(COMMENT_TABLE_NAME, [])
+        if not pending:
+            break
+    return pending
+
+
+@timed
+def batch_fetch_comments(comment_ids):
+    """
+    Retrieves several comments with BatchGetItem, retrying UnprocessedKeys with backoff.
+    Comments are returned without their responses list (response_count is included).
+    comment_ids: list of comment ids; duplicates are fetched once
+    Returns: a list of (comment_id, error, comment) in the order of comment_ids,
+    where error is None, COMMENT_NOT_FOUND or BATCH_UNPROCESSED
+    """
+    unique_ids = list(dict.fromkeys(comment_ids))
+    found = {}
+    unprocessed = set()
+
+    for start in range(0, len(unique_ids), BATCH_GET_LIMIT):
+        pending = {'Keys': [_comment_key(c) for c in unique_ids[start:start + BATCH_GET_LIMIT]]}
+        for attempt in range(BATCH_MAX_ATTEMPTS):
+            if attempt:
+                _backoff(attempt)
+            response = get_resource().batch_get_item(RequestItems={COMMENT_TABLE_NAME: pending})
+            for item in response['Responses'].get(COMMENT_TABLE_NAME, []):
+                found[item['comment_id']] = _strip_keys(item)
+            pending = response.get('UnprocessedKeys', {}).get(COMMENT_TABLE_NAME)
+            if not pending:
+                break
+        else:
+            unprocessed.update(key['comment_id'] for key in pending['Keys'])
+
+    results = []
+    for comment_id in comment_ids:
+        if comment_id in found:
+            results.append((comment_id, None, found[comment_id]))
+        elif comment_id in unprocessed:
+            results.append((comment_id, e.BATCH_UNPROCESSED, "Could not be read, please retry"))
+        else:
+            results.append((comment_id, e.COMMENT_NOT_FOUND, "Comment could not be found!"))
+    return results
+
+
+@timed
+def batch_post_comments(entries):
+    """
+    Posts several new comments with BatchWriteItem; see batch_put_comments.
+    entries: list of (item_id, commenter_id, comment_text)
+    Returns: a list of (error, comment) in the order of entries, where error is None or BATCH_UNPROCESSED
+    """
+    return batch_put_comments([new_comment(item_id, commenter_id, comment_text)
+                               for item_id, commenter_id, comment_text in entries])
+
+
+@timed
+def batch_put_comments(comments):
+    """
+    Writes comments built by new_comment with BatchWriteItem, 25 per call, retrying UnprocessedItems
+    with backoff. Each item's summary gets one update for all of its comments.
+    Only the puts can raise, and they overwrite the same items when repeated, so a call that raised can be retried.
+    Returns: a list of (error, comment) in the order of comments, where error is None or BATCH_UNPROCESSED
+    """
+    items = [_stamp({**comment, 'sk': COMMENT_SK}, comment['item_id']) for comment in comments]
+    failed = set()
+
+    for start in range(0, len(items), BATCH_WRITE_LIMIT):
+        requests = [{'PutRequest': {'Item': item}} for item in items[start:start + BATCH_WRITE_LIMIT]]
+        for request in _batch_write(requests):
+            failed.add(request['PutRequest']['Item']['comment_id'])
+
+    posted_by_item = {}
+    for item in items:
+        if item['comment_id'] not in failed:
+            _remember_comment_item(item['comment_id'], item['item_id'])
+            posted_by_item.setdefault(item['item_id'], []).append(item)
+    for item_id, posted in posted_by_item.items():
+        _summarize(_record_comments_posted, item_id, [c['comment_id'] for c in posted], posted[-1]['datetime'])
+        _invalidate(item_id=item_id)
+
+    return [(e.BATCH_UNPROCESSED, "Could not be written, please retry") if item['comment_id'] in failed
+            else (None, _strip_keys(item)) for item in items]
+
+
+def stored_thread(comment, responses=()):
+    """
+    The items post_comment and add_responses would store for a comment built by new_comment and
+    its responses built by new_response, for bulk loads that write them with BatchWriteItem.
+    """
+    item_id = comment['item_id']
+    items = [_stamp({**comment, 'sk': COMMENT_SK, 'response_count': len(responses)}, item_id)]
+    items += [_stamp({**response, 'sk': RESPONSE_SK_PREFIX + response['response_id']}, item_id)
+              for response in responses]
+    return items
+
+
+def record_bulk_load(item_id, latest_comment_ids, comment_count, response_count, last_activity):
+    """
+    Adds bulk-loaded comments and responses to an item's summary with one update.
+    latest_comment_ids: the newest loaded comments, oldest first (at most LATEST_COMMENT_IDS are kept)
+    """
+    _summary_table().update_item(
+        Key={"item_id": item_id},
+        UpdateExpression="ADD comment_count :n, response_count :responses SET last_activity = :dts, "
+                         "latest_comment_ids = list_append(:ids, if_not_exists(latest_comment_ids, :empty))",
+        ExpressionAttributeValues={":n": comment_count, ":responses": response_count, ":dts": last_activity,
+                                   ":ids": list(reversed(latest_comment_ids[-LATEST_COMMENT_IDS:])), ":empty": []}
+    )
+
+
+def _responses_exist(err, first_put):
+    """
+    Whether a cancelled add_responses transaction failed because its responses, the actions from
+    first_put on, were already written. Response ids are unique, so that only happens when the same
+    responses are written again, e.g. by a retry.
+    """
+    reasons = err.response.get('CancellationReasons') or []
+    return any(reason.get('Code') == 'ConditionalCheckFailed' for reason in reasons[first_put:])
+
+
+def _summarize(update, *args):
+    """
+    Runs a summary update after the write it records has committed. The write stands if the update
+    fails, and raising would get it retried and applied twice, so the error is only logged;
+    bin/migrate_responses.py --summaries-only rebuilds summaries that fell behind.
+    """
+    try:
+        update(*args)
+    except ClientError:
+        logger.exception(f"item summary update {update.__name__}{args} failed")
+
+
+def _empty_summary(item_id):
+    return {"item_id": item_id, "comment_count": 0, "response_count": 0, "last_activity": None,
+            "latest_comment_ids": []}
+
+
+def _record_comments_posted(item_id, comment_ids, dts):
+    """
+    Adds newly posted comments to an item's summary with one atomic update.
+    comment_ids: oldest first; the summary keeps its latest_comment_ids newest first.
+    The list is trimmed back to LATEST_COMMENT_IDS once it reaches twice that length,
+    so the trim costs one extra write every few posts.
+    """
+    res = _summary_table().update_item(
+        Key={"item_id": item_id},
+        UpdateExpression="ADD comment_count :n SET last_activity = :dts, "
+                         "latest_comment_ids = list_append(:ids, if_not_exists(latest_comment_ids, :empty))",
+        ExpressionAttributeValues={":n": len(comment_ids), ":dts": dts, ":ids": list(reversed(comment_ids)),
+                                   ":empty": []},
+        ReturnValues="UPDATED_NEW"
+    )
+    latest = res['Attributes']['latest_comment_ids']
+    if len(latest) >= 2 * LATEST_COMMENT_IDS:
+        try:
+            _summary_table().update_item(
+                Key={"item_id": item_id},
+                UpdateExpression="REMOVE " + ", ".join(f"latest_comment_ids[{i}]"
+                                                       for i in range(LATEST_COMMENT_IDS, len(latest))),
+                ConditionExpression="size(latest_comment_ids) = :size",
+                ExpressionAttributeValues={":size": len(latest)}
+            )
+        except ClientError as err:
+            # another post got in first; it will trim instead
+            if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+
+def _skipped_decrement(err, item_id):
+    """
+    Whether an update failed only because it would have taken a summary count below zero,
+    e.g. for comments written before the summary table existed and not yet backfilled.
+    """
+    if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+        return False
+    logger.warning(f"summary of item {item_id} is missing or behind, skipped a decrement; "
+                   f"run bin/migrate_responses.py --summaries-only to rebuild it")
+    return True
+
+
+def _record_response_change(item_id, delta, dts):
+    """
+    Adds delta responses to an item's summary; a decrement that would go below zero is skipped.
+    """
+    update_args = {
+        'Key': {"item_id": item_id},
+        'UpdateExpression': "ADD response_count :delta SET last_activity = :dts",
+        'ExpressionAttributeValues': {":delta": delta, ":dts": dts},
+    }
+    if delta < 0:
+        update_args['ConditionExpression'] = "response_count >= :minus_delta"
+        update_args['ExpressionAttributeValues'][":minus_delta"] = -delta
+    try:
+        _summary_table().update_item(**update_args)
+    except ClientError as err:
+        if not _skipped_decrement(err, item_id):
+            raise
+
+
+def _record_comment_deleted(deleted_comment, dts):
+    """
+    Takes a deleted comment (and its responses) out of its item's summary.
+    Counts are never taken below zero: if the summary does not hold the comment, only its id is removed.
+    """
+    comment_id = deleted_comment['comment_id']
+    item_id = deleted_comment['item_id']
+    response_count = deleted_comment.get('response_count', 0)
+    try:
+        res = _summary_table().update_item(
+            Key={"item_id": item_id},
+            UpdateExpression="ADD comment_count :minus_one, response_count :minus_responses SET last_activity = :dts",
+            ConditionExpression="comment_count >= :one AND response_count >= :responses",
+            ExpressionAttributeValues={":minus_one": -1, ":minus_responses": -response_count, ":dts": dts,
+                                       ":one": 1, ":responses": response_count},
+            ReturnValues="ALL_NEW"
+        )
+        latest = res['Attributes'].get('latest_comment_ids', [])
+    except ClientError as err:
+        if not _skipped_decrement(err, item_id):
+            raise
+        summary = _summary_table().get_item(Key={"item_id": item_id}).get('Item') or {}
+        latest = summary.get('latest_comment_ids', [])
+    if comment_id in latest:
+        index = latest.index(comment_id)
+        try:
+            _summary_table().update_item(
+                Key={"item_id": item_id},
+                UpdateExpression=f"REMOVE latest_comment_ids[{index}]",
+                ConditionExpression=f"latest_comment_ids[{index}] = :comment_id",
+                ExpressionAttributeValues={":comment_id": comment_id}
+            )
+        except ClientError as err:
+            if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+
+def _format_summary(summary):
+    summary['latest_comment_ids'] = summary.get('latest_comment_ids', [])[:LATEST_COMMENT_IDS]
+    return {**_empty_summary(summary['item_id']), **summary}
+
+
+@timed
+def get_item_summary(item_id):
+    """
+    retrieves the comment aggregates of one item with a single key lookup
+    Returns: {item_id, comment_count, response_count, last_activity, latest_comment_ids};
+    zeros for an item without comments
+    """
+    summary = _summary_table().get_item(Key={"item_id": item_id}).get('Item')
+    return _format_summary(summary) if summary is not None else _empty_summary(item_id)
+
+
+@timed
+def get_item_summaries(item_ids):
+    """
+    retrieves the comment aggregates of several items with BatchGetItem, retrying UnprocessedKeys
+    item_ids: list of item ids; duplicates are fetched once
+    Returns: a list of summaries in the order of item_ids (see get_item_summary)
+    """
+    unique_ids = list(dict.fromkeys(item_ids))
+    found = {}
+    for start in range(0, len(unique_ids), BATCH_GET_LIMIT):
+        pending = {'Keys': [{"item_id": i} for i in unique_ids[start:start + BATCH_GET_LIMIT]]}
+        for attempt in range(BATCH_MAX_ATTEMPTS):
+            if attempt:
+                _backoff(attempt)
+            response = get_resource().batch_get_item(RequestItems={SUMMARY_TABLE_NAME: pending})
+            for summary in response['Responses'].get(SUMMARY_TABLE_NAME, []):
+                found[summary['item_id']] = _format_summary(summary)
+            pending = response.get('UnprocessedKeys', {}).get(SUMMARY_TABLE_NAME)
+            if not pending:
+                break
+        else:
+            raise DynamoDBServiceException("Item summaries could not be read, please retry")
+    return [found.get(item_id) or _empty_summary(item_id) for item_id in item_ids]
+
+
+def _owner_condition(owner_attribute, user_id, old_version_id, values):
+    """
+    Builds the ConditionExpression that makes a write succeed only if the item exists,
+    belongs to user_id and (when old_version_id is given) has not changed since it was read.
+    Fills in the matching entries of values.
+    """
+    values[':user_id'] = user_id
+    condition = f"attribute_exists(sk) AND {owner_attribute} = :user_id"
+    if old_version_id is not None:
+        values[':old_version_id'] = old_version_id
+        condition += " AND version_id = :old_version_id"
+    return condition
+
+
+def _explain_condition_failure(item, owner_attribute, user_id, not_found_message, wrong_user_message):
+    """
+    Works out which part of an _owner_condition failed, from the item as it is now.
+    Only called after a failed write, so the happy path stays a single call.
+    """
+    if item is None:
+        return e.COMMENT_NOT_FOUND, not_found_message
+    if item[owner_attribute] != user_id:
+        return e.WRONG_USER, wrong_user_message
+    return e.WRITE_WRITE_CONFLICT, "VersionID incorrect- Write Write conflict"
+
+
+def _read_after_failure(key):
+    return _table().get_item(Key=key, ConsistentRead=True).get('Item', None)
+
+
+@timed
 def update_comment(comment_id, old_version_id, commenter_id, new_comment_text):
     """
     updates a comment with id=comment_id only if old_version_id==version_id of the comment with comment_id
@@ -156,173 +1260,271 @@ def update_comment(comment_id, old_version_id, commenter_id, new_comment_text):
     commenter_id: the id of the commenter updating the comment
     new_comment_text: the new text of the comment
 
-    this function needs to:
-    1. verify that commenter_id= commenter_id
-    2. update conditionally based on the version number of the old comment.
+    datetime stays the creation time, since it orders the item and commenter indexes (an edit must not
+    move a comment within listings or cursors); the time of the edit is stored as edited_at.
+    The ownership and version checks are part of the update's ConditionExpression, so this is one call;
+    the comment is only read back if the condition fails, to report which check failed.
     (see write_comment_if_not_changed in ferguson code)
     """
-    comment_to_update = fetch_comment_by_id(comment_id)
-
-    if comment_to_update['commenter_id'] != commenter_id:
-        return e.WRONG_USER, "Users may not edit other users comments"
-
-    dt = time.time()
-    dts = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(dt))
-    new_version_id = str(uuid.uuid4())
+    values = {":new_comment_text": new_comment_text, ":new_version_id": str(uuid.uuid4()),
+              ":edited_at": _current_datetime(), ":change_seq": _time_ordered_id()}
+    condition = _owner_condition('commenter_id', commenter_id, old_version_id, values)
 
     try:
-        res = table.update_item(
-            Key= {
-                'comment_id': comment_id
-            },
-            UpdateExpression="SET version_id = :new_version_id, comment_text = :new_comment_text, #dts = :dts",
-            ConditionExpression="version_id=:old_version_id",
-            ExpressionAttributeValues={":old_version_id": old_version_id,":new_comment_text": new_comment_text,
-                                       ":new_version_id": new_version_id, ":dts": dts},
-            ExpressionAttributeNames= {"#dts": "datetime"}
+        res = _table().update_item(
+            Key=_comment_key(comment_id),
+            UpdateExpression="SET version_id = :new_version_id, comment_text = :new_comment_text, "
+                             "edited_at = :edited_at, change_item_id = item_id, change_seq = :change_seq",
+            ConditionExpression=condition,
+            ExpressionAttributeValues=values,
+            ReturnValues="ALL_NEW"
         )
     except ClientError as err:
         if err.response['Error']['Code']=='ConditionalCheckFailedException':
-            return e.WRITE_WRITE_CONFLICT, "VersionID incorrect- Write Write conflict"
-        else:
-            return e.COMMENT_NOT_FOUND, "Update failed"
+            return _explain_condition_failure(_read_after_failure(_comment_key(comment_id)), 'commenter_id',
+                                              commenter_id, "Comment could not be found!",
+                                              "Users may not edit other users comments")
+        raise
 
-    return None, res
+    _invalidate(comment_id, res['Attributes']['item_id'])
+    return None, _strip_keys(res['Attributes'])
 
 #update_comment("3e0ab1b0-df48-4c65-b238-e3b4ccd8ee76", '1234', 'TK', 'new comment')
 # pprint(fetch_all_comments())
 # pprint(fetch_comment_by_id('d9d6b8ec-9a0a-49ce-a17e-de091b184fd8'))
 
 
+@timed
 def update_response(comment_id, response_id, new_response_text, responder_id, old_version_id):
     """
-    same as update comment but for response
-    This post shows how to update one map item in a list in dynamo
-    https://stackoverflow.com/questions/36799604/update-list-element-in-dynamodb
-    I think flow will have to be: iterate through the list to find the index where response_id=response_id,
-    then follow the stackoverflow format
+    same as update comment but for response (datetime stays the creation time, the edit time is edited_at)
+    The response is its own item, so this is one conditional update by key.
     """
-    comment_to_update = fetch_comment_by_id(comment_id)
+    item_id = _comment_item_id(comment_id)
+    if item_id is None:
+        return e.COMMENT_NOT_FOUND, "The requested response could not be found."
 
-    if comment_to_update is None:
-        return e.COMMENT_NOT_FOUND, "Parent comment could not be found!"
+    values = {":new_response_text": new_response_text, ":new_version_id": str(uuid.uuid4()),
+              ":edited_at": _current_datetime(), ":item_id": item_id, ":change_seq": _time_ordered_id()}
+    condition = _owner_condition('responder_id', responder_id, old_version_id, values)
 
-    comment_responses = comment_to_update["responses"]
-    index_of_response_to_update = -1
+    try:
+        res = _table().update_item(
+            Key=_response_key(comment_id, response_id),
+            UpdateExpression="SET response_text = :new_response_text, version_id = :new_version_id, "
+                             "edited_at = :edited_at, change_item_id = :item_id, change_seq = :change_seq",
+            ConditionExpression=condition,
+            ExpressionAttributeValues=values,
+            ReturnValues="ALL_NEW"
+        )
+    except ClientError as err:
+        if err.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return _explain_condition_failure(_read_after_failure(_response_key(comment_id, response_id)),
+                                              'responder_id', responder_id,
+                                              "The requested response could not be found.",
+                                              "Users may not edit other users comments")
+        raise
 
-    for idx, resp in enumerate(comment_responses):
-        if resp["response_id"] == response_id:
-            index_of_response_to_update = idx
-            break
+    _invalidate(comment_id, item_id)
+    return None, _strip_keys(res['Attributes'])
 
-    if index_of_response_to_update == -1:
-        return e.COMMENT_NOT_FOUND, "The requested response could not be found."
 
-    if comment_responses[index_of_response_to_update]['responder_id'] != responder_id:
-        return e.WRONG_USER, "Users may not edit other users comments"
+def _delete_thread_responses(comment_id):
+    """
+    deletes every response item in a comment's partition
+    """
+    keys = _iter_query(
+        KeyConditionExpression='comment_id = :comment_id AND begins_with(sk, :prefix)',
+        ExpressionAttributeValues={':comment_id': comment_id, ':prefix': RESPONSE_SK_PREFIX},
+        ProjectionExpression='comment_id, sk'
+    )
+    with _table().batch_writer() as batch:
+        for key in keys:
+            batch.delete_item(Key=key)
+
+
+@timed
+def delete_comment(comment_id, commenter_id, old_version_id=None):
+    """
+    deletes a comment with comment_id=comment_id
+    deleting a comment deletes all the responses to the comment
+    The ownership check (and the version check, if old_version_id is given) is the delete's
+    ConditionExpression, so a concurrent edit can't slip in between the check and the delete.
+    """
+    values = {}
+    condition = _owner_condition('commenter_id', commenter_id, old_version_id, values)
 
-    dt = time.time()
-    dts = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(dt))
-    new_version_id = str(uuid.uuid4())
     try:
-        res = table.update_item(
-            Key={
-                'comment_id': comment_id
-            },
-            UpdateExpression=f"SET responses[{index_of_response_to_update}].response_text = :new_response_text, " +
-                                 f"responses[{index_of_response_to_update}].version_id = :new_version_id, " +
-                                 f"responses[{index_of_response_to_update}].#dts = :dts",
-            ConditionExpression=f"responses[{index_of_response_to_update}].version_id=:old_version_id",
-            ExpressionAttributeValues={":new_response_text": new_response_text,
-                                       ":new_version_id": new_version_id,
-                                       ":dts": dts,
-                                       ":old_version_id": old_version_id},
-            ExpressionAttributeNames={"#dts": "datetime"}
+        res = _table().delete_item(
+            Key=_comment_key(comment_id),
+            ConditionExpression=condition,
+            ExpressionAttributeValues=values,
+            ReturnValues="ALL_OLD"
         )
     except ClientError as err:
         if err.response['Error']['Code'] == 'ConditionalCheckFailedException':
-            return e.WRITE_WRITE_CONFLICT, "VersionID incorrect- Write Write conflict"
-        else:
-            print(err)
-            return e.COMMENT_NOT_FOUND, "Update failed"
-    return None, res
+            return _explain_condition_failure(_read_after_failure(_comment_key(comment_id)), 'commenter_id',
+                                              commenter_id, "Parent comment could not be found!",
+                                              "Users may not delete other users comments")
+        raise
+
+    _delete_thread_responses(comment_id)
+    _table().put_item(Item=_tombstone(_comment_key(comment_id), res['Attributes']['item_id']))
+    _summarize(_record_comment_deleted, res['Attributes'], _current_datetime())
+    _invalidate(comment_id, res['Attributes']['item_id'])
+    return None, _strip_keys(res['Attributes'])
 
 
-def delete_comment(comment_id, commenter_id):
+@timed
+def delete_response(comment_id, response_id, responder_id, old_version_id=None):
     """
-    deletes a comment with comment_id=comment_id
-    deleting a comment deletes all the responses to the comment
-    needs to verify that the user deleting the comment is same as user who created the comment
+    deletes a response with response_id = responder_id
+    The response is deleted by key, conditional on its owner (and version, if old_version_id is given),
+    in one transaction with the decrement of the comment's response_count and the response's tombstone.
     """
-    comment_to_update = fetch_comment_by_id(comment_id)
+    item_id = _comment_item_id(comment_id)
+    if item_id is None:
+        return e.COMMENT_NOT_FOUND, "The requested response could not be found."
 
-    if comment_to_update is None:
-        return e.COMMENT_NOT_FOUND, "Parent comment could not be found!"
+    values = {}
+    condition = _owner_condition('responder_id', responder_id, old_version_id, values)
 
-    if comment_to_update['commenter_id'] != commenter_id:
-        return e.WRONG_USER, "Users may not delete other users comments"
+    try:
+        get_resource().meta.client.transact_write_items(TransactItems=[
+            {'Delete': {
+                'TableName': COMMENT_TABLE_NAME,
+                'Key': _serialize(_response_key(comment_id, response_id)),
+                'ConditionExpression': condition,
+                'ExpressionAttributeValues': _serialize(values),
+                'ReturnValuesOnConditionCheckFailure': 'ALL_OLD',
+            }},
+            {'Update': {
+                'TableName': COMMENT_TABLE_NAME,
+                'Key': _serialize(_comment_key(comment_id)),
+                'UpdateExpression': 'ADD response_count :minus_one',
+                'ConditionExpression': 'attribute_exists(comment_id)',
+                'ExpressionAttributeValues': _serialize({':minus_one': -1}),
+            }},
+            {'Put': {
+                'TableName': COMMENT_TABLE_NAME,
+                'Item': _serialize(_tombstone(_response_key(comment_id, response_id), item_id)),
+            }},
+        ])
+    except ClientError as err:
+        if err.response['Error']['Code'] != 'TransactionCanceledException' or _throttled(err):
+            raise
+        reasons = err.response.get('CancellationReasons')
+        if reasons is None:
+            response = _read_after_failure(_response_key(comment_id, response_id))
+        elif reasons[0].get('Code') == 'ConditionalCheckFailed':
+            old_item = reasons[0].get('Item')
+            response = {k: _deserializer.deserialize(v) for k, v in old_item.items()} if old_item else None
+        else:
+            return e.COMMENT_NOT_FOUND, "Parent comment could not be found!"
+        return _explain_condition_failure(response, 'responder_id', responder_id,
+                                          "The requested response could not be found.",
+                                          "Users may not delete other users responses")
 
-    res = table.delete_item(
-        Key={
-            'comment_id': comment_id
-        }
-    )
+    _summarize(_record_response_change, item_id, -1, _current_datetime())
+    _invalidate(comment_id, item_id)
+    return None, {"comment_id": comment_id, "response_id": response_id}
 
-    return None, res
+
+@timed
+def fetch_single_response(comment_id, response_id):
+    """
+    fetches a response with response_id = responder_id
+    A single key lookup on the response item.
+    """
+    response = _table().get_item(Key=_response_key(comment_id, response_id)).get('Item', None)
+
+    if response is None:
+        return e.COMMENT_NOT_FOUND, "The requested response could not be found."
+    else:
+        return None, _strip_keys(response)
 
 
-def delete_response(comment_id, response_id, responder_id):
+class DynamoDBDataResource(BaseDataResource):
     """
-    deletes a response with response_id = responder_id
-    needs to verify that the user deleting the response is the same as the user who created the response
+    The DynamoDB storage engine: the functions of this module behind the BaseDataResource interface.
     """
-    comment_to_update = fetch_comment_by_id(comment_id)
 
-    if comment_to_update is None:
-        return e.COMMENT_NOT_FOUND, "Parent comment could not be found!"
+    def __init__(self):
+        super().__init__()
 
-    comment_responses = comment_to_update["responses"]
-    index_of_response_to_update = -1
+    def fetch_comment_by_id(self, comment_id, fields=None, include_responses=ALL_RESPONSES):
+        return fetch_comment_by_id(comment_id, fields, include_responses)
 
-    for idx, resp in enumerate(comment_responses):
-        if resp["response_id"] == response_id:
-            index_of_response_to_update = idx
-            break
+    def get_comments_by_item_id(self, item_id, limit=DEFAULT_PAGE_LIMIT, cursor=None, ascending=True,
+                                fields=None, include_responses=ALL_RESPONSES):
+        return get_comments_by_item_id(item_id, limit, cursor, ascending, fields, include_responses)
 
-    if index_of_response_to_update == -1:
-        return e.COMMENT_NOT_FOUND, "The requested response could not be found."
+    def get_item_changes(self, item_id, since, limit=DEFAULT_PAGE_LIMIT):
+        return get_item_changes(item_id, since, limit)
 
-    if comment_responses[index_of_response_to_update]['responder_id'] != responder_id:
-        return e.WRONG_USER, "Users may not delete other users responses"
+    def changes_token(self):
+        return changes_token()
 
-    res = table.update_item(
-        Key={
-            'comment_id': comment_id
-        },
-        UpdateExpression=f"REMOVE responses[{index_of_response_to_update}]"
-    )
+    def fetch_responses_page(self, comment_id, limit=DEFAULT_PAGE_LIMIT, cursor=None):
+        return fetch_responses_page(comment_id, limit, cursor)
 
-    return None, res
+    def fetch_single_response(self, comment_id, response_id):
+        return fetch_single_response(comment_id, response_id)
 
+    def fetch_comments_page(self, limit=DEFAULT_PAGE_LIMIT, cursor=None):
+        return fetch_comments_page(limit, cursor)
 
-def fetch_single_response(comment_id, response_id):
-    """
-    fetches a response with response_id = responder_id
-    """
-    comment_to_look_in = fetch_comment_by_id(comment_id)
+    def iter_all_comments(self, page_size=None, cursor=None):
+        return iter_all_comments(page_size, cursor)
 
-    if comment_to_look_in is None:
-        return e.COMMENT_NOT_FOUND, "Parent comment could not be found!"
+    def find_comments(self, template, limit=DEFAULT_PAGE_LIMIT, cursor=None, ascending=True, fields=None,
+                      include_responses=ALL_RESPONSES):
+        return find_comments(template, limit, cursor, ascending, fields, include_responses)
 
-    comment_responses = comment_to_look_in["responses"]
-    index_of_response_to_fetch = -1
+    def fetch_all_comments_by_template(self, template):
+        return fetch_all_comments_by_template(template)
 
-    for idx, resp in enumerate(comment_responses):
-        if resp["response_id"] == response_id:
-            index_of_response_to_fetch = idx
-            break
+    def post_comment(self, item_id, commenter_id, comment_text, idempotency=None):
+        return post_comment(item_id, commenter_id, comment_text, idempotency)
 
-    if index_of_response_to_fetch == -1:
-        return e.COMMENT_NOT_FOUND, "The requested response could not be found."
-    else:
-        return None, comment_responses[index_of_response_to_fetch]
\ No newline at end of file
+    def add_response(self, comment_id, responder_id, response_text, idempotency=None):
+        return add_response(comment_id, responder_id, response_text, idempotency)
+
+    def new_comment(self, item_id, commenter_id, comment_text):
+        return new_comment(item_id, commenter_id, comment_text)
+
+    def new_response(self, comment_id, responder_id, response_text):
+        return new_response(comment_id, responder_id, response_text)
+
+    def batch_put_comments(self, comments):
+        return batch_put_comments(comments)
+
+    def add_responses(self, comment_id, responses):
+        return add_responses(comment_id, responses)
+
+    def update_comment(self, comment_id, old_version_id, commenter_id, new_comment_text):
+        return update_comment(comment_id, old_version_id, commenter_id, new_comment_text)
+
+    def update_response(self, comment_id, response_id, new_response_text, responder_id, old_version_id):
+        return update_response(comment_id, response_id, new_response_text, responder_id, old_version_id)
+
+    def delete_comment(self, comment_id, commenter_id, old_version_id=None):
+        return delete_comment(comment_id, commenter_id, old_version_id)
+
+    def delete_response(self, comment_id, response_id, responder_id, old_version_id=None):
+        return delete_response(comment_id, response_id, responder_id, old_version_id)
+
+    def get_item_summary(self, item_id):
+        return get_item_summary(item_id)
+
+    def get_item_summaries(self, item_ids):
+        return get_item_summaries(item_ids)
+
+    def batch_fetch_comments(self, comment_ids):
+        return batch_fetch_comments(comment_ids)
+
+    def batch_post_comments(self, entries):
+        return batch_post_comments(entries)
+
+    def cache_stats(self):
+        return cache_stats()
@@ -0,0 +1,426 @@
+"""
+In-memory storage engine (STORAGE_ENGINE=memory) for tests, load tests and single-process deployments.
+
+Comments are kept in a dict by comment_id, with hash indexes from item_id and commenter_id,
+so every route is a dict lookup or a slice of an already sorted list; nothing is scanned.
+Writes apply the same ownership and optimistic version checks as the DynamoDB engine.
+Data lives in the worker process, so it is lost on restart and not shared between workers.
+"""
+import copy
+import itertools
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+from database_services.base_data_resource import BaseDataResource, BaseDataException, encode_cursor, decode_cursor, \
+    ALL_RESPONSES, project_thread, ChangesExpiredException, check_template, KEY_LOOKUP, INDEX_QUERY, SCAN
+from database_services.dynamodb_errors import DynmamoDBErrors as e
+
+# how many of an item's newest comment ids its summary keeps
+LATEST_COMMENT_IDS = 5
+# how long changes are kept for get_item_changes
+CHANGE_HISTORY_SECONDS = int(os.environ.get('CHANGE_HISTORY_SECONDS', 7 * 24 * 3600))
+
+
+def _current_datetime():
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time()))
+
+
+def _cursor_seq(cursor):
+    """
+    The creation sequence number a cursor continues after, or None for the first page.
+    """
+    key = decode_cursor(cursor)
+    if key is None:
+        return None
+    try:
+        return int(key['seq'])
+    except (KeyError, TypeError, ValueError):
+        raise BaseDataException("Invalid pagination cursor")
+
+
+class InMemoryDataResource(BaseDataResource):
+    """
+    Every record carries a process-wide creation sequence number. Each index is a list of
+    (seq, id) in creation order, so pages are bisected out of it and cursors are sequence numbers.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.RLock()
+        self._seq = itertools.count(1)
+        self._comments = {}         # comment_id -> comment, without responses
+        self._responses = {}        # comment_id -> {response_id: response}
+        self._response_order = {}   # comment_id -> [(seq, response_id)]
+        self._order = []            # [(seq, comment_id)] across all items
+        self._by_item = {}          # item_id -> [(seq, comment_id)]
+        self._by_commenter = {}     # commenter_id -> [(seq, comment_id)]
+        self._last_activity = {}    # item_id -> datetime of the last write
+        self._item_responses = {}   # item_id -> number of responses on its comments
+        self._changes = {}          # item_id -> [(seq, comment_id, response_id, deleted, time)]
+        self._changes_floor = {}    # item_id -> seq of the newest change dropped from its log
+        self._idempotency = {}      # idempotency key -> (fingerprint, result, expires_at)
+
+    @staticmethod
+    def _remove(index, seq):
+        del index[bisect_left(index, (seq,))]
+
+    @staticmethod
+    def _page(index, limit, cursor, ascending=True):
+        """
+        Slices one page of (seq, id) out of a sorted index.
+        Returns (ids, next_cursor).
+        """
+        limit = min(limit, BaseDataResource.MAX_PAGE_LIMIT)
+        after = _cursor_seq(cursor)
+        if ascending:
+            start = 0 if after is None else bisect_left(index, (after + 1,))
+            page = index[start:start + limit]
+            more = start + limit < len(index)
+        else:
+            end = len(index) if after is None else bisect_left(index, (after,))
+            page = index[max(0, end - limit):end][::-1]
+            more = end - limit > 0
+        next_cursor = encode_cursor({'seq': page[-1][0]}) if page and more else None
+        return [record_id for _, record_id in page], next_cursor
+
+    def _thread(self, comment_id, fields=None, include_responses=ALL_RESPONSES):
+        """
+        A copy of a comment with its responses list, projected. Must hold the lock.
+        Only the responses the projection keeps are copied.
+        """
+        comment = copy.deepcopy(self._comments[comment_id])
+        del comment['_seq']
+        mode, first = include_responses
+        order = self._response_order[comment_id]
+        if mode in ('none', 'count'):
+            order = []
+        elif mode == 'first':
+            order = order[:first]
+        comment['responses'] = [self._public(self._responses[comment_id][response_id]) for _, response_id in order]
+        return project_thread(comment, fields, include_responses)
+
+    @staticmethod
+    def _public(record):
+        record = copy.deepcopy(record)
+        record.pop('_seq', None)
+        return record
+
+    def _touch(self, item_id, dts):
+        self._last_activity[item_id] = dts
+
+    def _log_change(self, item_id, comment_id, response_id=None, deleted=False):
+        """
+        Appends to the item's change log, dropping changes older than CHANGE_HISTORY_SECONDS. Must hold the lock.
+        """
+        log = self._changes.setdefault(item_id, [])
+        now = time.time()
+        log.append((next(self._seq), comment_id, response_id, deleted, now))
+        expired = 0
+        while log[expired][4] < now - CHANGE_HISTORY_SECONDS:
+            expired += 1
+        if expired:
+            self._changes_floor[item_id] = log[expired - 1][0]
+            del log[:expired]
+
+    def _change(self, comment_id, response_id, deleted):
+        """
+        A change as get_item_changes returns it, or None if the record has gone since. Must hold the lock.
+        """
+        if deleted:
+            change = {'type': 'comment' if response_id is None else 'response', 'comment_id': comment_id}
+            if response_id is not None:
+                change['response_id'] = response_id
+            change['deleted'] = True
+            return change
+        if response_id is None:
+            record = self._comments.get(comment_id)
+        else:
+            record = self._responses.get(comment_id, {}).get(response_id)
+        if record is None:
+            return None
+        return {'type': 'comment' if response_id is None else 'response', **self._public(record), 'deleted': False}
+
+    def fetch_comment_by_id(self, comment_id, fields=None, include_responses=ALL_RESPONSES):
+        with self._lock:
+            if comment_id not in self._comments:
+                return None
+            return self._thread(comment_id, fields, include_responses)
+
+    def get_comments_by_item_id(self, item_id, limit=BaseDataResource.DEFAULT_PAGE_LIMIT, cursor=None,
+                                ascending=True, fields=None, include_responses=ALL_RESPONSES):
+        with self._lock:
+            comment_ids, next_cursor = self._page(self._by_item.get(item_id, []), limit, cursor, ascending)
+            return [self._thread(comment_id, fields, include_responses) for comment_id in comment_ids], next_cursor
+
+    def get_item_changes(self, item_id, since, limit=BaseDataResource.DEFAULT_PAGE_LIMIT):
+        """
+        Pages through the item's change log; a record changed more than once in a page is reported once.
+        """
+        after = _cursor_seq(since)
+        if after is None:
+            raise BaseDataException("Invalid since token")
+        limit = min(limit, self.MAX_PAGE_LIMIT)
+        with self._lock:
+            if after < self._changes_floor.get(item_id, 0):
+                raise ChangesExpiredException("since token is older than the change history")
+            log = self._changes.get(item_id, [])
+            start = bisect_left(log, (after + 1,))
+            page = log[start:start + limit]
+            latest = {}
+            for _, comment_id, response_id, deleted, _ in page:
+                latest.pop((comment_id, response_id), None)
+                latest[(comment_id, response_id)] = deleted
+            changes = [self._change(comment_id, response_id, deleted)
+                       for (comment_id, response_id), deleted in latest.items()]
+            next_since = encode_cursor({'seq': page[-1][0] if page else after})
+            return [c for c in changes if c is not None], next_since, start + limit < len(log)
+
+    def changes_token(self):
+        with self._lock:
+            return encode_cursor({'seq': next(self._seq)})
+
+    def fetch_responses_page(self, comment_id, limit=BaseDataResource.DEFAULT_PAGE_LIMIT, cursor=None):
+        with self._lock:
+            response_ids, next_cursor = self._page(self._response_order.get(comment_id, []), limit, cursor)
+            return [self._public(self._responses[comment_id][r]) for r in response_ids], next_cursor
+
+    def fetch_single_response(self, comment_id, response_id):
+        with self._lock:
+            response = self._responses.get(comment_id, {}).get(response_id)
+            if response is None:
+                return e.COMMENT_NOT_FOUND, "The requested response could not be found."
+            return None, self._public(response)
+
+    def fetch_comments_page(self, limit=BaseDataResource.DEFAULT_PAGE_LIMIT, cursor=None):
+        with self._lock:
+            comment_ids, next_cursor = self._page(self._order, limit, cursor)
+            return [self._thread(comment_id) for comment_id in comment_ids], next_cursor
+
+    def iter_all_comments(self, page_size=None, cursor=None):
+        page_size = page_size or self.MAX_PAGE_LIMIT
+        while True:
+            comments, cursor = self.fetch_comments_page(page_size, cursor)
+            yield from comments
+            if cursor is None:
+                return
+
+    def find_comments(self, template, limit=BaseDataResource.DEFAULT_PAGE_LIMIT, cursor=None, ascending=True,
+                      fields=None, include_responses=ALL_RESPONSES):
+        """
+        The DynamoDB engine's plans over the in-memory indexes: the comment dict for a comment_id,
+        the commenter_id or item_id index, or else every comment in creation order.
+        """
+        check_template(template)
+        with self._lock:
+            if 'comment_id' in template:
+                access_path, index, key = KEY_LOOKUP, None, ['comment_id']
+                comment_ids = [template['comment_id']] if template['comment_id'] in self._comments else []
+                next_cursor = None
+            else:
+                index = next((name for name in ('commenter_id', 'item_id') if name in template), None)
+                if index is not None:
+                    access_path, key = INDEX_QUERY, [index]
+                    candidates = (self._by_commenter if index == 'commenter_id' else self._by_item) \
+                        .get(template[index], [])
+                else:
+                    access_path, key, candidates = SCAN, [], self._order
+                comment_ids, next_cursor = self._page(candidates, limit, cursor, ascending)
+            filter_attributes = sorted(set(template) - set(key))
+            comments = [self._thread(comment_id, fields, include_responses) for comment_id in comment_ids
+                        if all(self._comments[comment_id].get(k) == template[k] for k in filter_attributes)]
+        explain = {'access_path': access_path, 'index': index, 'key_attributes': key,
+                   'filter_attributes': filter_attributes, 'items_examined': len(comment_ids),
+                   'items_returned': len(comments)}
+        return comments, next_cursor, explain
+
+    def new_comment(self, item_id, commenter_id, comment_text):
+        return {
+            "comment_id": str(uuid.uuid4()),
+            "version_id": str(uuid.uuid4()),
+            "commenter_id": commenter_id,
+            "comment_text": comment_text,
+            "datetime": _current_datetime(),
+            "item_id": item_id,
+            "response_count": 0
+        }
+
+    def new_response(self, comment_id, responder_id, response_text):
+        return {
+            "comment_id": comment_id,
+            "responder_id": responder_id,
+            "datetime": _current_datetime(),
+            "response_text": response_text,
+            "response_id": str(uuid.uuid4()),
+            "version_id": str(uuid.uuid4())
+        }
+
+    def _replay(self, idempotency):
+        """
+        The stored answer for an Idempotency-Key seen before, or None if the post should go ahead. Must hold the lock.
+        """
+        if idempotency is None:
+            return None
+        entry = self._idempotency.get(idempotency.key)
+        if entry is None or entry[2] < time.time():
+            return None
+        fingerprint, result, _ = entry
+        if fingerprint != idempotency.fingerprint:
+            return e.IDEMPOTENCY_KEY_REUSED, "Idempotency-Key was already used for a different request"
+        idempotency.replayed = True
+        return None, copy.deepcopy(result)
+
+    def _record_idempotency(self, idempotency, result):
+        """
+        Stores a post's result under its Idempotency-Key, dropping expired keys. Must hold the lock.
+        """
+        if idempotency is None:
+            return
+        now = time.time()
+        if len(self._idempotency) % 1000 == 999:
+            self._idempotency = {k: v for k, v in self._idempotency.items() if v[2] >= now}
+        self._idempotency[idempotency.key] = (idempotency.fingerprint, copy.deepcopy(result), now + idempotency.ttl)
+
+    def post_comment(self, item_id, commenter_id, comment_text, idempotency=None):
+        with self._lock:
+            replay = self._replay(idempotency)
+            if replay is not None:
+                return replay
+            error, result = self.batch_put_comments([self.new_comment(item_id, commenter_id, comment_text)])[0]
+            self._record_idempotency(idempotency, result)
+            return error, result
+
+    def batch_put_comments(self, comments):
+        with self._lock:
+            for comment in comments:
+                seq = next(self._seq)
+                comment_id, item_id = comment['comment_id'], comment['item_id']
+                self._comments[comment_id] = {**comment, '_seq': seq}
+                self._responses[comment_id] = {}
+                self._response_order[comment_id] = []
+                self._order.append((seq, comment_id))
+                self._by_item.setdefault(item_id, []).append((seq, comment_id))
+                self._by_commenter.setdefault(comment['commenter_id'], []).append((seq, comment_id))
+                self._touch(item_id, comment['datetime'])
+                self._log_change(item_id, comment_id)
+        return [(None, comment) for comment in comments]
+
+    def add_response(self, comment_id, responder_id, response_text, idempotency=None):
+        with self._lock:
+            replay = self._replay(idempotency)
+            if replay is not None:
+                return replay
+            error, result = self.add_responses(comment_id,
+                                               [self.new_response(comment_id, responder_id, response_text)])
+            if error is not None:
+                return error, result
+            self._record_idempotency(idempotency, result[0])
+            return None, result[0]
+
+    def add_responses(self, comment_id, responses):
+        with self._lock:
+            comment = self._comments.get(comment_id)
+            if comment is None:
+                return e.COMMENT_NOT_FOUND, "Parent comment could not be found!"
+            for response in responses:
+                seq = next(self._seq)
+                self._responses[comment_id][response['response_id']] = {**response, '_seq': seq}
+                self._response_order[comment_id].append((seq, response['response_id']))
+                self._log_change(comment['item_id'], comment_id, response['response_id'])
+            comment['response_count'] += len(responses)
+            self._item_responses[comment['item_id']] = \
+                self._item_responses.get(comment['item_id'], 0) + len(responses)
+            if responses:
+                self._touch(comment['item_id'], responses[-1]['datetime'])
+        return None, responses
+
+    @staticmethod
+    def _check_owner(record, owner_attribute, user_id, old_version_id, not_found_message, wrong_user_message):
+        """
+        The in-memory counterpart of the DynamoDB engine's conditional writes.
+        Returns (error, message), or None if the write may go ahead.
+        """
+        if record is None:
+            return e.COMMENT_NOT_FOUND, not_found_message
+        if record[owner_attribute] != user_id:
+            return e.WRONG_USER, wrong_user_message
+        if old_version_id is not None and record['version_id'] != old_version_id:
+            return e.WRITE_WRITE_CONFLICT, "VersionID incorrect- Write Write conflict"
+        return None
+
+    def update_comment(self, comment_id, old_version_id, commenter_id, new_comment_text):
+        with self._lock:
+            comment = self._comments.get(comment_id)
+            failure = self._check_owner(comment, 'commenter_id', commenter_id, old_version_id,
+                                        "Comment could not be found!", "Users may not edit other users comments")
+            if failure is not None:
+                return failure
+            comment.update(comment_text=new_comment_text, version_id=str(uuid.uuid4()),
+                           edited_at=_current_datetime())
+            self._touch(comment['item_id'], comment['edited_at'])
+            self._log_change(comment['item_id'], comment_id)
+            return None, self._public(comment)
+
+    def update_response(self, comment_id, response_id, new_response_text, responder_id, old_version_id):
+        with self._lock:
+            response = self._responses.get(comment_id, {}).get(response_id)
+            failure = self._check_owner(response, 'responder_id', responder_id, old_version_id,
+                                        "The requested response could not be found.",
+                                        "Users may not edit other users comments")
+            if failure is not None:
+                return failure
+            response.update(response_text=new_response_text, version_id=str(uuid.uuid4()),
+                            edited_at=_current_datetime())
+            self._touch(self._comments[comment_id]['item_id'], response['edited_at'])
+            self._log_change(self._comments[comment_id]['item_id'], comment_id, response_id)
+            return None, self._public(response)
+
+    def delete_comment(self, comment_id, commenter_id, old_version_id=None):
+        with self._lock:
+            comment = self._comments.get(comment_id)
+            failure = self._check_owner(comment, 'commenter_id', commenter_id, old_version_id,
+                                        "Parent comment could not be found!",
+                                        "Users may not delete other users comments")
+            if failure is not None:
+                return failure
+            del self._comments[comment_id]
+            del self._responses[comment_id]
+            del self._response_order[comment_id]
+            self._remove(self._order, comment['_seq'])
+            self._remove(self._by_item[comment['item_id']], comment['_seq'])
+            self._remove(self._by_commenter[comment['commenter_id']], comment['_seq'])
+            self._item_responses[comment['item_id']] = \
+                self._item_responses.get(comment['item_id'], 0) - comment['response_count']
+            self._touch(comment['item_id'], _current_datetime())
+            self._log_change(comment['item_id'], comment_id, deleted=True)
+            return None, self._public(comment)
+
+    def delete_response(self, comment_id, response_id, responder_id, old_version_id=None):
+        with self._lock:
+            response = self._responses.get(comment_id, {}).get(response_id)
+            failure = self._check_owner(response, 'responder_id', responder_id, old_version_id,
+                                        "The requested response could not be found.",
+                                        "Users may not delete other users responses")
+            if failure is not None:
+                return failure
+            del self._responses[comment_id][response_id]
+            self._remove(self._response_order[comment_id], response['_seq'])
+            comment = self._comments[comment_id]
+            comment['response_count'] -= 1
+            self._item_responses[comment['item_id']] -= 1
+            self._touch(comment['item_id'], _current_datetime())
+            self._log_change(comment['item_id'], comment_id, response_id, deleted=True)
+            return None, {"comment_id": comment_id, "response_id": response_id}
+
+    def get_item_summary(self, item_id):
+        with self._lock:
+            index = self._by_item.get(item_id, [])
+            return {
+                "item_id": item_id,
+                "comment_count": len(index),
+                "response_count": self._item_responses.get(item_id, 0),
+                "last_activity": self._last_activity.get(item_id),
+                "latest_comment_ids": [c for _, c in index[:-LATEST_COMMENT_IDS - 1:-1]],
+            }
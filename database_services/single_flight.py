@@ -0,0 +1,109 @@
+"""
+Single-flight coalescing of concurrent identical reads in dynamodb_service.
+
+When several threads of a worker (gthread, or the async thread pool) ask for the same comment
+or listing page at once, the first one (the leader) makes the DynamoDB call and the others wait
+for it and share its result, or its exception. Nothing is kept once the call returns, so the
+result is never older than a read that was already in flight when the caller arrived.
+
+Reads are grouped by what they read ("comment:<id>", "item:<id>"). A write forgets the group's
+calls in flight, so a read arriving after a write in this worker always makes a fresh call;
+callers already waiting keep the result of the call they joined, which they may have got anyway.
+Each caller gets its own copy of the result and may mutate it.
+"""
+import copy
+import threading
+
+from middleware import metrics
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.followers = 0
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same (group, key) in this process into one.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.leaders = 0
+        self.followers = 0
+        self._calls = {}   # (group, key) -> _Call
+        self._groups = {}  # group -> set of (group, key) in flight
+        self._lock = threading.Lock()
+
+    def do(self, group, key, fn, read=None):
+        """
+        Returns fn(), sharing the call with any caller of the same group and key while it is in flight.
+        read: label of the collapsed-call counters (default the group's kind, e.g. "comment")
+        """
+        if not self.enabled:
+            return fn()
+        read = read or group.split(':', 1)[0]
+        flight = (group, key)
+        with self._lock:
+            call = self._calls.get(flight)
+            leader = call is None
+            if leader:
+                call = self._calls[flight] = _Call()
+                self._groups.setdefault(group, set()).add(flight)
+                self.leaders += 1
+            else:
+                call.followers += 1
+                self.followers += 1
+        metrics.inc(metrics.SINGLE_FLIGHT_CALLS, read=read, role='leader' if leader else 'follower')
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = fn()
+        except BaseException as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                self._forget(flight, call)
+                followers = call.followers
+            call.done.set()
+        # followers copy the result concurrently, so the leader must not hand out the shared one
+        return copy.deepcopy(call.result) if followers else call.result
+
+    def _forget(self, flight, call):
+        if self._calls.get(flight) is call:
+            del self._calls[flight]
+            in_flight = self._groups.get(flight[0])
+            if in_flight is not None:
+                in_flight.discard(flight)
+                if not in_flight:
+                    del self._groups[flight[0]]
+
+    def forget(self, group):
+        """
+        Detaches the group's calls in flight, so later callers make a new call. Called after a write.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            for flight in self._groups.pop(group, ()):
+                self._calls.pop(flight, None)
+
+    def stats(self):
+        with self._lock:
+            calls = self.leaders + self.followers
+            return {
+                'enabled': self.enabled,
+                'calls': calls,
+                'collapsed': self.followers,
+                'collapsed_ratio': self.followers / calls if calls else 0.0,
+                'in_flight': len(self._calls),
+            }
@@ -0,0 +1,240 @@
+"""
+Write-behind for posted comments and responses (WRITE_BEHIND=true).
+
+The POST routes build the new record, ids included, hand it to a bounded in-process queue and
+answer 202 with its ids. A background thread in each worker writes the queue out in batches:
+    * comments with batch_put_comments (25 per BatchWriteItem, one summary update per item);
+    * responses grouped by comment, each group with one add_responses call (one transaction
+      and one response_count/summary update per comment instead of one per response).
+
+Durability: an accepted write only lives in the worker's memory until its batch is written.
+It is lost if the worker dies first; a graceful shutdown drains the queue (see gunicorn.conf.py).
+A response whose comment no longer exists is dropped when its batch is written. Readers may not
+see an accepted write until then. A full queue rejects new writes instead of growing, and the
+routes answer 503 with Retry-After. All of this is counted in stats() and in /metrics.
+"""
+import atexit
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+from botocore.exceptions import ConnectionError as EndpointError, HTTPClientError
+
+from database_services.base_data_resource import CapacityExceededException
+from middleware import metrics
+
+logger = logging.getLogger()
+
+COMMENT = "comment"
+RESPONSE = "response"
+
+# how long the flusher blocks on an empty queue before checking whether it should stop
+POLL_SECONDS = 0.5
+
+# errors after which a batch is tried again: throttling, and connections that failed or dropped
+# (the write may or may not have happened, so only retry-safe writes are used, see _attempt)
+RETRYABLE_ERRORS = (CapacityExceededException, EndpointError, HTTPClientError)
+
+
+class WriteBehindQueue:
+    """
+    Queue entries are (accepted_at, kind, record). The flusher thread is started on the first
+    write in each process, so a queue created before gunicorn forks its workers is safe to use.
+    """
+
+    def __init__(self, db, max_size=10000, batch_size=100, linger=0.05, enqueue_timeout=0.1, max_attempts=5,
+                 drain_timeout=10.0):
+        """
+        db: the BaseDataResource the batches are written to
+        linger: seconds the flusher waits for a batch to fill up once its first write arrives
+        enqueue_timeout: seconds a write waits for room in a full queue before it is rejected
+        max_attempts: tries per batch when the engine is throttled or unreachable before its writes count as failed
+        drain_timeout: seconds close() waits for the queue to drain
+        """
+        self.db = db
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.linger = linger
+        self.enqueue_timeout = enqueue_timeout
+        self.max_attempts = max_attempts
+        self.drain_timeout = drain_timeout
+
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(max_size)
+        self._thread = None
+        self._pid = None
+        self._closing = False
+        self._in_flight = 0
+        self._counts = {}  # (kind, outcome) -> number of writes
+        self._batches = 0
+        self._last_flush_seconds = None
+        metrics.set_gauge(metrics.WRITE_BEHIND_QUEUE_DEPTH, self.depth)
+
+    def submit_comment(self, comment):
+        """
+        Queues a comment built by db.new_comment. Returns False if the queue is full or closed.
+        """
+        return self._submit(COMMENT, comment)
+
+    def submit_response(self, response):
+        """
+        Queues a response built by db.new_response. Returns False if the queue is full or closed.
+        """
+        return self._submit(RESPONSE, response)
+
+    def _submit(self, kind, record):
+        self._ensure_flusher()
+        try:
+            if self._closing:
+                raise queue.Full
+            self._queue.put((time.monotonic(), kind, record), timeout=self.enqueue_timeout)
+        except queue.Full:
+            self._count(kind, "rejected")
+            return False
+        self._count(kind, "accepted")
+        return True
+
+    def _ensure_flusher(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    # a forked child starts with an empty queue and no flusher thread of its own
+                    self._queue = queue.Queue(self.max_size)
+                    self._closing = False
+                    self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                    self._thread.start()
+                    self._pid = pid
+                    atexit.register(self.close)
+
+    def _count(self, kind, outcome, n=1):
+        with self._lock:
+            self._counts[(kind, outcome)] = self._counts.get((kind, outcome), 0) + n
+        metrics.inc(metrics.WRITE_BEHIND_WRITES, n, kind=kind, outcome=outcome)
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            if batch:
+                self._flush(batch)
+
+    def _take_batch(self):
+        """
+        Blocks for the first write, then collects more until the batch is full or linger has passed.
+        Returns None once the queue is closing and empty.
+        """
+        try:
+            batch = [self._queue.get(timeout=POLL_SECONDS)]
+        except queue.Empty:
+            return None if self._closing else []
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch):
+        """
+        Writes one batch: its comments first, so responses to them find them, then each comment's responses.
+        """
+        with self._lock:
+            self._in_flight = len(batch)
+        start = time.perf_counter()
+
+        comments = [record for _, kind, record in batch if kind == COMMENT]
+        responses = {}
+        for _, kind, record in batch:
+            if kind == RESPONSE:
+                responses.setdefault(record['comment_id'], []).append(record)
+
+        if comments:
+            results = self._attempt(self.db.batch_put_comments, comments)
+            written = 0 if results is None else sum(1 for error, _ in results if error is None)
+            self._record_outcome(COMMENT, written, len(comments) - written)
+        for comment_id, records in responses.items():
+            result = self._attempt(self.db.add_responses, comment_id, records)
+            if result is not None and result[0] is None:
+                self._record_outcome(RESPONSE, len(records), 0)
+            else:
+                if result is not None:
+                    logger.warning("write-behind dropped %d responses to comment %s: %s",
+                                   len(records), comment_id, result[1])
+                self._record_outcome(RESPONSE, 0, len(records))
+
+        elapsed = time.perf_counter() - start
+        metrics.observe(metrics.WRITE_BEHIND_FLUSH_SECONDS, elapsed)
+        with self._lock:
+            self._in_flight = 0
+            self._batches += 1
+            self._last_flush_seconds = elapsed
+
+    def _attempt(self, write, *args):
+        """
+        Calls write(*args), retrying with backoff on RETRYABLE_ERRORS. Returns None if it failed.
+        Only batch_put_comments and add_responses are written this way; both can be repeated after
+        they raise without applying anything twice (see their docstrings). Any other error is not
+        retried, since the write may have been partly applied.
+        """
+        for attempt in range(self.max_attempts):
+            if attempt:
+                time.sleep(random.uniform(0, min(2.0, 0.05 * (2 ** attempt))))
+            try:
+                return write(*args)
+            except RETRYABLE_ERRORS:
+                logger.exception("write-behind batch failed (attempt %d of %d)", attempt + 1, self.max_attempts)
+            except Exception:
+                logger.exception("write-behind batch failed, not retrying")
+                return None
+        return None
+
+    def _record_outcome(self, kind, written, failed):
+        if written:
+            self._count(kind, "written", written)
+        if failed:
+            self._count(kind, "failed", failed)
+
+    def depth(self):
+        """
+        Writes accepted and not yet written: the queue plus the batch being written.
+        """
+        return self._queue.qsize() + self._in_flight
+
+    def close(self, timeout=None):
+        """
+        Stops taking new writes and lets the flusher write out everything queued, waiting up to
+        timeout (default drain_timeout) seconds. Returns the number of writes left unwritten.
+        """
+        self._closing = True
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            thread.join(self.drain_timeout if timeout is None else timeout)
+        left = self.depth()
+        if left:
+            logger.error("write-behind queue closed with %d writes not written", left)
+        return left
+
+    def stats(self):
+        with self._queue.mutex:
+            oldest = self._queue.queue[0][0] if self._queue.queue else None
+        with self._lock:
+            writes = {}
+            for (kind, outcome), n in self._counts.items():
+                writes.setdefault(kind, {})[outcome] = n
+            return {
+                'mode': 'write-behind',
+                'queue_depth': self._queue.qsize(),
+                'queue_capacity': self.max_size,
+                'in_flight': self._in_flight,
+                'oldest_pending_seconds': time.monotonic() - oldest if oldest is not None else None,
+                'batches': self._batches,
+                'last_flush_seconds': self._last_flush_seconds,
+                'writes': writes,
+            }
@@ -0,0 +1,50 @@
+"""
+gunicorn settings. SERVER_MODE picks the entry point:
+    * sync (default) -- application:application on WSGI workers; GUNICORN_THREADS > 1 uses gthread workers.
+    * async -- asgi:application on uvicorn workers. A thread-pool bridge, not non-blocking I/O: Flask still
+      runs synchronously, one of ASGI_THREADS pool threads per request in flight; see asgi.py.
+"""
+import os
+import sys
+
+SERVER_MODE = os.environ.get("SERVER_MODE", "sync")
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("GUNICORN_WORKERS", 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 1))
+
+# The app does no I/O at import time, so it can be loaded once in the master and forked;
+# each worker creates its own DynamoDB client on first use.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "false").lower() == "true"
+
+if SERVER_MODE == "async":
+    wsgi_app = "asgi:application"
+    worker_class = "uvicorn.workers.UvicornWorker"
+    # the bridge's pool, not GUNICORN_THREADS, caps the requests a worker runs at once
+    concurrent_requests = int(os.environ.get("ASGI_THREADS", 256))
+elif SERVER_MODE == "sync":
+    wsgi_app = "application:application"
+    worker_class = "gthread" if threads > 1 else "sync"
+    concurrent_requests = threads
+else:
+    raise ValueError(f"SERVER_MODE must be sync or async, not {SERVER_MODE}")
+
+# the memory cache is per worker: a write in one worker would leave the others serving the old entry
+if workers > 1 and os.environ.get("COMMENT_CACHE_BACKEND", "none") == "memory":
+    raise ValueError("COMMENT_CACHE_BACKEND=memory only works with one worker (GUNICORN_WORKERS=1); "
+                     "use a redis:// cache to share invalidation between workers")
+
+# one pooled DynamoDB connection per request a worker can run at once, plus one per thread of the
+# multi-item and response read pools (workers inherit this)
+concurrent_calls = concurrent_requests + int(os.environ.get("CATALOG_READ_WORKERS", 8)) + \
+    int(os.environ.get("RESPONSE_READ_WORKERS", 8))
+os.environ.setdefault("DYNAMODB_MAX_POOL_CONNECTIONS", str(max(10, concurrent_calls)))
+
+
+def worker_exit(server, worker):
+    """
+    Writes out the worker's write-behind queue (WRITE_BEHIND=true) before it exits.
+    """
+    application = sys.modules.get("application")
+    if application is not None and application.write_queue is not None:
+        application.write_queue.close()
@@ -0,0 +1,248 @@
+"""
+Latency histograms and DynamoDB capacity counters, served in the Prometheus text format from /metrics.
+
+Every thread records into its own shard, so recording takes no lock and threads never
+contend; the shards are only merged when /metrics is scraped. Shards are created once per
+thread (gthread and ASGI pools reuse their threads), and each worker process reports its
+own numbers, like any multi-process Prometheus target.
+"""
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+
+HTTP_REQUEST_SECONDS = "http_request_duration_seconds"
+AUTH_SECONDS = "auth_verify_token_duration_seconds"
+DYNAMODB_FUNCTION_SECONDS = "dynamodb_function_duration_seconds"
+DYNAMODB_CALLS = "dynamodb_calls_total"
+DYNAMODB_CAPACITY = "dynamodb_consumed_capacity_units_total"
+DYNAMODB_SCANNED = "dynamodb_items_scanned_total"
+DYNAMODB_RETURNED = "dynamodb_items_returned_total"
+WRITE_BEHIND_WRITES = "write_behind_writes_total"
+WRITE_BEHIND_FLUSH_SECONDS = "write_behind_flush_duration_seconds"
+WRITE_BEHIND_QUEUE_DEPTH = "write_behind_queue_depth"
+RATE_LIMITED_REQUESTS = "rate_limited_requests_total"
+SHED_REQUESTS = "shed_requests_total"
+DYNAMODB_THROTTLES = "dynamodb_throttled_requests_total"
+ADMISSION_LEVEL = "admission_level"
+SINGLE_FLIGHT_CALLS = "single_flight_reads_total"
+CACHE_ERRORS = "comment_cache_errors_total"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+    HTTP_REQUEST_SECONDS: ("histogram", "Time to handle a request, by route template, method and status."),
+    AUTH_SECONDS: ("histogram", "Time spent in Security.verify_token."),
+    DYNAMODB_FUNCTION_SECONDS: ("histogram", "Time spent in each dynamodb_service function."),
+    DYNAMODB_CALLS: ("counter", "DynamoDB API calls, by dynamodb_service function and operation."),
+    DYNAMODB_CAPACITY: ("counter", "Consumed capacity units reported by DynamoDB, by function and table."),
+    DYNAMODB_SCANNED: ("counter", "Items read by Query and Scan calls before filtering (ScannedCount)."),
+    DYNAMODB_RETURNED: ("counter", "Items returned by Query and Scan calls after filtering (Count)."),
+    WRITE_BEHIND_WRITES: ("counter", "Writes handled by the write-behind queue, by kind and outcome."),
+    WRITE_BEHIND_FLUSH_SECONDS: ("histogram", "Time to write one write-behind batch."),
+    WRITE_BEHIND_QUEUE_DEPTH: ("gauge", "Writes accepted by the write-behind queue and not yet written."),
+    RATE_LIMITED_REQUESTS: ("counter", "Requests answered 429 because the user's read or write budget was spent."),
+    SHED_REQUESTS: ("counter", "Requests answered 503 while shedding load after DynamoDB throttling."),
+    DYNAMODB_THROTTLES: ("counter", "Requests that failed because DynamoDB was still throttling after retries."),
+    ADMISSION_LEVEL: ("gauge", "Fraction of requests this worker admits; below 1 while shedding load."),
+    SINGLE_FLIGHT_CALLS: ("counter", "Coalesced reads, by read and role: leaders call DynamoDB, followers "
+                                     "share a leader's call."),
+    CACHE_ERRORS: ("counter", "Comment cache calls that failed and were skipped, by operation."),
+}
+
+
+class _Shard:
+    def __init__(self):
+        self.histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self.counters = {}    # (name, labels) -> value
+
+
+_local = threading.local()
+_shards = []
+_shards_lock = threading.Lock()
+_gauges = {}  # name -> callable returning the current value
+
+
+def _shard():
+    try:
+        return _local.shard
+    except AttributeError:
+        shard = _local.shard = _Shard()
+        with _shards_lock:
+            _shards.append(shard)
+        return shard
+
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def observe(name, seconds, **labels):
+    """
+    Records one observation in a latency histogram.
+    """
+    histograms = _shard().histograms
+    key = (name, _labels(labels))
+    values = histograms.get(key)
+    if values is None:
+        values = histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+    values[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+    values[-1] += seconds
+
+
+def inc(name, amount=1, **labels):
+    counters = _shard().counters
+    key = (name, _labels(labels))
+    counters[key] = counters.get(key, 0) + amount
+
+
+def set_gauge(name, read):
+    """
+    Reports name as the value read() returns whenever the metrics are rendered.
+    """
+    _gauges[name] = read
+
+
+def _dynamodb_function():
+    return getattr(_local, "dynamodb_function", None)
+
+
+def timed_function(name):
+    """
+    Decorator that records the wrapped function's duration in histogram name, labelled with its name.
+    DynamoDB calls made while it runs are attributed to the outermost timed function.
+    Returned generators are timed while they are consumed.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            outermost = _dynamodb_function() is None
+            if outermost:
+                _local.dynamodb_function = fn.__name__
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                if outermost:
+                    _local.dynamodb_function = None
+            if inspect.isgenerator(result):
+                return _timed_generator(name, fn.__name__, result, elapsed)
+            observe(name, elapsed, function=fn.__name__)
+            return result
+        return wrapper
+    return decorator
+
+
+def attributed(fn):
+    """
+    Wraps fn, to be run on another thread, so its DynamoDB calls are attributed to the timed
+    function running now on this one.
+    """
+    function = _dynamodb_function()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        _local.dynamodb_function = function
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.dynamodb_function = None
+    return wrapper
+
+
+def _timed_generator(name, function, generator, elapsed):
+    while True:
+        outermost = _dynamodb_function() is None
+        if outermost:
+            _local.dynamodb_function = function
+        start = time.perf_counter()
+        try:
+            item = next(generator)
+        except StopIteration:
+            observe(name, elapsed + time.perf_counter() - start, function=function)
+            return
+        finally:
+            elapsed += time.perf_counter() - start
+            if outermost:
+                _local.dynamodb_function = None
+        yield item
+
+
+def _request_capacity(params, model, **kwargs):
+    if "ReturnConsumedCapacity" in model.input_shape.members:
+        params.setdefault("ReturnConsumedCapacity", "TOTAL")
+
+
+def _record_call(parsed, model, **kwargs):
+    function = _dynamodb_function() or "other"
+    inc(DYNAMODB_CALLS, function=function, operation=model.name)
+
+    consumed = parsed.get("ConsumedCapacity")
+    for capacity in consumed if isinstance(consumed, list) else [consumed] if consumed else []:
+        inc(DYNAMODB_CAPACITY, capacity.get("CapacityUnits", 0.0), function=function,
+            table=capacity.get("TableName", ""))
+    if "ScannedCount" in parsed:
+        inc(DYNAMODB_SCANNED, parsed["ScannedCount"], function=function, operation=model.name)
+        inc(DYNAMODB_RETURNED, parsed.get("Count", 0), function=function, operation=model.name)
+
+
+def instrument_dynamodb_client(client):
+    """
+    Makes every call on a boto3 DynamoDB client ask for its consumed capacity, and records the
+    capacity, the call, and the scanned/returned counts of queries and scans.
+    """
+    client.meta.events.register("provide-client-params.dynamodb.*", _request_capacity)
+    client.meta.events.register("after-call.dynamodb.*", _record_call)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def render():
+    """
+    Merges every thread's shard and returns the metrics in the Prometheus text exposition format.
+    """
+    histograms = {}
+    counters = {}
+    with _shards_lock:
+        shards = list(_shards)
+    for shard in shards:
+        for key, values in dict(shard.histograms).items():
+            merged = histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(list(values)):
+                merged[i] += value
+        for key, value in dict(shard.counters).items():
+            counters[key] = counters.get(key, 0) + value
+
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "histogram":
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), values[:-1]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {values[-1]}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        elif kind == "gauge":
+            if name in _gauges:
+                lines.append(f"{name} {_gauges[name]()}")
+        else:
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,191 @@
+"""
+Admission control: per-user token buckets, and load shedding while DynamoDB is throttling.
+
+Each user has one bucket for reads and one for writes, refilled at a steady rate up to a burst
+size; a request takes one token or is answered 429 with Retry-After. Buckets live in a store:
+    * memory -- per worker process, so the real limit is the per-worker limit times the workers;
+    * sqlite:///path -- one SQLite file shared by every worker on the host (put it on local disk
+      or /dev/shm); each check is one short write transaction.
+
+Independently, every DynamoDB throttle that survives botocore's retries lowers the fraction of
+requests the worker admits, which then recovers steadily, so the service backs off while the
+table is over capacity instead of adding retries to it.
+"""
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger()
+
+READ = "read"
+WRITE = "write"
+READ_METHODS = {"GET", "HEAD"}
+
+
+def _take(tokens, updated, now, rate, burst, cost):
+    """
+    The token bucket step: refills tokens for the time since updated, then takes cost if there is enough.
+    Returns (tokens left, seconds until cost tokens are available, or 0 if they were taken).
+    """
+    tokens = min(burst, tokens + (now - updated) * rate)
+    if tokens >= cost:
+        return tokens - cost, 0.0
+    return tokens, (cost - tokens) / rate
+
+
+class MemoryBuckets:
+    """
+    Buckets of one worker process, bounded to max_keys users (least recently seen dropped first;
+    a dropped bucket comes back full, which is what it would have refilled to).
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1):
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens, retry_after = _take(tokens, updated, now, rate, burst, cost)
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+
+class SQLiteBuckets:
+    """
+    Buckets in a SQLite file, shared by the workers of a host. Every thread has its own connection;
+    rows of users idle for longer than PRUNE_AFTER seconds are deleted now and then.
+    """
+    PRUNE_AFTER = 3600
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._checks = 0
+        self._connection().execute("CREATE TABLE IF NOT EXISTS buckets "
+                                   "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def take(self, key, rate, burst, cost=1):
+        connection = self._connection()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row is not None else (burst, now)
+            tokens, retry_after = _take(tokens, updated, now, rate, burst, cost)
+            connection.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                               (key, tokens, now))
+            self._checks += 1
+            if self._checks % self.PRUNE_EVERY == 0:
+                connection.execute("DELETE FROM buckets WHERE updated < ?", (now - self.PRUNE_AFTER,))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return retry_after
+
+
+class RateLimiter:
+    """
+    Per-user read and write budgets on top of a bucket store.
+    budgets: {READ: (tokens per second, burst), WRITE: (tokens per second, burst)}
+    """
+
+    def __init__(self, store, budgets):
+        self.store = store
+        self.budgets = budgets
+
+    def check(self, user_id, kind, cost=1):
+        """
+        Takes cost tokens from the user's bucket for kind.
+        Returns 0 if the request may go ahead, otherwise the seconds to wait before retrying.
+        A store that fails lets the request through: the limiter must not take the service down with it.
+        """
+        rate, burst = self.budgets[kind]
+        try:
+            return self.store.take(f"{kind}:{user_id}", rate, burst, cost)
+        except sqlite3.Error:
+            logger.exception("rate limit store failed; admitting the request")
+            return 0.0
+
+    def stats(self):
+        return {
+            "backend": type(self.store).__name__,
+            "budgets": {kind: {"per_second": rate, "burst": burst} for kind, (rate, burst) in self.budgets.items()},
+        }
+
+
+def create_rate_limiter(spec, budgets, max_keys=100000):
+    """
+    Builds a limiter from a config string: "none" (no limiter, returns None), "memory" or sqlite:///path.
+    As in SQLAlchemy URLs, sqlite:///relative/path is relative and sqlite:////absolute/path absolute.
+    """
+    if not spec or spec == "none":
+        return None
+    if spec == "memory":
+        return RateLimiter(MemoryBuckets(max_keys=max_keys), budgets)
+    if spec.startswith("sqlite:///"):
+        return RateLimiter(SQLiteBuckets(spec[len("sqlite:///"):]), budgets)
+    raise ValueError(f"Unknown rate limit backend: {spec}")
+
+
+class LoadShedder:
+    """
+    Admits a fraction of requests (the admission level, 1.0 when healthy). Each throttle halves it,
+    down to min_level, and it climbs back by recovery_per_second; halving at most once per
+    cooldown seconds keeps one burst of throttled calls from shutting the worker out.
+    """
+
+    def __init__(self, min_level=0.05, recovery_per_second=0.1, cooldown=1.0):
+        self.min_level = min_level
+        self.recovery_per_second = recovery_per_second
+        self.cooldown = cooldown
+        self._level = 1.0
+        self._updated = time.monotonic()
+        self._last_throttle = None
+        self._lock = threading.Lock()
+
+    def level(self):
+        with self._lock:
+            return self._recover(time.monotonic())
+
+    def _recover(self, now):
+        self._level = min(1.0, self._level + (now - self._updated) * self.recovery_per_second)
+        self._updated = now
+        return self._level
+
+    def record_throttle(self):
+        now = time.monotonic()
+        with self._lock:
+            level = self._recover(now)
+            if self._last_throttle is None or now - self._last_throttle >= self.cooldown:
+                self._level = max(self.min_level, level / 2)
+                self._last_throttle = now
+
+    def admit(self):
+        """
+        Returns 0 if the request may go ahead, otherwise the seconds the client should wait.
+        """
+        level = self.level()
+        if level >= 1.0 or random.random() < level:
+            return 0.0
+        return (1.0 - level) / self.recovery_per_second
@@ -2,15 +2,38 @@
 Google Authentication Class to help with authentication of
 the submitted Oauth token.
 """
+import os
+
 import requests
+from requests.adapters import HTTPAdapter
+
+# (connect, read) timeouts in seconds for calls to the Google Oauth API
+GOOGLE_AUTH_TIMEOUT = (float(os.environ.get('GOOGLE_AUTH_CONNECT_TIMEOUT', 3.05)),
+                       float(os.environ.get('GOOGLE_AUTH_READ_TIMEOUT', 5)))
+GOOGLE_AUTH_POOL_SIZE = int(os.environ.get('GOOGLE_AUTH_POOL_SIZE', 10))
+
+
+def _build_session():
+    """
+    A single keep-alive session shared by every request in the process,
+    so calls to Google reuse pooled TLS connections.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=GOOGLE_AUTH_POOL_SIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
 
 
 class GoogleAuth:
     """
     Authenticates an oauth token with the Google API
     """
-    TOKEN_INFO = 'https://www.googleapis.com/oauth2/v1/tokeninfo'
-    USER_INFO = "https://www.googleapis.com/oauth2/v2/userinfo"
+    # overridable so tests and benchmarks can point at a local fake tokeninfo server
+    TOKEN_INFO = os.environ.get('GOOGLE_TOKEN_INFO_URL', 'https://www.googleapis.com/oauth2/v1/tokeninfo')
+    USER_INFO = os.environ.get('GOOGLE_USER_INFO_URL', 'https://www.googleapis.com/oauth2/v2/userinfo')
+
+    session = _build_session()
 
     def validate_token(self, token):
         """
@@ -18,8 +41,8 @@ class GoogleAuth:
         on the token to make sure it is still valid, including checking the
         expiration date).
         """
-        response = requests.get(self.TOKEN_INFO, params={
-                                'access_token': token})
+        response = self.session.get(self.TOKEN_INFO, params={
+                                    'access_token': token}, timeout=GOOGLE_AUTH_TIMEOUT)
         return response.json()
 
     def get_user_information(self, token):
@@ -28,5 +51,5 @@ class GoogleAuth:
         from the Google Oauth API.
         """
         headers = {'Authorization': f'Bearer {token}'}
-        response = requests.get(self.USER_INFO, headers=headers, data={})
+        response = self.session.get(self.USER_INFO, headers=headers, data={}, timeout=GOOGLE_AUTH_TIMEOUT)
         return response.json()
@@ -0,0 +1,230 @@
+"""
+Local verification of Google ID tokens (signed JWTs), so signing in needs no call to Google per request.
+
+Google signs ID tokens with RS256 and publishes its public keys as a JWKS. The keys are fetched
+once and kept for the max-age Google sends with them; a token signed with a key id that is not
+known yet triggers an early refetch (Google rotates its keys), at most once per min_refresh_seconds.
+The JWKS source may be a URL or a local file, so tokens signed with locally generated keys can be
+verified without network access.
+
+Signatures are checked with RSASSA-PKCS1-v1_5 / SHA-256 using only the standard library.
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import logging
+import re
+import threading
+import time
+
+import requests
+
+from middleware.security.google_auth import GoogleAuth, GOOGLE_AUTH_TIMEOUT
+
+logger = logging.getLogger()
+
+GOOGLE_JWKS_URL = 'https://www.googleapis.com/oauth2/v3/certs'
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+# ASN.1 DigestInfo prefix of a SHA-256 digest (RFC 8017, section 9.2)
+_SHA256_DIGEST_INFO = bytes.fromhex('3031300d060960864801650304020105000420')
+
+
+class InvalidIdToken(ValueError):
+    pass
+
+
+def _b64decode(segment):
+    try:
+        return base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4))
+    except (binascii.Error, ValueError):
+        raise InvalidIdToken("malformed token")
+
+
+def _b64int(value):
+    return int.from_bytes(_b64decode(value), 'big')
+
+
+def verify_rs256(public_key, signing_input, signature):
+    """
+    Whether signature is a valid RS256 signature of signing_input under public_key, an (n, e) pair.
+    """
+    n, e = public_key
+    size = (n.bit_length() + 7) // 8
+    if len(signature) != size:
+        return False
+    s = int.from_bytes(signature, 'big')
+    if s >= n:
+        return False
+    encoded = pow(s, e, n).to_bytes(size, 'big')
+    digest = _SHA256_DIGEST_INFO + hashlib.sha256(signing_input).digest()
+    padding = size - len(digest) - 3
+    if padding < 8:
+        return False
+    expected = b'\x00\x01' + b'\xff' * padding + b'\x00' + digest
+    return hmac.compare_digest(encoded, expected)
+
+
+def parse_jwks(jwks):
+    """
+    The RSA signing keys of a JWKS document, as {kid: (n, e)}.
+    """
+    keys = {}
+    for jwk in jwks.get('keys', []):
+        if jwk.get('kty') != 'RSA' or jwk.get('alg', 'RS256') != 'RS256' or jwk.get('use', 'sig') != 'sig':
+            continue
+        try:
+            keys[jwk['kid']] = (_b64int(jwk['n']), _b64int(jwk['e']))
+        except (KeyError, InvalidIdToken):
+            logger.warning(f"skipping malformed JWKS key {jwk.get('kid')}")
+    return keys
+
+
+class JWKSCache:
+    """
+    The signing keys of a JWKS source (an http(s) URL or a file path), fetched when first needed
+    and refreshed after max_age seconds, or the Cache-Control max-age of the response if it has one.
+    If a refresh fails, the keys already known stay in use and the refresh is retried later.
+    """
+
+    def __init__(self, source, max_age=3600, min_refresh_seconds=60):
+        self.source = source
+        self.max_age = max_age
+        self.min_refresh_seconds = min_refresh_seconds
+        self.fetches = 0
+        self._keys = None
+        self._expires = 0.0
+        self._last_fetch = None
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+
+    def _fetch(self):
+        """
+        Returns (jwks, max_age).
+        """
+        if self.source.startswith(('https://', 'http://')):
+            response = GoogleAuth.session.get(self.source, timeout=GOOGLE_AUTH_TIMEOUT)
+            response.raise_for_status()
+            match = re.search(r'max-age=(\d+)', response.headers.get('Cache-Control', ''))
+            return response.json(), int(match.group(1)) if match else self.max_age
+        path = self.source[len('file://'):] if self.source.startswith('file://') else self.source
+        with open(path) as f:
+            return json.load(f), self.max_age
+
+    def _refresh(self, wait=False):
+        """
+        Refetches the keys unless there are keys fetched less than min_refresh_seconds ago, and
+        returns the current keys. The fetch runs outside _lock, so lookups of known keys never wait
+        for it. While one thread fetches, the others keep using the keys they have, unless they wait
+        for the fetch: when there are no keys yet, or wait is set.
+        """
+        if not self._fetch_lock.acquire(blocking=wait or self._keys is None):
+            return self._keys
+        try:
+            now = time.monotonic()
+            with self._lock:
+                if self._keys is not None and now - self._last_fetch < self.min_refresh_seconds:
+                    return self._keys
+                self._last_fetch = now
+            try:
+                jwks, max_age = self._fetch()
+                if not isinstance(jwks, dict):
+                    raise ValueError("not a JWKS document")
+                keys = parse_jwks(jwks)
+            except (requests.RequestException, OSError, ValueError) as err:
+                if self._keys is None:
+                    raise
+                logger.warning(f"JWKS refresh from {self.source} failed, keeping the current keys: {err}")
+                return self._keys
+            with self._lock:
+                self.fetches += 1
+                self._keys = keys
+                self._expires = now + max_age
+            return keys
+        finally:
+            self._fetch_lock.release()
+
+    def get(self, kid):
+        """
+        Returns the public key with key id kid, or None if the source does not have it.
+        Raises requests.RequestException, OSError or ValueError if the keys were never fetched.
+        """
+        with self._lock:
+            keys, expires = self._keys, self._expires
+        if keys is None or time.monotonic() >= expires:
+            keys = self._refresh()
+        if kid not in keys:
+            # a key we have not seen yet: Google may have rotated its keys
+            keys = self._refresh(wait=True)
+        return keys.get(kid)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'source': self.source,
+                'keys': len(self._keys or ()),
+                'fetches': self.fetches,
+                'expires_in': round(max(0.0, self._expires - time.monotonic())) if self._keys is not None else None,
+            }
+
+
+class IdTokenVerifier:
+    """
+    Verifies ID tokens: the RS256 signature against the JWKS, then iss, aud and exp.
+    audiences: the OAuth client ids tokens must be issued to
+    leeway: seconds of clock skew allowed on exp and iat
+    """
+
+    def __init__(self, jwks, audiences, issuers=GOOGLE_ISSUERS, leeway=30):
+        if not audiences:
+            raise ValueError("ID token verification needs at least one audience (OAuth client id)")
+        self.jwks = jwks
+        self.audiences = frozenset(audiences)
+        self.issuers = frozenset(issuers)
+        self.leeway = leeway
+
+    def verify(self, token):
+        """
+        Returns the token's claims. Raises InvalidIdToken if it is not valid, and what JWKSCache.get
+        raises if the keys cannot be fetched.
+        """
+        parts = token.split('.')
+        if len(parts) != 3:
+            raise InvalidIdToken("malformed token")
+        try:
+            header = json.loads(_b64decode(parts[0]))
+            claims = json.loads(_b64decode(parts[1]))
+        except ValueError:
+            raise InvalidIdToken("malformed token")
+        if not isinstance(header, dict) or not isinstance(claims, dict):
+            raise InvalidIdToken("malformed token")
+        if header.get('alg') != 'RS256':
+            raise InvalidIdToken(f"unsupported signing algorithm {header.get('alg')}")
+
+        if not isinstance(header.get('kid'), str):
+            raise InvalidIdToken("token has no key id")
+        key = self.jwks.get(header['kid'])
+        if key is None:
+            raise InvalidIdToken("token signed with an unknown key")
+        if not verify_rs256(key, f'{parts[0]}.{parts[1]}'.encode('ascii'), _b64decode(parts[2])):
+            raise InvalidIdToken("invalid signature")
+
+        if claims.get('iss') not in self.issuers:
+            raise InvalidIdToken("wrong issuer")
+        audiences = claims.get('aud')
+        audiences = audiences if isinstance(audiences, list) else [audiences]
+        if not self.audiences.intersection(a for a in audiences if isinstance(a, str)):
+            raise InvalidIdToken("wrong audience")
+        now = time.time()
+        exp, iat = claims.get('exp'), claims.get('iat', 0)
+        if not isinstance(exp, (int, float)) or not isinstance(iat, (int, float)):
+            raise InvalidIdToken("malformed token")
+        if exp + self.leeway < now:
+            raise InvalidIdToken("token expired")
+        if iat - self.leeway > now:
+            raise InvalidIdToken("token used before it was issued")
+        if not claims.get('sub'):
+            raise InvalidIdToken("token has no subject")
+        return claims
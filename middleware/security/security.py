@@ -2,13 +2,46 @@
 Google Authentication Class to help with authentication of
 the submitted Oauth token.
 """
+import os
+import time
+
+import requests
 from flask import g
 from middleware.security.google_auth import GoogleAuth
+from middleware.security.id_token import IdTokenVerifier, JWKSCache, InvalidIdToken, GOOGLE_JWKS_URL
+from middleware.security.token_cache import TokenValidationCache
+
+LOGIN_NOT_REQUIRED_PATHS = ["health_check", "get_metrics"]
+
+# comma-separated Google user ids allowed to use the /api/admin endpoints
+ADMIN_USER_IDS = {user_id for user_id in os.environ.get("ADMIN_USER_IDS", "").split(",") if user_id}
+
+token_cache = TokenValidationCache(
+    max_entries=int(os.environ.get("TOKEN_CACHE_MAX_ENTRIES", 10000)),
+    max_ttl=int(os.environ.get("TOKEN_CACHE_MAX_TTL", 3600)),
+    negative_ttl=int(os.environ.get("TOKEN_CACHE_NEGATIVE_TTL", 30)),
+)
+
+# How bearer tokens are checked: "tokeninfo" sends OAuth access tokens to Google's tokeninfo endpoint,
+# "id_token" verifies signed Google ID tokens locally against Google's keys (GOOGLE_JWKS_URL, which
+# may also be a local file) and needs the app's OAuth client ids in GOOGLE_CLIENT_IDS.
+AUTH_MODES = ("tokeninfo", "id_token")
+AUTH_MODE = os.environ.get("AUTH_MODE", "tokeninfo")
+if AUTH_MODE not in AUTH_MODES:
+    raise ValueError(f"Unknown AUTH_MODE: {AUTH_MODE}")
 
-LOGIN_NOT_REQUIRED_PATHS = ["health_check"]
+id_token_verifier = IdTokenVerifier(
+    JWKSCache(os.environ.get("GOOGLE_JWKS_URL", GOOGLE_JWKS_URL),
+              max_age=int(os.environ.get("GOOGLE_JWKS_MAX_AGE", 3600)),
+              min_refresh_seconds=int(os.environ.get("GOOGLE_JWKS_MIN_REFRESH_SECONDS", 60))),
+    audiences=[client_id for client_id in os.environ.get("GOOGLE_CLIENT_IDS", "").split(",") if client_id],
+    leeway=int(os.environ.get("ID_TOKEN_LEEWAY_SECONDS", 30)),
+) if AUTH_MODE == "id_token" else None
 
 
 class Security:
+    google_auth = GoogleAuth()
+
     def __init__(self) -> None:
         pass
 
@@ -35,6 +68,10 @@ class Security:
         # validate the token with Google
         access_token = auth_header.split("Bearer ")[1]
         is_valid, validation = cls.is_valid_token(access_token)
+        if not is_valid and validation['error'] == 'unavailable':
+            # Google (or its keys) could not be reached; the token itself may well be valid
+            return {'message': 'Request could not be authenticated, please retry',
+                    'reason': validation['error_description']}, 503
         if not is_valid:
             return {'message': 'Request denied access',
                     'reason': f'Google rejected oauth2 token: {validation["error_description"]}'}, 401
@@ -50,9 +87,47 @@ class Security:
         from the Google Auth API. Determines if the token is valid so that calling function
         does not need to do any additional checks to know the result, but can use the
         error description from the validation provided.
+        Results are cached in token_cache, so a token is only sent to Google once per TTL.
+        With AUTH_MODE=id_token the token is verified locally instead (see is_valid_id_token).
+        """
+        if id_token_verifier is not None:
+            return cls.is_valid_id_token(token)
+
+        cached = token_cache.get(token)
+        if cached is not None:
+            return cached
+
+        try:
+            validation = cls.google_auth.validate_token(token)
+        except (requests.RequestException, ValueError) as err:
+            # transport failures are not the token's fault, so they are not cached
+            return False, {'error': 'unavailable', 'error_description': f'token validation failed: {err}'}
+
+        is_valid = 'error' not in validation.keys()
+        if not is_valid:
+            validation.setdefault('error_description', validation['error'])
+        token_cache.put(token, is_valid, validation)
+        return is_valid, validation
+
+    @classmethod
+    def is_valid_id_token(cls, token):
+        """
+        Verifies a Google ID token's signature, issuer, audience and expiry without calling Google
+        (the signing keys are cached). Returns the same (is_valid, validation) as is_valid_token,
+        with the token's subject as the user_id.
+        """
+        try:
+            claims = id_token_verifier.verify(token)
+        except InvalidIdToken as err:
+            return False, {'error': 'invalid_token', 'error_description': str(err)}
+        except (requests.RequestException, OSError, ValueError) as err:
+            return False, {'error': 'unavailable', 'error_description': f'token validation failed: {err}'}
+        return True, {'user_id': claims['sub'], 'email': claims.get('email'), 'audience': claims['aud'],
+                      'expires_in': int(claims['exp'] - time.time())}
+
+    @classmethod
+    def is_admin(cls):
+        """
+        Whether the user making the current request (as set by verify_token) is an admin.
         """
-        google_auth = GoogleAuth()
-        validation = google_auth.validate_token(token)
-        if 'error' in validation.keys():
-            return False, validation
-        return True, validation
+        return getattr(g, 'google_user_id', None) in ADMIN_USER_IDS
@@ -0,0 +1,85 @@
+"""
+Bounded in-process cache of OAuth token validation results, so repeated
+requests with the same token skip the round trip to Google's tokeninfo endpoint.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenValidationCache:
+    """
+    LRU cache of (is_valid, validation) results keyed by a SHA-256 digest of the token,
+    so raw tokens are never held in memory longer than the request.
+    Valid tokens are cached until the expires_in reported by tokeninfo (capped at max_ttl);
+    rejected tokens are cached for negative_ttl seconds.
+    """
+
+    def __init__(self, max_entries=10000, max_ttl=3600, negative_ttl=30):
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get(self, token):
+        """
+        Returns the cached (is_valid, validation) for the token, or None on a miss.
+        """
+        key = self._key(token)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, token, is_valid, validation):
+        """
+        Stores a validation result. Valid results without a positive expires_in are not cached.
+        """
+        if is_valid:
+            try:
+                ttl = min(int(validation.get('expires_in', 0)), self.max_ttl)
+            except (TypeError, ValueError):
+                ttl = 0
+        else:
+            ttl = self.negative_ttl
+        if ttl <= 0:
+            return
+
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, is_valid, validation)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,86 @@
+"""
+Tests of create_tables (database_services/dynamodb_schema.py) against a stubbed DynamoDB client.
+
+    $ python -m unittest discover -s tests -t .
+"""
+import unittest
+from unittest import mock
+
+import boto3
+from botocore.stub import ANY, Stubber
+
+from database_services import dynamodb_schema
+from database_services.dynamodb_schema import COMMENT_TABLE, COMMENT_TABLE_NAME, ITEM_INDEX, \
+    COMMENTER_INDEX_NAME, CHANGES_INDEX_NAME, TIME_TO_LIVE, TTL_ATTRIBUTE
+
+
+def table(name, status='ACTIVE', indexes=()):
+    description = {'TableName': name, 'TableStatus': status}
+    if indexes:
+        description['GlobalSecondaryIndexes'] = [{'IndexName': index, 'IndexStatus': index_status}
+                                                 for index, index_status in indexes]
+    return {'Table': description}
+
+
+class CreateTablesTest(unittest.TestCase):
+    def setUp(self):
+        self.dynamodb = boto3.resource('dynamodb', region_name='us-east-1', aws_access_key_id='test',
+                                       aws_secret_access_key='test')
+        self.stubber = Stubber(self.dynamodb.meta.client)
+        self.addCleanup(self.stubber.deactivate)
+        patch = mock.patch.object(dynamodb_schema.time, 'sleep')
+        self.sleep = patch.start()
+        self.addCleanup(patch.stop)
+
+    def describe(self, response, name=COMMENT_TABLE_NAME):
+        self.stubber.add_response('describe_table', response, {'TableName': name})
+
+    def create_index(self, index_name):
+        self.stubber.add_response('update_table', {}, {
+            'TableName': COMMENT_TABLE_NAME,
+            'AttributeDefinitions': ANY,
+            'GlobalSecondaryIndexUpdates': [{'Create': next(
+                index for index in COMMENT_TABLE['GlobalSecondaryIndexes'] if index['IndexName'] == index_name)}],
+        })
+
+    def other_tables_exist(self):
+        for definition in dynamodb_schema.TABLES[1:]:
+            self.describe(table(definition['TableName']), definition['TableName'])
+        for name in TIME_TO_LIVE:
+            self.describe(table(name), name)
+            self.stubber.add_response('describe_time_to_live',
+                                      {'TimeToLiveDescription': {'TimeToLiveStatus': 'ENABLED',
+                                                                 'AttributeName': TTL_ATTRIBUTE}},
+                                      {'TableName': name})
+
+    def test_adds_missing_indexes_one_at_a_time(self):
+        item_index = ITEM_INDEX['IndexName']
+        self.describe(table(COMMENT_TABLE_NAME, indexes=[(item_index, 'ACTIVE')]))
+        # before the first index: nothing is building
+        self.describe(table(COMMENT_TABLE_NAME, indexes=[(item_index, 'ACTIVE')]))
+        self.create_index(COMMENTER_INDEX_NAME)
+        # before the second: the first is still building, twice, then done
+        self.describe(table(COMMENT_TABLE_NAME, 'UPDATING', [(item_index, 'ACTIVE'), (COMMENTER_INDEX_NAME, 'CREATING')]))
+        self.describe(table(COMMENT_TABLE_NAME, 'ACTIVE', [(item_index, 'ACTIVE'), (COMMENTER_INDEX_NAME, 'CREATING')]))
+        self.describe(table(COMMENT_TABLE_NAME, indexes=[(item_index, 'ACTIVE'), (COMMENTER_INDEX_NAME, 'ACTIVE')]))
+        self.create_index(CHANGES_INDEX_NAME)
+        self.other_tables_exist()
+
+        with self.stubber:
+            dynamodb_schema.create_tables(self.dynamodb, poll_seconds=5)
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(self.sleep.call_args_list, [mock.call(5), mock.call(5)])
+
+    def test_complete_table_is_left_alone(self):
+        self.describe(table(COMMENT_TABLE_NAME, indexes=[(index['IndexName'], 'ACTIVE')
+                                                         for index in COMMENT_TABLE['GlobalSecondaryIndexes']]))
+        self.other_tables_exist()
+
+        with self.stubber:
+            dynamodb_schema.create_tables(self.dynamodb)
+        self.stubber.assert_no_pending_responses()
+        self.sleep.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,245 @@
+"""
+Tests of local ID token verification (middleware/security/id_token.py) with RSA keys generated
+here and a JWKS file in a temporary directory.
+
+    $ python -m unittest discover -s tests -t .
+"""
+import base64
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from middleware.security.id_token import IdTokenVerifier, InvalidIdToken, JWKSCache, verify_rs256
+
+AUDIENCE = 'client-1.apps.googleusercontent.com'
+_rng = random.SystemRandom()
+
+
+def _is_probable_prime(n, rounds=32):
+    if n < 2:
+        return False
+    for p in (2, 3, 5, 7, 11, 13, 17, 19, 23, 29):
+        if n % p == 0:
+            return n == p
+    d, r = n - 1, 0
+    while d % 2 == 0:
+        d, r = d // 2, r + 1
+    for _ in range(rounds):
+        x = pow(_rng.randrange(2, n - 1), d, n)
+        if x in (1, n - 1):
+            continue
+        for _ in range(r - 1):
+            x = pow(x, 2, n)
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def _prime(bits):
+    while True:
+        candidate = _rng.getrandbits(bits) | (1 << (bits - 1)) | 1
+        if _is_probable_prime(candidate):
+            return candidate
+
+
+def make_rsa_key(bits=1024):
+    """
+    Returns (n, e, d) of a new RSA key.
+    """
+    e = 65537
+    while True:
+        p, q = _prime(bits // 2), _prime(bits // 2)
+        phi = (p - 1) * (q - 1)
+        if p != q and phi % e:
+            return p * q, e, pow(e, -1, phi)
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def _int_b64(value):
+    return _b64(value.to_bytes((value.bit_length() + 7) // 8, 'big'))
+
+
+def jwk(kid, key):
+    n, e, _ = key
+    return {'kty': 'RSA', 'alg': 'RS256', 'use': 'sig', 'kid': kid, 'n': _int_b64(n), 'e': _int_b64(e)}
+
+
+def sign(key, kid, claims, alg='RS256'):
+    """
+    An RS256 JWT of claims (RSASSA-PKCS1-v1_5 with SHA-256).
+    """
+    n, _, d = key
+    signing_input = f"{_b64(json.dumps({'alg': alg, 'kid': kid, 'typ': 'JWT'}).encode())}." \
+                    f"{_b64(json.dumps(claims).encode())}"
+    size = (n.bit_length() + 7) // 8
+    digest = bytes.fromhex('3031300d060960864801650304020105000420') + \
+        hashlib.sha256(signing_input.encode('ascii')).digest()
+    encoded = b'\x00\x01' + b'\xff' * (size - len(digest) - 3) + b'\x00' + digest
+    signature = pow(int.from_bytes(encoded, 'big'), d, n).to_bytes(size, 'big')
+    return f'{signing_input}.{_b64(signature)}'
+
+
+def claims(**overrides):
+    now = int(time.time())
+    return {'iss': 'https://accounts.google.com', 'aud': AUDIENCE, 'sub': '1234567890',
+            'email': 'artist@example.com', 'iat': now, 'exp': now + 600, **overrides}
+
+
+class IdTokenTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.key1 = make_rsa_key()
+        cls.key2 = make_rsa_key()
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.jwks_path = os.path.join(self.dir.name, 'jwks.json')
+        self.write_jwks(k1=self.key1)
+        self.jwks = JWKSCache(self.jwks_path, max_age=3600, min_refresh_seconds=60)
+        self.verifier = IdTokenVerifier(self.jwks, [AUDIENCE])
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write_jwks(self, **keys):
+        with open(self.jwks_path, 'w') as f:
+            json.dump({'keys': [jwk(kid, key) for kid, key in keys.items()]}, f)
+
+    def assertRejected(self, token, reason):
+        with self.assertRaises(InvalidIdToken) as caught:
+            self.verifier.verify(token)
+        self.assertEqual(str(caught.exception), reason)
+
+
+class VerifyTest(IdTokenTestCase):
+    def test_valid_token(self):
+        verified = self.verifier.verify(sign(self.key1, 'k1', claims()))
+        self.assertEqual(verified['sub'], '1234567890')
+        self.assertEqual(verified['email'], 'artist@example.com')
+
+    def test_audience_list(self):
+        self.verifier.verify(sign(self.key1, 'k1', claims(aud=['other', AUDIENCE])))
+
+    def test_tampered_signature(self):
+        header, payload, signature = sign(self.key1, 'k1', claims()).split('.')
+        raw = bytearray(base64.urlsafe_b64decode(signature + '=' * (-len(signature) % 4)))
+        raw[-1] ^= 1
+        self.assertRejected(f'{header}.{payload}.{_b64(bytes(raw))}', 'invalid signature')
+
+    def test_tampered_claims(self):
+        header, _, signature = sign(self.key1, 'k1', claims()).split('.')
+        payload = _b64(json.dumps(claims(sub='someone-else')).encode())
+        self.assertRejected(f'{header}.{payload}.{signature}', 'invalid signature')
+
+    def test_signed_with_another_key(self):
+        self.assertRejected(sign(self.key2, 'k1', claims()), 'invalid signature')
+
+    def test_wrong_audience(self):
+        self.assertRejected(sign(self.key1, 'k1', claims(aud='another-client')), 'wrong audience')
+
+    def test_wrong_issuer(self):
+        self.assertRejected(sign(self.key1, 'k1', claims(iss='https://evil.example.com')), 'wrong issuer')
+
+    def test_expired(self):
+        self.assertRejected(sign(self.key1, 'k1', claims(exp=int(time.time()) - 120)), 'token expired')
+
+    def test_expiry_leeway(self):
+        self.verifier.verify(sign(self.key1, 'k1', claims(exp=int(time.time()) - 5)))
+
+    def test_missing_subject(self):
+        token_claims = claims()
+        del token_claims['sub']
+        self.assertRejected(sign(self.key1, 'k1', token_claims), 'token has no subject')
+
+    def test_other_algorithm(self):
+        self.assertRejected(sign(self.key1, 'k1', claims(), alg='HS256'), 'unsupported signing algorithm HS256')
+
+    def test_malformed(self):
+        for token in ('', 'abc', 'a.b.c', 'a.b'):
+            self.assertRejected(token, 'malformed token')
+
+    def test_verify_rs256_rejects_wrong_length(self):
+        n, e, _ = self.key1
+        self.assertFalse(verify_rs256((n, e), b'data', b'\x01' * 10))
+
+
+class JWKSCacheTest(IdTokenTestCase):
+    def test_keys_are_fetched_once(self):
+        for _ in range(3):
+            self.verifier.verify(sign(self.key1, 'k1', claims()))
+        self.assertEqual(self.jwks.fetches, 1)
+
+    def test_unknown_kid_refreshes_the_keys(self):
+        self.verifier.verify(sign(self.key1, 'k1', claims()))
+        self.write_jwks(k1=self.key1, k2=self.key2)
+        self.jwks.min_refresh_seconds = 0
+        self.verifier.verify(sign(self.key2, 'k2', claims()))
+        self.assertEqual(self.jwks.fetches, 2)
+
+    def test_unknown_kid_refresh_is_rate_limited(self):
+        self.verifier.verify(sign(self.key1, 'k1', claims()))
+        self.write_jwks(k1=self.key1, k2=self.key2)
+        # fetched less than min_refresh_seconds ago, so k2 is not looked for yet
+        self.assertRejected(sign(self.key2, 'k2', claims()), 'token signed with an unknown key')
+        self.assertRejected(sign(self.key2, 'k3', claims()), 'token signed with an unknown key')
+        self.assertEqual(self.jwks.fetches, 1)
+
+        with mock.patch('middleware.security.id_token.time.monotonic', return_value=time.monotonic() + 61):
+            self.verifier.verify(sign(self.key2, 'k2', claims()))
+        self.assertEqual(self.jwks.fetches, 2)
+
+    def test_failed_refresh_keeps_the_current_keys(self):
+        self.verifier.verify(sign(self.key1, 'k1', claims()))
+        with open(self.jwks_path, 'w') as f:
+            f.write('not json')
+        self.jwks.max_age = 0
+        self.jwks._expires = 0.0
+        self.jwks.min_refresh_seconds = 0
+        with self.assertLogs(level='WARNING'):
+            self.verifier.verify(sign(self.key1, 'k1', claims()))
+        self.assertEqual(self.jwks.fetches, 1)
+
+    def test_first_fetch_failure_raises(self):
+        os.remove(self.jwks_path)
+        with self.assertRaises(OSError):
+            self.verifier.verify(sign(self.key1, 'k1', claims()))
+
+    def test_lookups_do_not_wait_for_a_refresh(self):
+        self.verifier.verify(sign(self.key1, 'k1', claims()))
+        fetching, release = threading.Event(), threading.Event()
+        fetch = self.jwks._fetch
+
+        def slow_fetch():
+            fetching.set()
+            release.wait(5)
+            return fetch()
+
+        self.jwks._fetch = slow_fetch
+        self.jwks._expires = 0.0
+        self.jwks.min_refresh_seconds = 0
+        refresh = threading.Thread(target=self.jwks.get, args=('k1',))
+        refresh.start()
+        try:
+            self.assertTrue(fetching.wait(5))
+            start = time.monotonic()
+            self.verifier.verify(sign(self.key1, 'k1', claims()))
+            self.assertLess(time.monotonic() - start, 1)
+        finally:
+            release.set()
+            refresh.join()
+        self.assertEqual(self.jwks.fetches, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+Tests of OAuth token validation (middleware/security/security.py) and its token cache
+against the local fake tokeninfo server.
+
+    $ python -m unittest discover -s tests -t .
+"""
+import time
+import unittest
+from unittest import mock
+
+from flask import Flask, g, request
+
+from benchmarks.fake_tokeninfo import FakeTokenInfoServer
+from middleware.security import security
+from middleware.security.google_auth import GoogleAuth
+from middleware.security.security import Security
+from middleware.security.token_cache import TokenValidationCache
+
+
+class TokenInfoTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tokeninfo = FakeTokenInfoServer(expires_in=120).start()
+        self.addCleanup(self.tokeninfo.stop)
+        self.cache = TokenValidationCache(max_entries=100, max_ttl=3600, negative_ttl=30)
+        for patch in (mock.patch.object(security, 'token_cache', self.cache),
+                      mock.patch.object(security, 'id_token_verifier', None),
+                      mock.patch.object(GoogleAuth, 'TOKEN_INFO', self.tokeninfo.url)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def unreachable(self):
+        """
+        Points validation at a port nothing listens on.
+        """
+        server = FakeTokenInfoServer()
+        url = server.url
+        server.server.server_close()
+        return mock.patch.object(GoogleAuth, 'TOKEN_INFO', url)
+
+
+class TokenCacheTest(TokenInfoTestCase):
+    def test_valid_token_is_cached(self):
+        Security.is_valid_token('valid-u1')
+        is_valid, validation = Security.is_valid_token('valid-u1')
+        self.assertTrue(is_valid)
+        self.assertEqual(validation['user_id'], 'u1')
+        self.assertEqual(self.tokeninfo.calls, 1)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_rejected_token_is_cached(self):
+        for _ in range(2):
+            is_valid, validation = Security.is_valid_token('bogus')
+            self.assertFalse(is_valid)
+            self.assertEqual(validation['error_description'], 'Invalid Value')
+        self.assertEqual(self.tokeninfo.calls, 1)
+
+    def test_transport_error_is_not_cached(self):
+        with self.unreachable():
+            for _ in range(2):
+                is_valid, validation = Security.is_valid_token('valid-u1')
+                self.assertFalse(is_valid)
+                self.assertEqual(validation['error'], 'unavailable')
+        self.assertEqual(self.cache.stats()['entries'], 0)
+        self.assertEqual(Security.is_valid_token('valid-u1')[0], True)
+        self.assertEqual(self.tokeninfo.calls, 1)
+
+    def test_entries_expire(self):
+        Security.is_valid_token('valid-u1')
+        Security.is_valid_token('bogus')
+        later = time.monotonic() + 31
+        with mock.patch('middleware.security.token_cache.time.monotonic', return_value=later):
+            # the rejection expired after negative_ttl, the valid token is kept for its expires_in
+            Security.is_valid_token('bogus')
+            Security.is_valid_token('valid-u1')
+            self.assertEqual(self.tokeninfo.calls, 3)
+        with mock.patch('middleware.security.token_cache.time.monotonic', return_value=later + 90):
+            Security.is_valid_token('valid-u1')
+        self.assertEqual(self.tokeninfo.calls, 4)
+
+
+class VerifyTokenTest(TokenInfoTestCase):
+    def verify(self, token):
+        app = Flask(__name__)
+        with app.test_request_context('/api/comments', headers={'Authorization': f'Bearer {token}'}):
+            return Security.verify_token(request), getattr(g, 'google_user_id', None)
+
+    def test_valid_token(self):
+        self.assertEqual(self.verify('valid-u1'), (None, 'u1'))
+
+    def test_rejected_token_is_401(self):
+        (body, status), _ = self.verify('bogus')
+        self.assertEqual(status, 401)
+
+    def test_unreachable_google_is_503(self):
+        with self.unreachable():
+            (body, status), _ = self.verify('valid-u1')
+        self.assertEqual(status, 503)
+
+
+if __name__ == '__main__':
+    unittest.main()